@@ -3,8 +3,12 @@
 # Hopefully it will result in something meaningful
 #
 # ver 2015-4-20
+#
+# Files of spectral field collectors (add-dft-fields, see gen.ini.canonical) contain 
+# the amplitudes at the frequencies already, they are plotted without the time analysis
 
 import numpy
+import re
 from scipy import fft, arange
 #import cmath 
 #import pandas # for reading/writing csv
@@ -19,6 +23,8 @@ parser.add_argument('--text', action='store_true', help = 'Set for not showing g
 parser.add_argument('--time', action='store_true', help = 'Show time dependency')
 parser.add_argument('--spectrum', action='store_true', help = 'Show spectrum')
 parser.add_argument('--out', default = None, help = 'Outputs relative phases into a dat file')
+parser.add_argument('--freq', nargs = 3, type = float, default = None, metavar = ('CENTER', 'WIDTH', 'POINTS'),
+		help = 'The frequencies of the DFT files (as in the property of the collector)')
 parser.add_argument('datfile', nargs='+')
 args = parser.parse_args()
 
@@ -37,6 +43,74 @@ try:
 except IOError :
 	sys.exit("File couldn't be open. Wrong name?")
 
+def read_dft(f) :
+	# Returns the amplitudes of the DFT file (datasets <component>_<n>.r, .i 
+	# of the frequencies n) or None if it's not one
+	names = [re.match(r'^([eh][xyzrp])_(\d+)\.r$', name) for name in f.keys()]
+	names = [match for match in names if match]
+	if len(names) == 0 :
+		return None
+	component = names[0].group(1)
+	num = len([match for match in names if match.group(1) == component])
+	return numpy.array([numpy.ravel(f['%s_%s.r' % (component, n)][()])[0] + 
+		1j*numpy.ravel(f['%s_%s.i' % (component, n)][()])[0] for n in range(num)])
+
+def plot_spectra(data_freq, data_spec) :
+	# amplitudes and phases of the spectra and their ratios to the first one
+	f5, ax5 = plt.subplots()
+	f6, ax6 = plt.subplots()
+	f7, ax7 = plt.subplots()
+	f8, ax8 = plt.subplots()
+
+	data_sp_phase = numpy.angle(data_spec)
+
+	listobs = []
+	for i in range(num_files) :
+		ax5.plot(data_freq, abs(data_spec[i,:]))
+		ax6.plot(data_freq, data_sp_phase[i,:])
+		listobs.append('Port: %s' % i)
+	ax5.legend(listobs, loc = 'upper left')
+	f5.suptitle('Amplitude spectrum')
+	ax6.legend(listobs, loc = 'upper left')
+	f6.suptitle('Phase spectrum')
+
+	listobs = []
+	for i in range(1, num_files) :
+		ax7.plot(data_freq, abs(data_spec[i,:]/data_spec[0,:]))
+		ax8.plot(data_freq, 
+			numpy.sin(data_sp_phase[i,:] - data_sp_phase[0,:]), '.-')
+		listobs.append('F_%s/F_0: ' % i)
+	ax7.legend(listobs, loc = 'upper left')
+	f7.suptitle('Ratio of spectral amplitudes')
+	ax8.legend(listobs, loc = 'upper left')
+	f8.suptitle('Phase difference')
+
+	if args.out != None :
+		numpy.savetxt(args.out, data_sp_phase[1,:] - data_sp_phase[0,:])
+
+	f5.savefig('abs_spectrum.png', bbox_inches= 'tight')
+	f6.savefig('phase_spectrum.png', bbox_inches= 'tight')
+	f7.savefig('ratio_ampl_spectrum.png', bbox_inches= 'tight')
+	f8.savefig('rel_phase_spectrum.png', bbox_inches= 'tight')
+
+dft = [read_dft(fdata[i]) for i in range(num_files)]
+if any(spec is not None for spec in dft) :
+	if any(spec is None for spec in dft) or len(set(len(spec) for spec in dft)) > 1 :
+		sys.exit('Data is inconsistent')
+	data_spec = numpy.array(dft)
+	num_freqs = data_spec.shape[1]
+	if args.freq != None :
+		# add-dft-fields spreads the points over center -+ width/2
+		data_freq = numpy.linspace(args.freq[0] - args.freq[1]/2.0, args.freq[0] + args.freq[1]/2.0, num_freqs)
+	else :
+		print "The frequencies are not given (--freq), the numbers of the points are used"
+		data_freq = numpy.arange(num_freqs)
+	print "DFT files, %s frequencies" % num_freqs
+	plot_spectra(data_freq, data_spec)
+	if not args.text: 
+		plt.show()
+	sys.exit(0)
+
 # Check input files and extract names of the datasets
 dsets = []
 data_size = None
@@ -97,11 +171,6 @@ if args.time :
 	#f4.savefig('phase_rel.png', bbox_inches= 'tight')
 
 if args.spectrum :
-	f5, ax5 = plt.subplots()
-	f6, ax6 = plt.subplots()
-	f7, ax7 = plt.subplots()
-	f8, ax8 = plt.subplots()
-
 	def trans(y):
 		n1 = int(numpy.log2(len(y))) + 2
 		Nlarge = 2**n1
@@ -138,36 +207,7 @@ if args.spectrum :
 	data_spec = numpy.squeeze(data_spectrum[:,spw])
 	data_spec = data_spec[:,perm]
 	data_freq = data_freq[perm]
-	data_sp_phase = numpy.angle(data_spec)
-
-	listobs = []
-	for i in range(num_files) :
-		ax5.plot(data_freq, abs(data_spec[i,:]))
-		ax6.plot(data_freq, data_sp_phase[i,:])
-		listobs.append('Port: %s' % i)
-	ax5.legend(listobs, loc = 'upper left')
-	f5.suptitle('Amplitude spectrum')
-	ax6.legend(listobs, loc = 'upper left')
-	f6.suptitle('Phase spectrum')
-
-	listobs = []
-	for i in range(1, num_files) :
-		ax7.plot(data_freq, abs(data_spec[i,:]/data_spec[0,:]))
-		ax8.plot(data_freq, 
-			numpy.sin(data_sp_phase[i,:] - data_sp_phase[0,:]), '.-')
-		listobs.append('F_%s/F_0: ' % i)
-	ax7.legend(listobs, loc = 'upper left')
-	f7.suptitle('Ratio of spectral amplitudes')
-	ax8.legend(listobs, loc = 'upper left')
-	f8.suptitle('Phase difference')
-
-	if args.out != None :
-		numpy.savetxt(args.out, data_sp_phase[1,:] - data_sp_phase[0,:])
-
-	f5.savefig('abs_spectrum.png', bbox_inches= 'tight')
-	f6.savefig('phase_spectrum.png', bbox_inches= 'tight')
-	f7.savefig('ratio_ampl_spectrum.png', bbox_inches= 'tight')
-	f8.savefig('rel_phase_spectrum.png', bbox_inches= 'tight')
+	plot_spectra(data_freq, data_spec)
 
 if not args.text: 
 	plt.show()
\ No newline at end of file
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# Benchmarks of the translator (gentri3.py) on synthetic meta-configurations
+#
+# The structures are rows of lines positioned relative to each other. The suites scale
+#   lines       - the number of lines (3 periods each)
+#   periods     - the number of long lines (30 periods each)
+#   connectors  - lines and connectors between the rows (a third of the elements)
+#   overlap     - parallel lines of neighbouring rows are close and shifted, so every
+#                 line conflicts with its neighbours and is cut (settleConflicts)
+# Sources and collectors are taken from gen.ini.canonical.
+#
+# Usage:
+#   benchtri3.py run [--suites ...] [--sizes 10 100 ...] [-o results.json] [--baseline base.json]
+#   benchtri3.py compare results.json base.json
+#   benchtri3.py generate SUITE SIZE out.ini
+#
+# The results are kept as JSON (one record per case: wall and CPU time of the best of
+# --repeat translations, the peak memory traced by tracemalloc in a separate translation,
+# the size of the control file). The comparison flags the cases slower or larger than
+# the baseline by more than --threshold, the exit code is 1 then
+
+import os
+import sys
+import copy
+import math
+import time
+import json
+import platform
+import tempfile
+import tracemalloc
+import yaml
+
+import gentri3
+
+SUITES = ('lines', 'periods', 'connectors', 'overlap')
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+# the vertical distances between the rows of lines in the canonical property:
+# far enough and close enough to make the paddings overlap (but not the lines)
+ROW_SPACING = 8
+CLOSE_SPACING = 5
+# between the lines of a row with connectors
+GAP = 2
+
+def canonical() :
+    script_path, _ = os.path.split(os.path.realpath(__file__))
+    with open(os.path.join(script_path, 'gen.ini.canonical'), "r") as f :
+        return yaml.load(f, Loader = gentri3.YAMLLoader)
+
+def synthetic_config(suite, size, base = None) :
+    # Returns the meta-configuration (dictionary) of the suite with size elements
+    config = copy.deepcopy(canonical() if base == None else base)
+    geometry = config['Geometry']
+    prop = geometry['elements'][0]['line']['property']
+    periods = 30 if suite == 'periods' else 3
+
+    numConnectors = size//3 if suite == 'connectors' else 0
+    numLines = size - numConnectors
+    perRow = max(int(math.ceil(math.sqrt(numLines))), 1)
+    numConnectors = min(numConnectors, max(numLines - perRow, 0))
+    numLines = size - numConnectors
+
+    def name(row, col) :
+        return "l%s-%s" % (row, col)
+
+    elements = []
+    for num in range(numLines) :
+        row, col = divmod(num, perRow)
+        if num == 0 :
+            start = {'x' : 0, 'y' : 0, 'skip' : 0}
+        elif col == 0 :
+            # the rows go up, in the overlap suite every second row is close to the previous
+            # one and shifted by half a line
+            close = suite == 'overlap' and row % 2 == 1
+            start = {'ref' : name(row - 1, 0), 'point' : 'start',
+                     'x' : 0.5*periods*prop['grooves']['period'] if close else 0,
+                     'y' : CLOSE_SPACING if close else ROW_SPACING}
+        elif suite == 'connectors' :
+            start = {'ref' : name(row, col - 1), 'point' : 'end', 'x' : GAP, 'y' : 0}
+        else :
+            start = {'attached_to' : name(row, col - 1), 'point' : 'end'}
+        elements.append({'line' : {'id' : name(row, col), 'start' : start,
+                                   'end' : {'periods' : periods, 'x' : 0.4, 'y' : 0},
+                                   'property' : prop}})
+
+    # the connectors join the ends of the lines of neighbouring rows, column by column
+    pairs = [(row, col) for col in range(perRow) for row in range(numLines//perRow + 1)
+             if (row + 1)*perRow + col < numLines]
+    for num, (row, col) in enumerate(pairs[:numConnectors]) :
+        elements.append({'connector' : {'id' : "c%s" % num,
+                                        'start' : {'attached_to' : name(row, col), 'point' : 'end'},
+                                        'end' : {'attached_to' : name(row + 1, col), 'point' : 'end'},
+                                        'property' : prop}})
+    geometry['elements'] = elements
+
+    # sources at the first line, collectors at the last one
+    first, last = name(0, 0), name(*divmod(numLines - 1, perRow))
+    for source in config['Sources'] :
+        source['source']['position']['ref'] = first
+    # (every collector with a position: fluxes, spectral and temporal fields; the others,
+    # as snapshots, are kept as they are)
+    for kind in ('spectral', 'temporal') :
+        for obs in config['Collectors'].get(kind) or [] :
+            for value in dict(obs).values() :
+                if isinstance(value, dict) and isinstance(value.get('position'), dict) :
+                    value['position']['ref'] = last
+    config['Output']['ctl_file'] = {'default' : True}
+    return config
+
+def run_case(suite, size, rcData, repeat = 1, base = None) :
+    # Translates the synthetic configuration (written to a file, so parsing is included)
+    # and returns the record of the case
+    config = synthetic_config(suite, size, base)
+    fd, iniFileName = tempfile.mkstemp(suffix = ".ini", prefix = "bench-")
+    try :
+        with os.fdopen(fd, "w") as f :
+            yaml.safe_dump(config, f)
+
+        wall, cpu = [], []
+        for num in range(repeat) :
+            startWall, startCpu = time.perf_counter(), time.process_time()
+            text, diagnostics = gentri3.translate(iniFileName, rcData)
+            wall.append(time.perf_counter() - startWall)
+            cpu.append(time.process_time() - startCpu)
+            if text == None :
+                break
+
+        peak = None
+        if text != None :
+            del text
+            tracemalloc.start()
+            text, diagnostics = gentri3.translate(iniFileName, rcData)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally :
+        os.remove(iniFileName)
+
+    record = {
+        'case' : "%s-%s" % (suite, size),
+        'suite' : suite,
+        'elements' : size,
+        'wall_s' : round(min(wall), 6),
+        'cpu_s' : round(min(cpu), 6),
+    }
+    if text == None :
+        record['errors'] = [str(error[1]) for error in diagnostics['errors']]
+    else :
+        record['peak_mb'] = round(peak/2.0**20, 3)
+        record['ctl_bytes'] = len(text)
+    return record
+
+def run(suites, sizes, rcFileName = None, repeat = 3, maxTime = None) :
+    # runs the cases, the larger sizes of the suite are skipped once a case takes more
+    # than maxTime seconds
+    rcData = gentri3.genResource(rcFileName)
+    if not rcData.isValid :
+        sys.exit("Fatal error: The resource file is corrupted!")
+    base = canonical()
+    records = []
+    for suite in suites :
+        for size in sorted(sizes) :
+            record = run_case(suite, size, rcData, repeat, base)
+            records.append(record)
+            print("%-20s %10.3f s %10.3f s CPU %10s MB %s"
+                  % (record['case'], record['wall_s'], record['cpu_s'], record.get('peak_mb', '-'),
+                     "FAILED: " + "; ".join(record['errors']) if 'errors' in record else ""))
+            if maxTime != None and record['wall_s'] > maxTime :
+                print("%s: larger sizes are skipped" % suite)
+                break
+    return {
+        'version' : gentri3.VERSION,
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'date' : time.strftime("%Y-%m-%d %H:%M:%S"),
+        'repeat' : repeat,
+        'cases' : records,
+    }
+
+def scaling(results) :
+    # the exponents of the time of every suite between its smallest and largest cases
+    res = {}
+    for suite in SUITES :
+        cases = [case for case in results['cases'] if case['suite'] == suite and not 'errors' in case]
+        if len(cases) < 2 :
+            continue
+        first, last = min(cases, key = lambda case : case['elements']), max(cases, key = lambda case : case['elements'])
+        if first['wall_s'] > 0 and last['elements'] > first['elements'] :
+            res[suite] = math.log(last['wall_s']/first['wall_s'])/math.log(float(last['elements'])/first['elements'])
+    return res
+
+def compare(results, baseline, threshold = 0.25, minTime = 0.01) :
+    # Returns the list of regressions: cases failing now, slower (by more than threshold
+    # and minTime seconds) or using more memory than in the baseline
+    baseCases = dict((case['case'], case) for case in baseline['cases'])
+    regressions = []
+    for case in results['cases'] :
+        base = baseCases.get(case['case'])
+        if base == None :
+            continue
+        if 'errors' in case and not 'errors' in base :
+            regressions.append((case['case'], 'fails'))
+            continue
+        if 'errors' in case or 'errors' in base :
+            continue
+        if case['wall_s'] > base['wall_s']*(1 + threshold) and case['wall_s'] - base['wall_s'] > minTime :
+            regressions.append((case['case'], 'time %.3f s instead of %.3f s' % (case['wall_s'], base['wall_s'])))
+        if case['peak_mb'] > base['peak_mb']*(1 + threshold) :
+            regressions.append((case['case'], 'memory %.1f MB instead of %.1f MB' % (case['peak_mb'], base['peak_mb'])))
+    return regressions
+
+def report(results, baseline = None, threshold = 0.25) :
+    # prints the scaling and the regressions, returns the number of the latter
+    for suite, exponent in sorted(scaling(results).items()) :
+        print("Scaling of %s: time ~ N^%.2f" % (suite, exponent))
+    if baseline == None :
+        return 0
+    regressions = compare(results, baseline, threshold)
+    for case, what in regressions :
+        print("REGRESSION %s: %s" % (case, what))
+    print("%s regressions against the baseline of %s" % (len(regressions), baseline['date']))
+    return len(regressions)
+
+if __name__ == "__main__" :
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices = ['run', 'compare', 'generate'])
+    parser.add_argument('args', nargs = '*',
+                        help = 'compare: RESULTS BASELINE, generate: SUITE SIZE INI')
+    parser.add_argument('-r', default = None, help = 'The resource file')
+    parser.add_argument('--suites', nargs = '+', default = list(SUITES), choices = SUITES)
+    parser.add_argument('--sizes', nargs = '+', type = int, default = list(DEFAULT_SIZES),
+                        help = 'The numbers of elements (default: %s)' % " ".join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument('--repeat', type = int, default = 3, help = 'The best time of the translations is taken')
+    parser.add_argument('--max-time', type = float, default = None,
+                        help = 'Skip the larger sizes of the suite once a case takes longer (in seconds)')
+    parser.add_argument('-o', default = None, metavar = 'JSON', help = 'Write the results to the file')
+    parser.add_argument('--baseline', default = None, metavar = 'JSON', help = 'Compare the results against the file')
+    parser.add_argument('--threshold', type = float, default = 0.25,
+                        help = 'The relative increase of time or memory considered a regression')
+    args = parser.parse_args()
+
+    if args.command == 'generate' :
+        if len(args.args) != 3 or not args.args[0] in SUITES :
+            sys.exit("generate SUITE SIZE INI, the suites: %s" % ", ".join(SUITES))
+        with open(args.args[2], "w") as f :
+            yaml.safe_dump(synthetic_config(args.args[0], int(args.args[1])), f)
+    elif args.command == 'compare' :
+        if len(args.args) != 2 :
+            sys.exit("compare RESULTS BASELINE")
+        with open(args.args[0], "r") as f :
+            results = json.load(f)
+        with open(args.args[1], "r") as f :
+            baseline = json.load(f)
+        sys.exit(1 if report(results, baseline, args.threshold) > 0 else 0)
+    else :
+        results = run(args.suites, args.sizes, args.r, args.repeat, args.max_time)
+        if args.o != None :
+            with open(args.o, "w") as f :
+                json.dump(results, f, indent = 2)
+            print("The results are written to: %s" % args.o)
+        baseline = None
+        if args.baseline != None :
+            with open(args.baseline, "r") as f :
+                baseline = json.load(f)
+        sys.exit(1 if report(results, baseline, args.threshold) > 0 else 0)
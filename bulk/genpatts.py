@@ -22,6 +22,9 @@
 # The command producing particular meta-configuration file is 
 #
 # sed -e "s/\${var1}/val1/" -e "s/\${var2}/val2/" ... initial.patt > conf.number
+#
+# sweeptri3.py (next to gentri3.py) takes the same ranges (--vert, --term, --middle, --freq)
+# and translates all points in one go instead
 
 import argparse
 parser = argparse.ArgumentParser()
@@ -133,6 +136,8 @@ with open(outFileName, "w") as outfile, open(descFileName, "w") as descfile :
                     outfile.write("mv %s %s \n" % (metaFileName, dirName))
                     outfile.write("cp %s %s \n" % ("gentri3.py", dirName))
                     outfile.write("cp %s %s \n" % ("gen.rc", dirName))
+                    outfile.write("cp %s %s \n" % ("simcache.py", dirName))
+                    outfile.write("cp %s %s \n" % ("h5stride.py", dirName))
                     outfile.write('sed -e "s/\${config}/%s/" -e "s/\${control}/%s/" %s > %s/%s \n' 
                                   % (metaFileName, outctlName+"."+str(count), runFilePatt, dirName, runFileName)) 
                     outfile.write('sed -e "s/\${config}/%s/" -e "s/\${control}/%s/" %s > %s/%s \n' 
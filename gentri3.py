@@ -41,7 +41,19 @@
 
 import numpy as np
 import copy # for copying nested dictionaries
+import heapq
+import itertools
+import bisect
 import sys
+import io
+import time
+import contextlib
+import hashlib
+import re
+import pickle
+import json
+import tracemalloc
+import shutil
 import yaml
 from datetime import datetime
 
@@ -56,6 +68,16 @@ Tolerance = 1e-6
 VERSION = '0.4.1'
 MAJOR_VERSION = '0.4'
 
+# the C loader is much faster where libyaml is available
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# the messages about every element, source and collector are printed 
+# with the verbosity 1 and above (gentri3.py -v)
+VERBOSITY = 0
+
+# the profile of the translation (gentri3.py --profile), None when it's not collected
+PROFILE = None
+
 def validateVersion(version) :
     # until release, x in 0.x.y denotes the major version
     if version == VERSION :
@@ -83,6 +105,228 @@ def is_number(s):
 def sort_pair(a, b) :
     return (a,b) if a < b else (b,a)
 
+def write_raster(fileName, epsilon, conductivity) :
+    # writes the rasterized structure in the format of Meep's output-epsilon
+    try:
+        import h5py
+    except ImportError :
+        print("h5py is required for writing rasterized structures")
+        raise
+    with h5py.File(fileName, "w") as f :
+        f.create_dataset("eps", data = epsilon)
+        f.create_dataset("sigma", data = conductivity)
+
+def write_shared(fileName, write) :
+    # writes the file shared by many runs unless it exists: write(name) writes it aside
+    # and it's renamed, so concurrent translations never see a partial file. 
+    # Returns whether the file is written
+    if os.path.exists(fileName) :
+        return False
+    partFileName = "%s.%s.part" % (fileName, os.getpid())
+    write(partFileName)
+    os.replace(partFileName, fileName)
+    return True
+
+def link_shared(source, target) :
+    # puts the shared file next to the control file (hard link, copy across file systems)
+    if os.path.lexists(target) :
+        os.remove(target)
+    try :
+        os.link(source, target)
+    except OSError :
+        shutil.copy2(source, target)
+
+def hash_ctl_line(digest, line, epsilonInput = None) :
+    # adds the line of the control file to the hash of the simulation (see MeepControl.getHash):
+    # comments are skipped, the name of the epsilon-input-file (it follows the name of
+    # the control file) is replaced, so is the path of the shared geometry (its name is 
+    # the hash of the geometry already)
+    if line.startswith(";") :
+        return
+    if epsilonInput != None :
+        line = line.replace(epsilonInput, "epsilon-input")
+    line = re.sub(r'\(include "(?:[^"]*/)?([^"/]*)"\)', r'(include "\1")', line)
+    digest.update(line.encode() + b"\n")
+
+def hash_raster(digest, epsilon, conductivity) :
+    # adds the structure loaded by epsilon-input-file to the hash of the simulation
+    for values in (epsilon, conductivity) :
+        values = np.ascontiguousarray(values, dtype = np.float64)
+        digest.update(repr(values.shape).encode())
+        digest.update(values.tobytes())
+
+def mirror_regions(regions, direction) :
+    # checks whether the set of sources or flux regions is mapped onto itself by 
+    # the mirror flipping the given direction ('x' or 'y'), regions are compared together
+    # with their properties
+    def image(region) :
+        pos = region['position']
+        return (-pos['x'], pos['y']) if direction == 'x' else (pos['x'], -pos['y'])
+    # end of image
+    
+    for region in regions :
+        x, y = image(region)
+        if not any(abs(other['position']['x'] - x) < Tolerance and abs(other['position']['y'] - y) < Tolerance 
+                   and other['position']['width'] == region['position']['width'] 
+                   and other['position']['elevation'] == region['position']['elevation'] 
+                   and other['property'] == region['property'] for other in regions) :
+            return False
+    return True
+
+def mirror_phase(component, direction) :
+    # the phase of the electric field (as Meep counts it) under the mirror flipping 
+    # the direction for the source of the given component (Ex, ..., Hz)
+    # the E-field component along the direction is odd, H is the pseudovector
+    parallel = component[1:].lower() == direction
+    if component[0].upper() == 'E' :
+        return -1 if parallel else 1
+    return 1 if parallel else -1
+
+def estimate_cost(resources, sizes, resolution, duration, fluxes, snapshots, probes, 
+                  complexFields = False, numMirrors = 0) :
+    # Rough estimate of the cost of the run for scheduling, the rates are taken from
+    # the Estimate section of the resource file.
+    # sizes - of the cell (2 or 3), duration - the simulated time,
+    # fluxes - the list of (number of frequencies, sizes of the flux region),
+    # snapshots - the list of (time step, sizes of the sub-volume or None for the cell,
+    # time window or None for the whole run, spatial stride, single precision),
+    # probes - the time steps of the local field outputs
+    # Returns the dictionary ready for dumping
+    def points(extent) :
+        return max(int(round(extent*resolution)), 1)
+    # end of points
+    
+    gridPoints = int(np.prod([points(size) for size in sizes]))
+    # mirrors halve the computed part of the cell
+    computed = gridPoints // 2**numMirrors
+    timeStep = float(resources['courant'])/resolution
+    timeSteps = int(np.ceil(duration/timeStep))
+    # real numbers are doubles, complex are twice as much
+    word = 8*(2 if complexFields else 1)
+    
+    dftPoints = sum(numFreqs*int(np.prod([points(size) for size in region if size > 0])) 
+                    for numFreqs, region in fluxes)
+    # four tangential components of complex fields are accumulated
+    dftBytes = dftPoints*4*16
+    fieldBytes = computed*int(resources['field_arrays_%sd' % len(sizes)])*word
+    frames = [int((duration if window == None else window)/step) + 1 
+              for step, region, window, stride, single in snapshots]
+    framePoints = [max((gridPoints if region == None else int(np.prod([points(size) for size in region if size > 0])))
+                       // stride**len(sizes), 1) 
+                   for step, region, window, stride, single in snapshots]
+    frameWords = [word//2 if single else word for step, region, window, stride, single in snapshots]
+    outputBytes = sum(np.array(frames)*np.array(framePoints)*np.array(frameWords)) \
+        + sum(int(duration/step) + 1 for step in probes)*word
+    
+    memory = fieldBytes + dftBytes
+    ranks = max(int(np.ceil(float(computed)/resources['points_per_rank'])), 
+                int(np.ceil(memory/(resources['memory_per_rank']*2.0**20))), 1)
+    walltime = float(resources['walltime_margin'])*timeSteps*computed \
+        /(float(resources['updates_per_second'])*ranks)
+    
+    megabyte = 2.0**20
+    return {
+        'dimensions' : len(sizes),
+        'cell' : [float(size) for size in sizes],
+        'resolution' : float(resolution),
+        'grid_points' : gridPoints,
+        'mirror_symmetries' : numMirrors,
+        'time' : float(duration),
+        'courant' : float(resources['courant']),
+        'time_steps' : timeSteps,
+        'dft_points' : dftPoints, # frequencies times points of flux regions
+        'snapshot_frames' : sum(frames),
+        'output_mb' : round(float(outputBytes)/megabyte, 3),
+        'memory_mb' : round(memory/megabyte, 3), # peak memory of fields and DFT
+        'mpi_ranks' : ranks,
+        'walltime_s' : int(np.ceil(walltime)),
+        'walltime' : "%d:00:00" % max(int(np.ceil(walltime/3600.0)), 1), # for #PBS -l walltime
+    }
+
+def log(level, message) :
+    # prints the message if the verbosity allows
+    if level <= VERBOSITY :
+        print(message)
+
+class phaseProfile(object) :
+    # Wall time, CPU time and peak memory of the consecutive phases of the translation 
+    # and the counters of the work done (blocks, cuts, ...). The memory is the one 
+    # allocated by Python as traced by tracemalloc, which slows the translation down
+    
+    def __init__(self) :
+        self.phases = []
+        self.counters = {}
+        self.current = None
+        if not tracemalloc.is_tracing() :
+            tracemalloc.start()
+    
+    def start(self, name) :
+        # the phase lasts until the next one starts or stop is called
+        self.stop()
+        tracemalloc.reset_peak()
+        self.current = (name, time.perf_counter(), time.process_time(), 
+                        tracemalloc.get_traced_memory()[0])
+        
+    def stop(self) :
+        if self.current == None :
+            return
+        name, wall, cpu, memory = self.current
+        current, peak = tracemalloc.get_traced_memory()
+        self.phases.append({
+            'phase' : name,
+            'wall_s' : round(time.perf_counter() - wall, 6),
+            'cpu_s' : round(time.process_time() - cpu, 6),
+            'peak_mb' : round(peak/2.0**20, 3),
+            'retained_mb' : round((current - memory)/2.0**20, 3), # allocated and not freed
+        })
+        self.current = None
+    
+    def count(self, name, number = 1) :
+        self.counters[name] = self.counters.get(name, 0) + number
+        
+    def report(self) :
+        # Returns the dictionary ready for dumping, repeated phases are summed up
+        self.stop()
+        phases = {}
+        for phase in self.phases :
+            if not phase['phase'] in phases :
+                phases[phase['phase']] = dict(phase, calls = 0, wall_s = 0.0, cpu_s = 0.0, retained_mb = 0.0)
+            total = phases[phase['phase']]
+            total['calls'] += 1
+            for key in ('wall_s', 'cpu_s', 'retained_mb') :
+                total[key] = round(total[key] + phase[key], 6)
+            total['peak_mb'] = max(total['peak_mb'], phase['peak_mb'])
+        res = {
+            'version' : VERSION,
+            'phases' : list(phases.values()),
+            'counters' : dict(sorted(self.counters.items())),
+            'wall_s' : round(sum(phase['wall_s'] for phase in self.phases), 6),
+            'cpu_s' : round(sum(phase['cpu_s'] for phase in self.phases), 6),
+            'peak_mb' : max([phase['peak_mb'] for phase in self.phases] + [0]),
+        }
+        try :
+            import resource
+            # kilobytes on Linux
+            res['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0, 3)
+        except ImportError :
+            pass
+        return res
+
+## end of class phaseProfile
+
+def profile_phase(name) :
+    # starts the phase of the profile if it's collected
+    if PROFILE != None :
+        PROFILE.start(name)
+
+def profile_stop() :
+    if PROFILE != None :
+        PROFILE.stop()
+
+def profile_count(name, number = 1) :
+    if PROFILE != None :
+        PROFILE.count(name, number)
+
 class clYAML(object):
     # class dealing with YAML data
 
@@ -95,19 +339,30 @@ class clYAML(object):
         # For subclasses to do their stuff
         return True
 
-    def __init__(self, FileName) :
+    def __init__(self, FileName, Data = None) :
+        # the already parsed Data are copied (validation may change them)
+        # otherwise they are read off the file
         # TODO: deal with file problems better
         self.isValid = False
         self.Data = None
         self.iniFileName = FileName
-        try:
-            with open(self.iniFileName, "r") as f :
-                self.Data = yaml.safe_load(f)
-        except IOError :
-            print("Meta-configuration file cannot be opened")
-            raise
+        if Data != None :
+            self.Data = copy.deepcopy(Data, dict((id(kept), kept) for kept in self.keptData(Data)))
+        else :
+            try:
+                with open(self.iniFileName, "r") as f :
+                    profile_phase('yaml_load')
+                    self.Data = yaml.load(f, Loader = YAMLLoader)
+                    profile_stop()
+            except IOError :
+                print("Meta-configuration file cannot be opened")
+                raise
         self.isValid = self.validate()
 
+    def keptData(self, Data) :
+        # the parts of the parsed Data that validation doesn't change, they aren't copied
+        return []
+
     def getSection(self, toplevel, *args) :
         # Returns the branch starting from toplevel.args[0].args[1]...
         if toplevel in dict(self.Data) :
@@ -119,23 +374,68 @@ class clYAML(object):
             return None
 
 ## class clYAML
+
+def load_validated(cls, fileName, cacheDir = None) :
+    # Returns the instance of the subclass of clYAML (ctlInfo, genResource) made of the file.
+    # With cacheDir, the validated instance is kept there keyed by the hash of the name 
+    # and the content of the file and of the version and the code of the generator, so 
+    # repeated loads skip parsing and validation
+    if cacheDir == None :
+        return cls(fileName)
+    
+    with open(fileName, "rb") as f :
+        content = f.read()
+    digest = hashlib.sha256(VERSION.encode())
+    with open(os.path.realpath(__file__), "rb") as f :
+        digest.update(f.read())
+    digest.update(fileName.encode())
+    digest.update(content)
+    cacheName = os.path.join(cacheDir, "%s-%s.pickle" % (cls.__name__, digest.hexdigest()))
+    try :
+        with open(cacheName, "rb") as f :
+            profile_phase('cache_load')
+            obj = pickle.load(f)
+            profile_stop()
+        print("The validated %s is taken from the cache: %s" % (fileName, cacheName))
+        return obj
+    except Exception :
+        # missing or stale entries are made again
+        pass
+    
+    profile_phase('yaml_load')
+    data = yaml.load(content, Loader = YAMLLoader)
+    profile_stop()
+    obj = cls(fileName, data)
+    if obj.isValid :
+        try :
+            os.makedirs(cacheDir, exist_ok = True)
+            partName = "%s.%s.part" % (cacheName, os.getpid())
+            with open(partName, "wb") as f :
+                pickle.dump(obj, f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(partName, cacheName)
+        except (IOError, OSError) :
+            print("The cache cannot be written: %s" % cacheDir)
+    return obj
     
 class genResource(clYAML) :
     # the class providing the interface to the generator resources
     # It's made mostly to provide additional layer of validation
     # Currently it does nothing (two months later. not anymore)
     
-    def __init__(self, rcFileName = None) :
-        # the constructor accepts the name of the resource file
+    def __init__(self, rcFileName = None, data = None) :
+        # the constructor accepts the name of the resource file (and the parsed data)
+        super(genResource, self).__init__(self.resolveName(rcFileName), data)
+        
+        self.version = str(self.Data['version'])
+        self.majorVersion = str(self.Data['support_version']).split('.')[1]
+    
+    @staticmethod
+    def resolveName(rcFileName) :
         if rcFileName == None :
             # look for the .rc file in the directory where the py file resides
             script_path, _ = os.path.split(os.path.realpath(__file__))
             rcFileName = os.path.join(script_path, 'gen.rc')
-
-        super(genResource, self).__init__(rcFileName)
-        
-        self.version = str(self.Data['version'])
-        self.majorVersion = str(self.Data['support_version']).split('.')[1]
+        return rcFileName
         
     def subvalidate(self) :
         if str(self.Data['version']) == VERSION :
@@ -148,6 +448,55 @@ class genResource(clYAML) :
 
 ### classes Line and CollectionLines
 
+class elementPoint(object) :
+    # An end of the laid-out line or connector. attached_to is the element it's attached to
+    __slots__ = ('x', 'y', 'skip', 'attached_to', 'left_attachment', 'right_attachment')
+    
+    def __init__(self, x, y, skip = 0.0) :
+        self.x = x
+        self.y = y
+        self.skip = skip
+        self.attached_to = None
+        self.left_attachment = False
+        self.right_attachment = False
+
+class lineElement(object) :
+    # The laid-out line or connector. The property is the one given in the meta-configuration 
+    # file (with the elevation), it's shared by the elements and their pieces and never changed.
+    # So are the materials it refers to
+    __slots__ = ('type', 'id', 'comment', 'property', 'start', 'end', 
+                 'space_up', 'weak_space_up', 'space_down', 'weak_space_down', 
+                 'space_left', 'space_right')
+    
+    def __init__(self, type, id, comment, property, start = None, end = None) :
+        self.type = type
+        self.id = id
+        self.comment = comment
+        self.property = property
+        self.start = start
+        self.end = end
+        # space_up is the absolute minimum required
+        # weak_space_up is the maximum needed
+        self.space_up = self.weak_space_up = 0.0
+        self.space_down = self.weak_space_down = 0.0
+        self.space_left = self.space_right = 0.0
+    
+    def point(self, name) :
+        # the end by its name in the meta-configuration file
+        if name == 'start' :
+            return self.start
+        if name == 'end' :
+            return self.end
+        return None
+    
+    def piece(self, start, end) :
+        # the copy with new ends, only the coordinates are copied
+        res = lineElement(self.type, self.id, self.comment, self.property, start, end)
+        res.space_up, res.weak_space_up = self.space_up, self.weak_space_up
+        res.space_down, res.weak_space_down = self.space_down, self.weak_space_down
+        res.space_left, res.space_right = self.space_left, self.space_right
+        return res
+
 class collectionLines(object) :
     def __init__ (self, listLines = None) :
         self.listLines = []
@@ -157,24 +506,35 @@ class collectionLines(object) :
         self.MaxY = 0
         self.MinZ = 0
         self.MaxZ = 0        
+        # the shift centering the structure (see setCenter)
+        self.shiftX = 0.0
+        self.shiftY = 0.0
         
         self.numElements = 0
         self.numErrors = 0
         self.bufErrors = []
         
-    def setCenter(self) :
+        # registry of elements by their id's, it's filled as elements are added
+        self.dictIDs = {}
+        # the properties shared by the elements, by their representation
+        self.properties = {}
+        
+    def setCenter(self, listPoints = []) :
         # Finalizes reading the elements off the meta-configuration file
+        # The limits must be set (setLimits) before the conflicts are settled, since 
+        # the latter adjusts paddings. listPoints are other positioned objects (sources, 
+        # collectors) that are shifted together with the limits. The laid-out elements 
+        # keep their coordinates, the shift (shiftX, shiftY) is applied to their blocks
+        # (see blockTable.shift), so the same layout gives the same blocks wherever it is
         self.numElements = len(self.listLines)
-        self.setLimits()
             
         shift_X = -(self.MaxX + self.MinX)/2.0
         shift_Y = -(self.MaxY + self.MinY)/2.0
+        self.shiftX, self.shiftY = shift_X, shift_Y
             
-        for line in self.listLines :
-            line['start']['x'] += shift_X
-            line['start']['y'] += shift_Y
-            line['end']['x'] += shift_X
-            line['end']['y'] += shift_Y
+        for point in listPoints :
+            point['x'] += shift_X
+            point['y'] += shift_Y
 
         self.MinX += shift_X
         self.MaxX += shift_X
@@ -194,20 +554,20 @@ class collectionLines(object) :
     def setLimits(self) :
         if len(self.listLines) > 0 :
             # to avoid unnecessary dealing with None's
-            self.MinX = self.listLines[0]['start']['x']
+            self.MinX = self.listLines[0].start.x
             self.MaxX = self.MinX
-            self.MinY = self.listLines[0]['start']['y']
+            self.MinY = self.listLines[0].start.y
             self.MaxY = self.MinY
             
         for line in self.listLines :
-            if line['type'] == 'connector':
+            if line.type == 'connector':
                 continue
-            start = line['start']
-            end = line['end']
-            (curMinX, curMaxX) = sort_pair(start['x'], end['x'])
+            start = line.start
+            end = line.end
+            (curMinX, curMaxX) = sort_pair(start.x, end.x)
             
-            curMinY = min(start['y'], end['y']) - line['weak_space_down']
-            curMaxY = max(start['y'], end['y']) + line['weak_space_up']
+            curMinY = min(start.y, end.y) - line.weak_space_down
+            curMaxY = max(start.y, end.y) + line.weak_space_up
             
             self.MinX = min(self.MinX, curMinX)
             self.MaxX = max(self.MaxX, curMaxX)
@@ -216,33 +576,101 @@ class collectionLines(object) :
     # end of setLimits
         
     def findLineID(self, id) :
-        res = None
-        for line in self.listLines :
-            if "id" in dict(line) and line["id"] == id :
-                res = line
-                break            
+        return self.dictIDs.get(id)
+    
+    def registerID(self, elem) :
+        # the first element with the given id wins (pieces of cut lines are not registered)
+        if elem.id != None and not elem.id in self.dictIDs :
+            self.dictIDs[elem.id] = elem
+    
+    def shareProperty(self, property) :
+        # Returns the property with the elevation shared by all elements having the same one
+        # (YAML aliases or not), the property in the meta-configuration file is not changed
+        key = repr(property)
+        if not key in self.properties :
+            shared = dict(property)
+            shared['elevation'] = self.MaxZ
+            self.properties[key] = shared
+        return self.properties[key]
+    
+    def orderElements(self, listElem) :
+        # Returns the list of elements (as given in the meta-configuration file) ordered
+        # so that every element comes after the elements it refers to (ref or attached_to).
+        # The original order is kept whenever possible. Returns None if references are cyclic.
+        dependencies = self.elementDependencies
+        owners = {}
+        for num, item in enumerate(listElem) :
+            elem = list(item.values())[0]
+            if "id" in dict(elem) and not elem["id"] in owners :
+                owners[elem["id"]] = num
+        
+        numDeps = [0]*len(listElem)
+        dependents = [[] for item in listElem]
+        for num, item in enumerate(listElem) :
+            # unknown references are reported when the element is added
+            for dep in set(owners[ref] for ref in dependencies(list(item.values())[0]) if ref in owners) :
+                numDeps[num] += 1
+                dependents[dep].append(num)
+        
+        ready = [num for num in range(len(listElem)) if numDeps[num] == 0]
+        heapq.heapify(ready)
+        res = []
+        while len(ready) > 0 :
+            num = heapq.heappop(ready)
+            res.append(listElem[num])
+            for dep in dependents[num] :
+                numDeps[dep] -= 1
+                if numDeps[dep] == 0 :
+                    heapq.heappush(ready, dep)
+        
+        if len(res) < len(listElem) :
+            self.setError("Elements refer to each other cyclically")
+            return None
         return res
 
+    @staticmethod
+    def elementDependencies(elem) :
+        # the ids of the elements the element (as given in the meta-configuration file) refers to
+        deps = []
+        for point in (elem['start'], elem['end']) :
+            if "ref" in dict(point) and not ("id" in dict(elem) and elem["id"] == point['ref']) :
+                deps.append(point['ref'])
+            if "attached_to" in dict(point) :
+                deps.append(point['attached_to'])
+        return deps
+        
     def addLine(self, add_line) :
-        def adjust_for_relative(point, curline = None) :
+        # add_line is the line as given in the meta-configuration file, it's not changed
+        line = self.layLine(add_line)
+        if line == None :
+            return False
+        self.listLines.append(line)
+        self.registerID(line)
+        return True
+        
+    def layLine(self, add_line) :
+        # Returns the line laid out after the elements registered so far (None on errors)
+        def place(point, curline = None) :
+            # Returns the position of the point relative to the referred element if any
             # The awkward second argument is to support the self-reference for end points
+            pos = elementPoint(point.get('x', 0.0), point.get('y', 0.0))
             if "ref" in dict(point) :
                 refelem = None
-                if curline != None and "id" in dict(curline) and curline["id"] == point['ref'] :
+                if curline != None and curline.id != None and curline.id == point['ref'] :
                     refelem = curline
                 else :
                     refelem = self.findLineID(point['ref'])
 
                 if refelem == None :
                     self.setError("The point refers to unknown element")
-                    return False
+                    return None
 
-                point['x'] += refelem[point['point']]['x']
-                point['y'] += refelem[point['point']]['y']
-            return True
-        # end adjust_for_relative
+                pos.x += refelem.point(point['point']).x
+                pos.y += refelem.point(point['point']).y
+            return pos
+        # end place
 
-        def is_attached(point) :
+        def is_attached(point, pos) :
             if "attached_to" in dict(point) :
                 refelem = self.findLineID(point['attached_to'])
 
@@ -251,30 +679,33 @@ class collectionLines(object) :
                     return False # hope it won't happen before Exceptions
                 # Also in the rectangular design line-end cannot be attached to line-end
 
-                point['x'] = refelem[point['point']]['x']
-                point['y'] = refelem[point['point']]['y']
-                point['attached_to'] = refelem
+                pos.x = refelem.point(point['point']).x
+                pos.y = refelem.point(point['point']).y
+                pos.attached_to = refelem
                 return True
             return False
-        # end adjust_for_attachment            
+        # end is_attached
 
         # main code of addLine
         start = add_line['start']
         end = add_line['end']
-        add_property = add_line['property']
+        add_property = self.shareProperty(add_line['property'])
+        line = lineElement('line', add_line.get('id'), add_line.get('comment'), add_property)
 
         # Finding absolute coordinates
         # First we settle the start point
-        if not adjust_for_relative(start) : return False
-        if is_attached(start) and not start['attached_to']['type'] == 'line':
+        line.start = place(start)
+        if line.start == None : return None
+        if is_attached(start, line.start) and not line.start.attached_to.type == 'line':
             # lines attachment is trvial --
             # if it's connector, however, we need to adjust y and (TODO) flag the necessity to create the patch
-            start['x'] += 0.5*start['attached_to']['property']['width']
-            start['y'] += 0.5*add_property['width']*(-1 if start['point'] == 'end' else 1)
+            line.start.x += 0.5*line.start.attached_to.property['width']
+            line.start.y += 0.5*add_property['width']*(-1 if start['point'] == 'end' else 1)
 
-            start['attached_to'][start['point']]['right_attachment'] = True
+            line.start.attached_to.point(start['point']).right_attachment = True
             
-        if not adjust_for_relative(end, add_line) : return False
+        line.end = place(end, line)
+        if line.end == None : return None
 
         # the end point can also be set up in terms of number of periods
         if "periods" in dict(end):
@@ -293,80 +724,91 @@ class collectionLines(object) :
             #     direct_y /= direct_len
             direct_x = 1.0
             direct_y = 0.0
-            shift_x = 0.0 if not 'x' in dict(end) else float(end['x'])
-            shift_y = 0.0 if not 'y' in dict(end) else float(end['y'])
+            shift_x = 0.0 if not 'x' in dict(end) else float(line.end.x)
+            shift_y = 0.0 if not 'y' in dict(end) else float(line.end.y)
             shift = np.sqrt(shift_x**2 + shift_y**2)
 
-            end['x'] = start['x'] + shift + \
+            line.end.x = line.start.x + shift + \
                 end["periods"]*add_property['grooves']['period'] # only horizontals for now
-            end['y'] = start['y']
-        elif is_attached(end) and not start['attached']['type'] == 'line' :
-            end['x'] -= 0.5*end['attached']['property']['width']
-            end['y'] += add_property['width']*(-1  if start['point'] == 'end' else 1)
-            end['attached'][end['point']]['left_attachment'] = True
+            line.end.y = line.start.y
+        elif is_attached(end, line.end) and not line.end.attached_to.type == 'line' :
+            line.end.x -= 0.5*line.end.attached_to.property['width']
+            line.end.y += add_property['width']*(-1  if start['point'] == 'end' else 1)
+            line.end.attached_to.point(end['point']).left_attachment = True
 
-        add_line['type'] = 'line'
-        
-        # space_up is the absolute minimum required
-        # weak_space_up is the maximum needed
-        add_line['space_up'] = add_property['width']/2.0 + add_property['grooves']['depth']
-        add_line['weak_space_up'] = add_line['space_up'] + add_property['padding']
-        add_line['space_down'] = add_property['width']/2.0 + add_property['grooves']['depth']
-        add_line['weak_space_down'] = add_line['space_down'] + add_line['property']['padding']
-        
-        if not 'skip' in dict(add_line['start']):
-            add_line['start']['skip'] = 0.0
-        add_line['start']['skip'] = add_line['start']['skip'] % 1 # we want only fraction
-        if abs(add_line['start']['skip'] - 1) < Tolerance or abs(add_line['start']['skip']) < Tolerance :
-            add_line['start']['skip'] = 0.0
-            
-        # Here we deal with the z part
-        add_line['property']['elevation'] = self.MaxZ
-        self.listLines.append(add_line)
-    # end addline
+        line.space_up = add_property['width']/2.0 + add_property['grooves']['depth']
+        line.weak_space_up = line.space_up + add_property['padding']
+        line.space_down = add_property['width']/2.0 + add_property['grooves']['depth']
+        line.weak_space_down = line.space_down + add_property['padding']
+        
+        skip = start.get('skip', 0.0) % 1 # we want only fraction
+        if abs(skip - 1) < Tolerance or abs(skip) < Tolerance :
+            skip = 0.0
+        line.start.skip = skip
+        return line
+    # end of layLine
     
     def addConnector(self, add_con) :
-        def adjust_for_attachment(point) :
-            if "attached_to" in dict(point) :
-                refelem = self.findLineID(point['attached_to'])
-    
-                if refelem == None:
-                    self.setError("The connector tries to attach to unknown element")
-                    return False # hope it won't happen before Exceptions
-                # We rely on the stict ordering of elements
-    
-                point['x'] = refelem[point['point']]['x']
-                point['y'] = refelem[point['point']]['y']
-                point['attached_to'] = refelem
-                point['left_attached'] = True
-            return True
+        # add_con is the connector as given in the meta-configuration file, it's not changed
+        con = self.layConnector(add_con)
+        if con == None :
+            return False
+        self.listLines.append(con)
+        self.registerID(con)
+        return True
+        
+    def layConnector(self, add_con) :
+        # Returns the connector laid out after the elements registered so far (None on errors)
+        def attach(point) :
+            # Returns the position of the point of the element it's attached to
+            refelem = self.findLineID(point['attached_to'])
+
+            if refelem == None:
+                self.setError("The connector tries to attach to unknown element")
+                return None # hope it won't happen before Exceptions
+            # Elements are added in the order of their dependencies (see orderElements)
+
+            pos = elementPoint(refelem.point(point['point']).x, refelem.point(point['point']).y)
+            pos.attached_to = refelem
+            return pos
     
         start = add_con['start']
         end = add_con['end']
     
         if not ('attached_to' in dict(start) and 'attached_to' in dict(end)) :
             self.setError("In the present version connectors must be attached to lines")
-            return False
+            return None
     
-        if not adjust_for_attachment(start) : return False # Exceptions
-        if not adjust_for_attachment(end) : return False
+        add_property = self.shareProperty(add_con['property'])
+        con = lineElement('connector', add_con.get('id'), add_con.get('comment'), add_property, 
+                          attach(start), attach(end))
+        if con.start == None or con.end == None : return None # Exceptions
     
-        start['y'] -= 0.5*start['attached_to']['property']['width']
-        end['y'] += 0.5*end['attached_to']['property']['width']
-        start['x'] += 0.5*add_con['property']['width']
-        end['x'] = start['x']
+        con.start.y -= 0.5*con.start.attached_to.property['width']
+        con.end.y += 0.5*con.end.attached_to.property['width']
+        con.start.x += 0.5*add_property['width']
+        con.end.x = con.start.x
     
-        add_con['type'] = 'connector'
-        add_con['space_left'] = add_con['property']['width']/2.0
-        add_con['space_right'] = add_con['property']['width']/2.0
-        
-        add_con['property']['elevation'] = self.MaxZ
-        self.listLines.append(add_con)
-    # end of addconnector
+        con.space_left = add_property['width']/2.0
+        con.space_right = add_property['width']/2.0
+        return con
+    # end of layConnector
         
     def settleConflicts(self) :
         # Now when we have all main elements added with their absolute coordinates we need to resolve
-        # CONFLICTS
+        # conflicts (see settleLines), the new pieces of lines follow all elements
+        lines = [line for line in self.listLines if line.type == 'line']
+        res = self.settleLines(lines)
+        if res == None :
+            return False
+        for linePieces in res[0] :
+            self.listLines.extend(linePieces[1:])
+        return True
+        
+    def settleLines(self, lines) :
+        # Settles the CONFLICTS of the lines (no connectors) with each other. Returns the pieces 
+        # of every line (the line itself becomes the first one) and the conflicting pairs 
+        # (distance, upper line, lower line), None if the conflicts cannot be settled
         # Currently we know how to deal with two types of conflicts
         # 1. (TODO) Attachment conflict.
         #    We need to make sure that sides are covered by metallic patches
@@ -393,103 +835,142 @@ class collectionLines(object) :
         #     -----
         #      Here we cut out the left part
         # 5. 4 flipped
-        # We keep going over the list 
-        
-        def isDisjoint(line1, line2):
-            # within the horizonatl alignment we need only x's
-            x11, x12 = line1['start']['x'], line1['end']['x']
-            x21, x22 = line2['start']['x'], line2['end']['x']
+        # Instead of going over all pairs we sweep the lines from left to right keeping the
+        # lines that are crossed by the sweep ordered by y, so only the lines that are close
+        # vertically are compared. Then all cutting points are found at once and the lines 
+        # are cut in a single pass. Connectors do not have paddings and are not involved.
+        
+        def x_range(line) :
+            return sort_pair(line.start.x, line.end.x)
+        
+        def find_pairs(lines) :
+            # pairs (distance, up, low) of overlapping lines being too close to each other
+            reach = max(line.weak_space_down for line in lines) \
+                + max(line.weak_space_up for line in lines)
             
-            return (max(x11, x12) <= min(x21, x22) or min(x11, x12) >= max(x21, x22)) 
-        # end of isDisjoint
-        
-        def y_separation(line1, line2):
-            # mutual penetration
-            # current implementation assumes the horizontal alignment
-            upper, lower = (line1, line2) if line1['start']['y'] > line2['start']['y'] else (line2, line1)
-            
-            distance = upper['start']['y'] - lower['start']['y']
-            return distance, upper, lower
-        # end y_separation
-        
-        def cut_line(line, x) :
-            # cuts the line at the specified point and creates a new piece out of it
-            # check that the line is oriented properly 
-            if line['end']['x'] < line['start']['x'] :
+            pairs = []
+            active = [] # (y, num) of lines crossed by the sweep
+            expiring = [] # heap of (xmax, y, num)
+            for num in sorted(range(len(lines)), key = lambda num : x_range(lines[num])[0]) :
+                line = lines[num]
+                xmin, xmax = x_range(line)
+                y = line.start.y
+                while len(expiring) > 0 and expiring[0][0] <= xmin + Tolerance :
+                    _, yold, numold = heapq.heappop(expiring)
+                    del active[bisect.bisect_left(active, (yold, numold))]
+                
+                for ycon, numcon in active[bisect.bisect_left(active, (y - reach, -1)) : 
+                                           bisect.bisect_right(active, (y + reach, len(lines)))] :
+                    conline = lines[numcon]
+                    upper, lower = (line, conline) if y > ycon else (conline, line)
+                    distance = upper.start.y - lower.start.y
+                    if distance < lower.space_up + upper.space_down :
+                        self.setError("Block overlap")
+                        return None
+                    if distance < upper.weak_space_down + lower.weak_space_up :
+                        pairs.append((distance, upper, lower))
+                
+                bisect.insort(active, (y, num))
+                heapq.heappush(expiring, (xmax, y, num))
+            return pairs
+        # end of find_pairs
+        
+        def add_cut(cuts, line, x) :
+            # adds the cutting point if it's inside the line and new
+            xmin, xmax = x_range(line)
+            if not xmin + Tolerance < x < xmax - Tolerance :
+                return
+            points = cuts[id(line)]
+            pos = bisect.bisect_left(points, x)
+            if (pos < len(points) and points[pos] - x < Tolerance) or \
+               (pos > 0 and x - points[pos - 1] < Tolerance) :
+                return
+            points.insert(pos, x)
+        # end of add_cut
+        
+        def cut_line(line, points) :
+            # cuts the line at the specified points and returns the new pieces
+            # the line itself becomes the leftmost piece
+            if line.end.x < line.start.x :
                 self.setError("Incorrect order of line ends")
-                return False
+                return None
 
-            # newline wouldn't start from the partial period
-            period = line['property']['grooves']['period']
-            lenLinePartial = period*(1.0-line['start']['skip'])
-            lenLineNew = x - line['start']['x']
+            # the pieces wouldn't start from the partial period
+            period = line.property['grooves']['period']
+            lenLinePartial = period*(1.0-line.start.skip)
             
-            newline = copy.deepcopy(line)
-            # newline.end copies the properties of line.end
-            # properties of newline.start and new properties of line.end are coordinates only
-            y = line['end']['y']
-            newline['start'] = {'x' :x, 'y': y}
-            line['end'] = {'x' :x, 'y': y}
+            y = line.end.y
+            start_x = line.start.x
+            end = line.end
+            line.end = elementPoint(points[0], y)
             
-            lenLineNewPeriods = lenLineNew - lenLinePartial
-            if lenLineNewPeriods < 0:
-                # the new line starts with even larger skip
-                newline['start']['skip'] = 1 + lenLineNewPeriods/float(period)
-            else:
-                newline['start']['skip'] = divmod(lenLineNewPeriods, period)[1]/float(period)
-        
-            self.listLines.append(newline) 
-            return True
-        # end of cut_line
-
-        flagConflicts = True
-        while flagConflicts :
-            for i in range(len(self.listLines)) :
-                line = self.listLines[i]
-                for j in range(i + 1, len(self.listLines)) :
-                    conline = self.listLines[j]
-                    if isDisjoint(line, conline) :
-                        continue
-                    distance, up, low  = y_separation(line, conline)
-                    if distance < low['space_up'] + up['space_down']:
-                        self.setError("Block overlap")
-                        return False
-                    if distance >= up['weak_space_down'] + low['weak_space_up'] :
-                        continue
-                    # we come here if there's a conflict but it can be settled
-                    # first we check the left end
-                    xmin_up = min(up['start']['x'], up['end']['x'])
-                    xmin_low = min(low['start']['x'], low['end']['x'])
-                    if xmin_up < xmin_low - Tolerance :
-                        if not cut_line(up, xmin_low) :
-                            return False
-                        break
-                    elif xmin_low < xmin_up - Tolerance :
-                        if not cut_line(low, xmin_up) :
-                            return False
-                        break
-                    # the left end is okay, let's look at the right one
-                    xmax_up = max(up['start']['x'], up['end']['x'])
-                    xmax_low = max(low['start']['x'], low['end']['x'])
-                    if xmax_low > xmax_up + Tolerance :
-                        if not cut_line(low, xmax_up) :
-                            return False
-                        break
-                    elif xmax_up > xmax_low + Tolerance :
-                        if not cut_line(up, xmax_low) :
-                            return False
-                        break                  
-                    # if we get to here the ends are aligned and we need to adjust padding only
-                    up['weak_space_down'] = distance/2.0
-                    low['weak_space_up'] = distance/2.0
-                    break
+            pieces = []
+            for num, x in enumerate(points) :
+                # properties of pieces are shared, only coordinates are new
+                newline = line.piece(elementPoint(x, y), 
+                                     end if num == len(points) - 1 else elementPoint(points[num + 1], y))
+                
+                lenLineNewPeriods = x - start_x - lenLinePartial
+                if lenLineNewPeriods < 0:
+                    # the new line starts with even larger skip
+                    newline.start.skip = 1 + lenLineNewPeriods/float(period)
                 else:
-                    continue
-                break
-            else:
-                flagConflicts = False
-                    
-        return True
+                    newline.start.skip = divmod(lenLineNewPeriods, period)[1]/float(period)
+                pieces.append(newline)
+            return pieces
+        # end of cut_line
+        
+        if len(lines) < 2 :
+            return [[line] for line in lines], []
+        
+        pairs = find_pairs(lines)
+        if pairs == None :
+            return None
+        profile_count('conflict_pairs', len(pairs))
+        
+        # A line is cut at the ends of its conflicting neighbours, so that the paddings facing 
+        # each neighbour can be adjusted piecewise. The cuts due to the neighbours on the other 
+        # side do not change the facing padding and do not need to be passed further
+        cuts = {}
+        for line in lines :
+            cuts[id(line)] = []
+        for _, up, low in pairs :
+            for x in x_range(up) :
+                add_cut(cuts, low, x)
+            for x in x_range(low) :
+                add_cut(cuts, up, x)
+        
+        pieces = {}
+        for line in lines :
+            pieces[id(line)] = [line]
+            if len(cuts[id(line)]) == 0 :
+                continue
+            newpieces = cut_line(line, cuts[id(line)])
+            if newpieces == None :
+                return None
+            profile_count('cuts', len(newpieces))
+            pieces[id(line)].extend(newpieces)
+        
+        # Now the ends are aligned and we need to adjust paddings only
+        # The closest neighbours come first. Pieces of both lines are ordered from left to right
+        for distance, up, low in sorted(pairs, key = lambda pair : pair[0]) :
+            listUp, listLow = pieces[id(up)], pieces[id(low)]
+            i, j = 0, 0
+            while i < len(listUp) and j < len(listLow) :
+                profile_count('conflict_iterations')
+                xmin_up, xmax_up = x_range(listUp[i])
+                xmin_low, xmax_low = x_range(listLow[j])
+                if min(xmax_up, xmax_low) - max(xmin_up, xmin_low) > Tolerance and \
+                   distance < listUp[i].weak_space_down + listLow[j].weak_space_up :
+                    listUp[i].weak_space_down = distance/2.0
+                    listLow[j].weak_space_up = distance/2.0
+                    profile_count('padding_adjustments')
+                if xmax_up < xmax_low :
+                    i += 1
+                else :
+                    j += 1
+        
+        return [pieces[id(line)] for line in lines], pairs
 
     def setError(self, str, code = 0) :
         # TODO: Exceptions for collection of lines
@@ -498,6 +979,848 @@ class collectionLines(object) :
         self.bufErrors.append((code, str))    
 
 ### end of classes Line and CollectionLines
+
+class laidElement(object) :
+    # The element (as given in the meta-configuration file) laid out by elementLayout: 
+    # the ids it refers to and the lines or connectors they were resolved to, the line
+    # or the connector as it's laid out (base), its pieces after the conflicts are settled
+    # and the number of the group of lines conflicting with each other it belongs to
+    __slots__ = ('item', 'deps', 'resolved', 'base', 'pieces', 'group')
+    
+    def __init__(self, item, deps, resolved, base) :
+        self.item = item
+        self.deps = deps
+        self.resolved = resolved
+        self.base = base
+        self.pieces = None if base == None else [base]
+        self.group = None
+
+class elementLayout(object) :
+    # The layout of the elements kept between the translations of the same meta-configuration
+    # (see ctlWatcher). Elements are told by their identity, the ones parsed again are new.
+    # Only the new elements and the elements referring to the elements laid out again 
+    # (ref, attached_to) are laid out again, and only the groups of lines conflicting with 
+    # each other that have the new lines or had the dropped ones are settled again. 
+    # The elements keep their coordinates when the structure is centered (see 
+    # collectionLines.setCenter), so the rest of them stays as it was
+    
+    def __init__(self) :
+        # (id of the element, number of its occurrence) -> laidElement
+        self.laid = {}
+        self.numGroups = 0
+        # the properties shared by the elements (see collectionLines.shareProperty) are kept
+        # as long as the elevation they carry is the same
+        self.elevation = None
+        self.properties = {}
+        # what the last update did
+        self.numElements = self.numLaid = 0
+        self.numLines = self.numSettled = 0
+    
+    def update(self, colLines, listElem) :
+        # Lays out the elements (ordered by collectionLines.orderElements) into colLines, 
+        # as addLine, addConnector, setLimits and settleConflicts of colLines do. 
+        # Returns False if the conflicts cannot be settled
+        if colLines.MaxZ != self.elevation :
+            self.laid, self.properties = {}, {}
+            self.elevation = colLines.MaxZ
+        colLines.properties = self.properties
+        
+        laid = {}
+        occurrences = {}
+        records = []
+        changed = []
+        for count, item in enumerate(listElem) :
+            if VERBOSITY >= 1 :
+                log(1, "Processing element: %s type: %s" % (count, list(item.keys())[0]))
+            num = occurrences.get(id(item), 0)
+            occurrences[id(item)] = num + 1
+            record = self.laid.get((id(item), num))
+            # the element is laid out as before if it refers to the same lines and connectors
+            if record == None or any(colLines.dictIDs.get(ref) is not elem 
+                                     for ref, elem in zip(record.deps, record.resolved)) :
+                kind = 'line' if 'line' in dict(item) else 'connector' if 'connector' in dict(item) else None
+                deps = () if kind == None else tuple(colLines.elementDependencies(item[kind]))
+                resolved = tuple(colLines.dictIDs.get(ref) for ref in deps)
+                base = None if kind == None else colLines.layLine(item[kind]) if kind == 'line' \
+                    else colLines.layConnector(item[kind])
+                record = laidElement(item, deps, resolved, base)
+                changed.append(record)
+            if record.base != None :
+                colLines.listLines.append(record.base)
+                colLines.registerID(record.base)
+            laid[(id(item), num)] = record
+            records.append(record)
+        
+        # The limits are fixed before the paddings are adjusted
+        colLines.setLimits()
+        lines = [record for record in records if record.base != None and record.base.type == 'line']
+        
+        # the groups of the dropped lines and of the lines which may conflict with the new ones
+        groups = set(record.group for key, record in self.laid.items() 
+                     if record.group != None and laid.get(key) is not record)
+        isNew = set(id(record) for record in changed)
+        newLines = [record for record in lines if id(record) in isNew]
+        if len(newLines) > 0 and len(lines) > len(newLines) :
+            xmin, xmax, y, up, down = np.array([sort_pair(record.base.start.x, record.base.end.x) 
+                                                + (record.base.start.y, record.base.weak_space_up, 
+                                                   record.base.weak_space_down) 
+                                                for record in lines]).T
+            old = np.array([not id(record) in isNew for record in lines])
+            near = np.zeros(len(lines), dtype = bool)
+            for record in newLines :
+                line = record.base
+                lineMin, lineMax = sort_pair(line.start.x, line.end.x)
+                near |= (np.maximum(xmin, lineMin) <= np.minimum(xmax, lineMax) + Tolerance) \
+                    & (np.abs(y - line.start.y) <= np.maximum(line.weak_space_down + up, down + line.weak_space_up))
+            groups.update(lines[num].group for num in np.nonzero(near & old)[0].tolist())
+        settled = [record for record in lines if id(record) in isNew or record.group in groups]
+        
+        # the lines are settled as copies, the laid-out ones are kept for the next time
+        copies = [record.base.piece(record.base.start, record.base.end) for record in settled]
+        res = colLines.settleLines(copies)
+        if res == None :
+            self.laid = {}
+            return False
+        pieces, pairs = res
+        # the groups are the connected components of the conflicting pairs
+        parent = list(range(len(copies)))
+        def find(num) :
+            while parent[num] != num :
+                parent[num] = parent[parent[num]]
+                num = parent[num]
+            return num
+        # end of find
+        numbers = dict((id(copy), num) for num, copy in enumerate(copies))
+        for _, up, low in pairs :
+            parent[find(numbers[id(up)])] = find(numbers[id(low)])
+        roots = {}
+        for num, record in enumerate(settled) :
+            record.pieces = pieces[num]
+            root = find(num)
+            if not root in roots :
+                roots[root] = self.numGroups
+                self.numGroups += 1
+            record.group = roots[root]
+        
+        # the new pieces of lines follow all elements, the ids name the first pieces
+        colLines.listLines = [record.pieces[0] for record in records if record.base != None]
+        for record in lines :
+            colLines.listLines.extend(record.pieces[1:])
+        first = dict((id(record.base), record.pieces[0]) for record in records if record.base != None)
+        colLines.dictIDs = dict((ident, first[id(elem)]) for ident, elem in colLines.dictIDs.items())
+        
+        self.numElements, self.numLaid = len(records), len(changed)
+        self.numLines, self.numSettled = len(lines), len(settled)
+        # after errors everything is laid out again, so they are reported again
+        self.laid = laid if colLines.numErrors == 0 else {}
+        return True
+    # end of update
+
+## end of class elementLayout
+        
+### class blockTable
+
+# Each block is a row with its center, size and vertical extension, 
+# the material is the index in blockTable.materials
+BLOCK_DTYPE = np.dtype([('centX', 'f8'), ('centY', 'f8'), ('sizeX', 'f8'), ('sizeY', 'f8'), 
+                        ('zB', 'f8'), ('zT', 'f8'), ('material', 'i4')])
+# the number of cells of overlapping blocks enumerated at once by blockTable.rasterize
+RASTER_BATCH = 2**22
+
+def join_blocks(chunks) :
+    # Returns the rows of the chunks (arrays of BLOCK_DTYPE) in one array, they are joined 
+    # as bytes (structured arrays are joined by fields, which is slow for many small chunks)
+    if len(chunks) == 0 :
+        return np.empty(0, dtype = BLOCK_DTYPE)
+    rows = np.dtype((np.void, BLOCK_DTYPE.itemsize))
+    return np.concatenate([np.ascontiguousarray(chunk).view(rows) for chunk in chunks]).view(BLOCK_DTYPE)
+
+class blockTable(object) :
+    # The geometry expanded into blocks
+    # Blocks are accumulated by chunks (one chunk is usually one element) and
+    # the rows keep the order in which blocks are added
+    
+    def __init__(self, cache = None) :
+        self.materials = []
+        self.keyMaterials = {}
+        self.chunks = []
+        self.numBlocks = 0
+        self.comments = [] # (number of the block before which the comment goes, comment)
+        # periodic parts of lines: (number of the first block, blocks per period, 
+        # number of periods, period)
+        self.repeats = []
+        # the blocks of elements laid out before (instance of translationCache), the elements
+        # added now are collected in newElements. Until the table is shifted (see shift),
+        # the media are numbered by the cache
+        self.cache = cache
+        if cache != None :
+            self.materials, self.keyMaterials = cache.materials, cache.keyMaterials
+        self.newElements = {}
+        self.numReused = 0
+        self.propertyKeys = {} # the representations of the properties by their id's
+        
+    def addMaterial(self, medium) :
+        # returns the index of the medium, media are told by their values
+        key = tuple(sorted(medium.items()))
+        if not key in self.keyMaterials :
+            self.keyMaterials[key] = len(self.materials)
+            self.materials.append(medium)
+        return self.keyMaterials[key]
+        
+    def addComment(self, comment) :
+        self.comments.append((self.numBlocks, comment))
+        
+    def addBlocks(self, material, xL, xR, yB, yT, zB, zT) :
+        # adds blocks made of the material(s), the arguments are broadcast against each other
+        xL, xR, yB, yT, zB, zT, material = np.broadcast_arrays(xL, xR, yB, yT, zB, zT, material)
+        chunk = np.empty(xL.size, dtype = BLOCK_DTYPE)
+        chunk['sizeX'] = (xR - xL).ravel()
+        chunk['centX'] = xL.ravel() + chunk['sizeX']/2.0
+        chunk['sizeY'] = (yT - yB).ravel()
+        chunk['centY'] = yB.ravel() + chunk['sizeY']/2.0
+        chunk['zB'] = zB.ravel()
+        chunk['zT'] = zT.ravel()
+        chunk['material'] = material.ravel()
+        self.chunks.append(chunk)
+        self.numBlocks += chunk.size
+        
+    def elementKey(self, line) :
+        # everything the blocks of the laid-out line or connector depend on
+        if line.type == 'connector' :
+            reference = line.start.attached_to.property
+            return ('connector', line.start.x, line.start.y, line.end.y, 
+                    self.propertyKey(line.property), reference['padding'], reference['grooves']['depth'], 
+                    repr(reference['materials']['up']))
+        return ('line', line.start.x, line.start.y, line.start.skip, 
+                line.end.x, line.end.y, line.weak_space_up, line.weak_space_down, 
+                self.propertyKey(line.property))
+    
+    def propertyKey(self, property) :
+        # the properties are shared by many elements (see collectionLines.shareProperty)
+        # and they aren't changed, so each is represented once
+        key = self.propertyKeys.get(id(property))
+        if key == None :
+            key = self.propertyKeys[id(property)] = (property, repr(property))
+        return key[1]
+    
+    def addElement(self, line) :
+        # adds the line or the connector, with the cache the blocks of the element
+        # laid out the same way before are reused
+        if self.cache == None :
+            if line.type == 'connector' :
+                self.addConnector(line)
+            else :
+                self.addLine(line)
+            return
+        
+        key = self.elementKey(line)
+        first, numChunks, numRepeats = self.numBlocks, len(self.chunks), len(self.repeats)
+        entry = self.cache.elements.get(key)
+        if entry != None :
+            # the chunks of the cache are never changed (see shift)
+            chunk, repeats = entry
+            self.chunks.append(chunk)
+            self.numBlocks += chunk.size
+            if len(repeats) > 0 :
+                self.repeats.extend((first + repeat[0],) + repeat[1:] for repeat in repeats)
+            self.numReused += 1
+        else :
+            if line.type == 'connector' :
+                self.addConnector(line)
+            else :
+                self.addLine(line)
+            chunk = join_blocks(self.chunks[numChunks:]) if len(self.chunks) > numChunks + 1 \
+                else self.chunks[numChunks]
+            entry = (chunk, [(repeat[0] - first,) + repeat[1:] for repeat in self.repeats[numRepeats:]])
+        self.newElements[key] = entry
+    # end of addElement
+    
+    def shift(self, shiftX, shiftY) :
+        # moves the blocks by the shift centering the structure (see collectionLines.setCenter)
+        # once all elements are added. With the cache, the media are numbered in the order 
+        # they appear in the table from here on, as they are numbered without the cache
+        table = join_blocks(self.chunks)
+        table['centX'] += shiftX
+        table['centY'] += shiftY
+        if self.cache != None :
+            used, first = np.unique(table['material'], return_index = True)
+            used = used[np.argsort(first)]
+            numbers = np.zeros(len(self.materials), dtype = np.int32)
+            numbers[used] = np.arange(used.size, dtype = np.int32)
+            table['material'] = numbers[table['material']]
+            self.materials = [self.materials[num] for num in used.tolist()]
+            self.keyMaterials = dict((tuple(sorted(medium.items())), num) 
+                                     for num, medium in enumerate(self.materials))
+        self.chunks = [table]
+    
+    def addLine(self, line) :
+        # expands the line into flat parts and grooves
+        # 1. Add an "incomplete" block due to initial skip of a part of the period
+        # 2. Add proper periods
+        # 3. Add possible "incomplete" block at the end
+        x1 = line.start.x
+        # in what follows x1 denotes the cursor position
+        x2 = line.end.x
+        y1 = line.start.y
+        y2 = line.end.y
+        length_rest = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+        # TODO: direction
+        
+        props = line.property
+        period = float(props["grooves"]["period"])
+        len_groove = props['grooves']['width']
+        len_flat = period - len_groove
+        
+        # the parts are collected as the list of their ends and kinds (True for grooves)
+        edges = [x1]
+        kinds = []
+        numperiods = None
+        
+        len_start_left = period*(1 - line.start.skip)
+        len_start_flat_left = len_start_left - len_groove
+        
+        if len_start_flat_left > 0 and length_rest < len_start_flat_left :
+            # we have a short line that doesn't cover the rest of the flat part
+            edges.append(x2)
+            kinds.append(False)
+        else :
+            if len_start_flat_left > 0 :
+                # at least the flat part is covered
+                edges.append(x1 + len_start_flat_left)
+                kinds.append(False)
+                len_start_left -= len_start_flat_left # == props['grooves']['width']
+                length_rest -= len_start_flat_left
+                # the cursor is at the beginning of the groove in the incomplete part
+            len_start_groove_left = len_start_left
+            
+            if length_rest < len_start_groove_left :
+                edges.append(edges[-1] + length_rest)
+                kinds.append(True)
+            else :
+                edges.append(edges[-1] + len_start_groove_left)
+                kinds.append(True)
+                length_rest -= len_start_groove_left
+                # The starting part is done now to proper periods
+                numperiods = int(length_rest/period)
+        
+        if numperiods == None :
+            edges = np.array(edges)
+            kinds = np.array(kinds)
+        else :
+            steps = np.empty(2*numperiods)
+            steps[0::2] = len_flat
+            steps[1::2] = len_groove
+            # cumsum accumulates the cursor the same way as the step-by-step addition
+            edges = np.concatenate((edges[:-1], np.cumsum(np.concatenate(([edges[-1]], steps)))))
+            if numperiods > 1 :
+                self.repeats.append((self.numBlocks + 3*len(kinds), 6, numperiods, period))
+            kinds = np.concatenate((kinds, np.tile([False, True], numperiods)))
+            # the periods are subtracted one by one as well, at once the remainder is
+            # rounded differently and on long lines it may fall on the other side of len_flat
+            length_rest = np.subtract.accumulate(np.concatenate(([length_rest],
+                                                                 np.full(numperiods, period))))[-1]
+
+            # Now we deal with the tail
+            x1 = edges[-1]
+            if length_rest > len_flat :
+                edges = np.append(edges, [x1 + len_flat, x1 + len_flat + (length_rest - len_flat)])
+                kinds = np.append(kinds, [False, True])
+            else :
+                edges = np.append(edges, x1 + length_rest)
+                kinds = np.append(kinds, False)
+        
+        self.addParts(line, edges[:-1], edges[1:], kinds)
+    # end of addLine
+    
+    def addParts(self, line, xL, xR, isGroove) :
+        # adds three blocks (up metal, channel, down metal) for every part of the line 
+        props = line.property
+        materials = props['materials']
+        y = line.start.y
+        depth = np.where(isGroove, props['grooves']['depth'], 0.0)
+        
+        yTop = np.empty((len(xL), 3))
+        yBottom = np.empty((len(xL), 3))
+        # the up metal part
+        yBottom[:, 0] = y + 0.5*props['width'] + depth
+        yTop[:, 0] = y + line.weak_space_up
+        # the middle part
+        yTop[:, 1] = yBottom[:, 0]
+        yBottom[:, 1] = yTop[:, 1] - props['width'] - 2.0*depth
+        # lower metallic part
+        yTop[:, 2] = yBottom[:, 1]
+        yBottom[:, 2] = y - line.weak_space_down
+        
+        listMaterials = [self.addMaterial(materials[part]) for part in ("up", "in", "down")]
+        self.addBlocks(listMaterials, xL[:, None], xR[:, None], yBottom, yTop, 
+                       -props['elevation'], props['elevation'])
+    # end of addParts
+    
+    def addConnector(self, line) :
+        # this is three block system
+        props = line.property
+        x1 = line.start.x
+        y1 = line.start.y
+        y2 = line.end.y
+        xLeft = x1 - 0.5*props['width']
+        xRight = x1 + 0.5*props['width']
+        reference = line.start.attached_to.property
+        # top block, middle dielectric, bottom
+        yTop = [y2 + reference['padding'] + reference['grooves']['depth'], y2, y1]
+        yBottom = [y2, y1, y1 - reference['padding'] - reference['grooves']['depth']]
+        listMaterials = [self.addMaterial(reference['materials']["up"]), 
+                         self.addMaterial(props['materials']["in"]), 
+                         self.addMaterial(reference['materials']["up"])]
+        self.addBlocks(listMaterials, xLeft, xRight, yBottom, yTop, 
+                       -props['elevation'], props['elevation'])
+        
+        # TODO: patches
+        # if is not attached on side : side.cover(whole)
+        # else: side.cover(whole - width_of_attached_lines)
+        # if not end.attached (to another connector) : add_terminating_block
+    # end of addConnector
+    
+    def optimize(self) :
+        # Drops blocks of zero volume and merges touching blocks of the same material
+        # into larger rectangles. Returns the number of removed blocks.
+        # The union of blocks of each material is cut into horizontal slabs at every
+        # y-coordinate, touching intervals are merged inside slabs and then identical 
+        # intervals of neighbouring slabs are merged. The blocks of different materials 
+        # must not overlap (Meep would resolve the overlap by the order of blocks), 
+        # otherwise only the blocks of zero volume are removed.
+        # Comments cannot be attributed to elements after that and are dropped
+        table = self.getTable()
+        numBlocks = table.size
+        table = table[(np.abs(table['sizeX']) >= Tolerance) & (np.abs(table['sizeY']) >= Tolerance)]
+        
+        chunks = []
+        for zB, zT in np.unique(np.stack((table['zB'], table['zT']), axis = 1), axis = 0) :
+            inZ = (table['zB'] == zB) & (table['zT'] == zT)
+            xL, xR, yB, yT = self.toGrid(table[inZ])
+            ys = np.unique(np.concatenate((yB, yT)))
+            runs = self.slabRuns(xL, xR, yB, yT, table['material'][inZ], ys)
+            if runs == None :
+                print("Geometry optimization: blocks of different materials overlap, only empty blocks are removed")
+                chunks = [table]
+                break
+            chunks.append(self.fromGrid(self.stackRuns(runs, ys.tolist()), zB, zT))
+        
+        optimized = np.concatenate(chunks) if len(chunks) > 0 else table
+        if optimized.size > table.size :
+            # slabs may fragment blocks in unlucky arrangements
+            optimized = table
+        self.chunks = [optimized]
+        self.numBlocks = optimized.size
+        self.comments = []
+        self.repeats = []
+        return numBlocks - optimized.size
+    # end of optimize
+    
+    def invert(self, xL, xR, yB, yT, zCell = None) :
+        # Finds the material occupying the largest area of the cell (xL, xR, yB, yT), 
+        # the parts of the cell not covered by blocks (e.g. the overshot margin) are vacuum.
+        # The table is replaced by the blocks of the other materials (including vacuum).
+        # zCell is the half of the vertical size of the cell in 3d, the vacuum layers 
+        # above and below the elements are added then.
+        # Returns the index of the dominant material or None if it cannot be done
+        table = self.getTable()
+        table = table[(np.abs(table['sizeX']) >= Tolerance) & (np.abs(table['sizeY']) >= Tolerance)]
+        if np.unique(np.stack((table['zB'], table['zT']), axis = 1), axis = 0).shape[0] > 1 :
+            print("Background material: elements of different heights are not supported")
+            return None
+        
+        vacuum = self.addMaterial({'medium': 'dielectric', 'epsilon': 1})
+        left, right, bottom, top = [int(value) for value in 
+                                    np.rint(np.array([xL, xR, yB, yT])*round(1.0/Tolerance))]
+        xL, xR, yB, yT = self.toGrid(table)
+        # only the parts inside the cell matter
+        xL, xR = np.clip(xL, left, right), np.clip(xR, left, right)
+        yB, yT = np.clip(yB, bottom, top), np.clip(yT, bottom, top)
+        ys = np.unique(np.concatenate((yB, yT, [bottom, top])))
+        runs = self.slabRuns(xL, xR, yB, yT, table['material'], ys)
+        if runs == None :
+            print("Background material: blocks of different materials overlap")
+            return None
+        runs = self.fillGaps(runs, len(ys) - 1, left, right, vacuum)
+        
+        areas = np.zeros(len(self.materials))
+        for s, runL, runR, mat in runs :
+            areas[mat] += float(runR - runL)*float(ys[s + 1] - ys[s])
+        background = int(np.argmax(areas))
+        
+        runs = [run for run in runs if run[3] != background]
+        zB, zT = (table['zB'][0], table['zT'][0]) if table.size > 0 else (0.0, 0.0)
+        chunks = [self.fromGrid(self.stackRuns(runs, ys.tolist()), zB, zT)]
+        if zCell != None and background != vacuum :
+            # vacuum above and below the elements
+            for zLayerB, zLayerT in ((max(zB, zT), zCell), (-zCell, min(zB, zT))) :
+                if zLayerT - zLayerB > Tolerance :
+                    chunks.append(self.fromGrid([[left, right, bottom, top, vacuum]], zLayerB, zLayerT))
+        
+        self.chunks = [np.concatenate(chunks)]
+        self.numBlocks = self.chunks[0].size
+        self.comments = []
+        self.repeats = []
+        return background
+    # end of invert
+    
+    def toGrid(self, table) :
+        # coordinates of sides of blocks are compared on the grid with the step Tolerance
+        scale = round(1.0/Tolerance)
+        def to_grid(values) :
+            return np.rint(values*scale).astype(np.int64)
+        return to_grid(table['centX'] - table['sizeX']/2.0), to_grid(table['centX'] + table['sizeX']/2.0), \
+            to_grid(table['centY'] - table['sizeY']/2.0), to_grid(table['centY'] + table['sizeY']/2.0)
+        
+    def fromGrid(self, rects, zB, zT) :
+        # makes the chunk of blocks out of the list of [xL, xR, yB, yT, material] on the grid
+        scale = float(round(1.0/Tolerance))
+        rects = np.array(rects, dtype = np.int64).reshape(-1, 5)
+        chunk = np.empty(len(rects), dtype = BLOCK_DTYPE)
+        chunk['sizeX'] = (rects[:, 1] - rects[:, 0])/scale
+        chunk['centX'] = rects[:, 0]/scale + chunk['sizeX']/2.0
+        chunk['sizeY'] = (rects[:, 3] - rects[:, 2])/scale
+        chunk['centY'] = rects[:, 2]/scale + chunk['sizeY']/2.0
+        chunk['zB'] = zB
+        chunk['zT'] = zT
+        chunk['material'] = rects[:, 4]
+        return chunk
+    
+    def slabRuns(self, xL, xR, yB, yT, material, ys) :
+        # Splits the blocks over the horizontal slabs between neighbouring ys and merges 
+        # touching intervals of the same material inside every slab.
+        # Returns the list of [slab, xL, xR, material] ordered by slab and x
+        # or None if blocks of different materials overlap
+        slabB = np.searchsorted(ys, yB)
+        counts = np.searchsorted(ys, yT) - slabB
+        # every block is split over the slabs it crosses
+        num = np.repeat(np.arange(len(xL)), counts)
+        slab = slabB[num] + np.arange(len(num)) - np.repeat(np.cumsum(counts) - counts, counts)
+        order = np.lexsort((xL[num], slab))
+        num = num[order]
+        slab = slab[order]
+        
+        runs = []
+        for s, left, right, mat in zip(slab.tolist(), xL[num].tolist(), xR[num].tolist(), 
+                                       material[num].tolist()) :
+            if right <= left :
+                continue
+            if len(runs) > 0 and runs[-1][0] == s and left <= runs[-1][2] :
+                if mat == runs[-1][3] :
+                    runs[-1][2] = max(runs[-1][2], right)
+                    continue
+                if left < runs[-1][2] :
+                    return None
+            runs.append([s, left, right, mat])
+        return runs
+    # end of slabRuns
+    
+    def fillGaps(self, runs, numSlabs, left, right, filler) :
+        # adds intervals of the filler material to runs (see slabRuns) so that
+        # every slab is covered from left to right
+        res = []
+        def add_run(s, runL, runR, mat) :
+            if runR <= runL :
+                return
+            if len(res) > 0 and res[-1][0] == s and res[-1][3] == mat and res[-1][2] == runL :
+                res[-1][2] = runR
+            else :
+                res.append([s, runL, runR, mat])
+        # end of add_run
+        
+        pos = 0
+        for s in range(numSlabs) :
+            cursor = left
+            while pos < len(runs) and runs[pos][0] == s :
+                add_run(s, cursor, runs[pos][1], filler)
+                add_run(*runs[pos])
+                cursor = runs[pos][2]
+                pos += 1
+            add_run(s, cursor, right, filler)
+        return res
+    # end of fillGaps
+    
+    def stackRuns(self, runs, ys) :
+        # merges identical intervals (see slabRuns) of neighbouring slabs
+        # returns the list of rectangles [xL, xR, yB, yT, material]
+        rects = []
+        opened = {} # (xL, xR, material) -> [rectangle, the last slab]
+        for s, left, right, mat in runs :
+            key = (left, right, mat)
+            if key in opened and opened[key][1] == s - 1 :
+                opened[key][0][3] = ys[s + 1]
+                opened[key][1] = s
+            else :
+                opened[key] = [[left, right, ys[s], ys[s + 1], mat], s]
+                rects.append(opened[key][0])
+        return rects
+    # end of stackRuns
+    
+    def selectMaterials(self, materials) :
+        # keeps only the blocks made of the given materials
+        table = self.getTable()
+        self.chunks = [table[np.isin(table['material'], list(materials))]]
+        self.numBlocks = self.chunks[0].size
+        self.comments = []
+        self.repeats = []
+        
+    def rasterize(self, xL, xR, yB, yT, resolution, zCell = None, background = None) :
+        # Returns the arrays of epsilon and conductivity at the centers of pixels of 
+        # the cell (xL, xR, yB, yT) (and (-zCell, zCell) in 3d) at the given resolution.
+        # The uncovered parts are vacuum unless the background material is given, 
+        # later blocks take precedence (as in Meep)
+        table = self.getTable()
+        if background == None :
+            background = self.addMaterial({'medium': 'dielectric', 'epsilon': 1})
+        
+        def pixels(left, right, start, end) :
+            # pixel i has the center at start + (i + 0.5)/resolution
+            num = max(int(round((end - start)*resolution)), 1)
+            first = np.clip(np.ceil((left - start)*resolution - 0.5), 0, num).astype(int)
+            last = np.clip(np.ceil((right - start)*resolution - 0.5), 0, num).astype(int)
+            return num, first, last
+        # end of pixels
+        
+        nx, i0, i1 = pixels(table['centX'] - table['sizeX']/2.0, table['centX'] + table['sizeX']/2.0, xL, xR)
+        ny, j0, j1 = pixels(table['centY'] - table['sizeY']/2.0, table['centY'] + table['sizeY']/2.0, yB, yT)
+        shape = (nx, ny)
+        ranges = [i0, i1, j0, j1]
+        if zCell != None :
+            # blocks of no vertical size are infinite
+            infinite = np.abs(table['zT'] - table['zB']) < Tolerance
+            nz, k0, k1 = pixels(np.where(infinite, -zCell, np.minimum(table['zB'], table['zT'])), 
+                                np.where(infinite, zCell, np.maximum(table['zB'], table['zT'])), -zCell, zCell)
+            shape = (nx, ny, nz)
+            ranges += [k0, k1]
+        
+        rows = np.nonzero(np.all([ranges[2*n + 1] > ranges[2*n] for n in range(len(shape))], axis = 0))[0]
+        # the image is constant between the edges of the blocks, so it's made on the grid 
+        # of cells between the distinct edges along every axis and expanded into pixels at the end
+        edges = [np.unique(np.concatenate(([0, num], ranges[2*n][rows], ranges[2*n + 1][rows]))) 
+                 for n, num in enumerate(shape)]
+        ranges = [np.searchsorted(edges[n//2], ranges[n]) for n in range(len(ranges))]
+        cells = tuple(len(edge) - 1 for edge in edges)
+        corners = list(itertools.product((0, 1), repeat = len(cells)))
+        
+        def integral(image) :
+            # cumulative sums along every axis, with the leading zeros (summed-area table)
+            res = np.zeros(tuple(num + 1 for num in cells), dtype = np.int64)
+            res[tuple(slice(1, None) for num in cells)] = image
+            for axis in range(len(cells)) :
+                np.cumsum(res, axis = axis, out = res)
+            return res
+        # end of integral
+        
+        def coverage(selected) :
+            # the number of the selected blocks covering every cell: +-1 at the corners 
+            # of the blocks in the difference array, then the cumulative sums
+            diff = np.zeros(tuple(num + 1 for num in cells), dtype = np.int32)
+            for corner in corners :
+                np.add.at(diff, tuple(ranges[2*n + corner[n]][selected] for n in range(len(cells))), 
+                          -1 if sum(corner) % 2 else 1)
+            for axis in range(len(cells)) :
+                np.cumsum(diff, axis = axis, out = diff)
+            return diff[tuple(slice(0, num) for num in cells)]
+        # end of coverage
+        
+        def lastBlocks(selected) :
+            # the last of the selected blocks covering every cell (-1 if none), the cells 
+            # of the blocks are enumerated by batches of about RASTER_BATCH
+            lows = [ranges[2*n][selected].astype(np.int64) for n in range(len(cells))]
+            extents = [ranges[2*n + 1][selected] - lows[n] for n in range(len(cells))]
+            strides = [int(np.prod(cells[n + 1:])) for n in range(len(cells))]
+            sizes = np.prod(extents, axis = 0).astype(np.int64)
+            ends = np.cumsum(sizes)
+            last = np.full(int(np.prod(cells)), -1, dtype = np.int64)
+            start = 0
+            while start < len(selected) :
+                first = ends[start] - sizes[start]
+                stop = max(int(np.searchsorted(ends, first + RASTER_BATCH, 'right')), start + 1)
+                owner = np.repeat(np.arange(start, stop), sizes[start:stop])
+                # the position of the cell in its block, row-major as the image
+                offset = np.arange(first, ends[stop - 1]) - (ends - sizes)[owner]
+                cell = np.zeros(owner.size, dtype = np.int64)
+                for n in reversed(range(len(cells))) :
+                    offset, index = np.divmod(offset, extents[n][owner])
+                    cell += (lows[n][owner] + index)*strides[n]
+                np.maximum.at(last, cell, selected[owner])
+                start = stop
+            return last.reshape(cells)
+        # end of lastBlocks
+        
+        # one pass per material, the cells covered by blocks of one material only are done
+        image = np.full(cells, background, dtype = np.int32)
+        numCovering = np.zeros(cells, dtype = np.int32)
+        for material in np.unique(table['material'][rows]).tolist() :
+            covered = coverage(rows[table['material'][rows] == material]) > 0
+            image[covered] = material
+            numCovering += covered
+        # where blocks of different materials overlap the last one wins, only the blocks 
+        # reaching such cells are enumerated
+        overlaps = numCovering > 1
+        if overlaps.any() :
+            overlapSums = integral(overlaps)
+            reaching = np.zeros(len(rows), dtype = np.int64)
+            for corner in corners :
+                reaching += (-1 if (len(cells) - sum(corner)) % 2 else 1) * \
+                    overlapSums[tuple(ranges[2*n + corner[n]][rows] for n in range(len(cells)))]
+            last = lastBlocks(rows[reaching > 0])
+            image[overlaps] = table['material'][last[overlaps]]
+        for axis, edge in enumerate(edges) :
+            image = np.repeat(image, np.diff(edge), axis = axis)
+        
+        epsilon = np.array([float(medium['epsilon']) for medium in self.materials])
+        conductivity = np.array([float(medium['conductivity']) if medium['medium'] == 'metal' else 0.0 
+                                 for medium in self.materials])
+        return epsilon[image], conductivity[image]
+    # end of rasterize
+    
+    def isMirrorSymmetric(self, direction) :
+        # checks whether the map of materials is mapped onto itself by the mirror 
+        # flipping the given direction ('x' or 'y'), the cell is assumed to be centered.
+        # The maps are compared slab by slab as in optimize, overlapping blocks 
+        # of different materials are regarded as asymmetric
+        table = self.getTable()
+        table = table[(np.abs(table['sizeX']) >= Tolerance) & (np.abs(table['sizeY']) >= Tolerance)]
+        for zB, zT in np.unique(np.stack((table['zB'], table['zT']), axis = 1), axis = 0) :
+            inZ = (table['zB'] == zB) & (table['zT'] == zT)
+            xL, xR, yB, yT = self.toGrid(table[inZ])
+            if direction == 'x' :
+                imageL, imageR, imageB, imageT = -xR, -xL, yB, yT
+            else :
+                imageL, imageR, imageB, imageT = xL, xR, -yT, -yB
+            ys = np.unique(np.concatenate((yB, yT, imageB, imageT)))
+            runs = self.slabRuns(xL, xR, yB, yT, table['material'][inZ], ys)
+            images = self.slabRuns(imageL, imageR, imageB, imageT, table['material'][inZ], ys)
+            if runs == None or images == None or runs != images :
+                return False
+        return True
+    # end of isMirrorSymmetric
+    
+    def getIndex(self) :
+        # the spatial index of the blocks (see blockIndex)
+        return blockIndex(self.getTable())
+        
+    def getTable(self) :
+        if len(self.chunks) != 1 :
+            self.chunks = [join_blocks(self.chunks)]
+        return self.chunks[0]
+
+### end of class blockTable
+
+class translationCache(object) :
+    # What the translations of the same meta-configuration keep for the next one (see 
+    # ctlWatcher, sweeptri3.py): the blocks of the laid-out elements by blockTable.elementKey 
+    # (the coordinates before centering) with the media numbered once for all translations,
+    # and the code of the blocks written by the last translation (see MeepControl.formatBlocks)
+    
+    def __init__(self) :
+        self.elements = {}
+        self.materials = []
+        self.keyMaterials = {}
+        # (the patterns of the code, the hashes of the blocks sorted, the blocks as bytes 
+        # and their code in the same order)
+        self.code = None
+
+## end of class translationCache
+
+class blockIndex(object) :
+    # Uniform grid over the blocks of the table (in x and y) for finding the blocks 
+    # crossed by a box, a segment or a point. Every block is listed in the cells it covers,
+    # the blocks covering too many cells (backgrounds, merged slabs) are checked always.
+    # Blocks touching the box only count when the box is degenerate in that direction
+    
+    # the number of cells per block on average and the most cells a listed block covers
+    cellsPerBlock = 4
+    maxCells = 64
+    
+    def __init__(self, table) :
+        self.table = table
+        self.xL = table['centX'] - table['sizeX']/2.0
+        self.xR = table['centX'] + table['sizeX']/2.0
+        self.yB = table['centY'] - table['sizeY']/2.0
+        self.yT = table['centY'] + table['sizeY']/2.0
+        self.zB = np.minimum(table['zB'], table['zT'])
+        self.zT = np.maximum(table['zB'], table['zT'])
+        # blocks of no vertical size are infinite
+        self.infinite = self.zT - self.zB < Tolerance
+        
+        numBlocks = table.size
+        if numBlocks == 0 :
+            self.cell, self.nx, self.ny = 1.0, 1, 1
+            self.x0 = self.y0 = 0.0
+            self.starts = np.zeros(2, dtype = np.int64)
+            self.rows = np.empty(0, dtype = np.int64)
+            self.large = np.empty(0, dtype = np.int64)
+            return
+        
+        self.x0, self.y0 = self.xL.min(), self.yB.min()
+        extentX, extentY = self.xR.max() - self.x0, self.yT.max() - self.y0
+        # typical blocks cover a cell or so, the grid isn't finer than needed
+        self.cell = max(float(np.median(np.maximum(table['sizeX'], table['sizeY']))), 
+                        np.sqrt(extentX*extentY/(self.cellsPerBlock*numBlocks)), Tolerance)
+        self.nx = int(extentX/self.cell) + 1
+        self.ny = int(extentY/self.cell) + 1
+        
+        i0, i1 = self.cells(self.xL, self.xR, self.x0, self.nx)
+        j0, j1 = self.cells(self.yB, self.yT, self.y0, self.ny)
+        width = i1 - i0 + 1
+        counts = width*(j1 - j0 + 1)
+        large = counts > self.maxCells
+        self.large = np.nonzero(large)[0]
+        counts[large] = 0
+        
+        # (cell, row) pairs of all listed blocks sorted by cells
+        rows = np.repeat(np.arange(numBlocks), counts)
+        offsets = np.arange(rows.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (j0[rows] + offsets//width[rows])*self.nx + i0[rows] + offsets % width[rows]
+        order = np.argsort(cells, kind = 'stable')
+        self.rows = rows[order]
+        self.starts = np.searchsorted(cells[order], np.arange(self.nx*self.ny + 1))
+    # end of __init__
+    
+    def cells(self, low, high, origin, num) :
+        # the ranges of cells covered by the intervals
+        return np.clip(np.floor((low - origin)/self.cell).astype(np.int64), 0, num - 1), \
+            np.clip(np.floor((high - origin)/self.cell).astype(np.int64), 0, num - 1)
+    
+    def query(self, xL, xR, yB, yT, zB = None, zT = None) :
+        # Returns the rows of the blocks crossed by the box, z is ignored if it's not given
+        i0, i1 = [int(i) for i in self.cells(xL - Tolerance, xR + Tolerance, self.x0, self.nx)]
+        j0, j1 = [int(j) for j in self.cells(yB - Tolerance, yT + Tolerance, self.y0, self.ny)]
+        candidates = [self.large]
+        for j in range(j0, j1 + 1) :
+            candidates.append(self.rows[self.starts[j*self.nx + i0] : self.starts[j*self.nx + i1 + 1]])
+        rows = np.unique(np.concatenate(candidates))
+        
+        def crossed(low, high, qLow, qHigh) :
+            if qHigh - qLow < Tolerance :
+                return (low[rows] - Tolerance <= qLow) & (qHigh <= high[rows] + Tolerance)
+            return np.minimum(high[rows], qHigh) - np.maximum(low[rows], qLow) > Tolerance
+        # end of crossed
+        
+        hits = crossed(self.xL, self.xR, xL, xR) & crossed(self.yB, self.yT, yB, yT)
+        if zB != None :
+            hits &= self.infinite[rows] | crossed(self.zB, self.zT, zB, zT)
+        return rows[hits]
+    
+    def grooves(self, rows) :
+        # Returns the rows which are grooves: the block is taller than the block 
+        # of the same material and the same center next to it (the flat part)
+        res = []
+        for row in rows.tolist() :
+            block = self.table[row]
+            for x in (self.xL[row], self.xR[row]) :
+                near = self.query(x, x, block['centY'], block['centY'])
+                near = near[(self.table['material'][near] == block['material']) 
+                            & (np.abs(self.table['centY'][near] - block['centY']) < Tolerance) 
+                            & (self.table['sizeY'][near] < block['sizeY'] - Tolerance)]
+                if near.size > 0 :
+                    res.append(row)
+                    break
+        return res
+
+## end of class blockIndex
         
 ### class ctlInfo and its Exceptions
 class InfoException(Exception) :
@@ -508,24 +1831,35 @@ class InfoException(Exception) :
 class ctlInfo(clYAML) :
     # the class dealing with the configuration data
     
-    # comments on the content
-    numWarnings = 0
-    bufWarnings = []
-    numErrors = 0
-    bufErrors = []
-    
-    def __init__(self, iniFileName = None) :
+    def __init__(self, iniFileName = None, data = None, layout = None) :
+        # data is the already parsed configuration, iniFileName names it then
+        # layout is the layout of the elements kept from before (instance of elementLayout)
+        # comments on the content
+        self.numWarnings = 0
+        self.bufWarnings = []
+        self.numErrors = 0
+        self.bufErrors = []
+        
         self.zSize = -1.0 # by default structures are 2d
         
         self.colLines = collectionLines()
         self.listFluxPoints = []
         self.listSources = []
         self.listTransients = []    
+        self.listSpectralFields = [] # fields at points accumulated by the DFT
+        self.layout = layout
         
-        super(ctlInfo, self).__init__("gen.ini" if iniFileName == None else iniFileName)
+        super(ctlInfo, self).__init__("gen.ini" if iniFileName == None else iniFileName, data)
         self.topComment = self.getSection('comment')
     
     
+    def keptData(self, Data) :
+        # the elements are laid out without changing them
+        try :
+            return [Data['Geometry']['elements']]
+        except (KeyError, TypeError) :
+            return []
+    
     def subvalidate (self) :
         
         if not 'version' in dict(self.Data) :
@@ -554,10 +1888,10 @@ class ctlInfo(clYAML) :
                         self.setError("The point refers to unknown element")
                         return False
     
-                    point['x'] += refelem[point['point']]['x']
-                    point['y'] += refelem[point['point']]['y']
+                    point['x'] += refelem.point(point['point']).x
+                    point['y'] += refelem.point(point['point']).y
     
-                    point['width'] *= refelem['property']['width']
+                    point['width'] *= refelem.property['width']
                 return True
             # end adjust_for_relative (source version)
     
@@ -580,10 +1914,10 @@ class ctlInfo(clYAML) :
                         self.setError("The point refers to uknown element")
                         return False
     
-                    point['x'] += refelem[point['point']]['x']
-                    point['y'] += refelem[point['point']]['y']
+                    point['x'] += refelem.point(point['point']).x
+                    point['y'] += refelem.point(point['point']).y
     
-                    point['width'] *= refelem['property']['width']
+                    point['width'] *= refelem.property['width']
                 return True
             # end adjust_for_relative (observer version, same as for sources)            
     
@@ -603,7 +1937,8 @@ class ctlInfo(clYAML) :
             self.listTransients.append(obs)
             return True
             
-        def addSnapLocal(obs) :
+        def addSnapLocal(obs, listTarget) :
+            # the local field, sampled in time (temporal) or accumulated by the DFT (spectral)
             def adjust_for_relative(point) :
                 if not "ref" in dict(point) :
                     return True
@@ -613,8 +1948,8 @@ class ctlInfo(clYAML) :
                     self.setError("The point refers to uknown element")
                     return False
         
-                point['x'] += refelem[point['point']]['x']
-                point['y'] += refelem[point['point']]['y']
+                point['x'] += refelem.point(point['point']).x
+                point['y'] += refelem.point(point['point']).y
                 return True
             # end adjust_for_relative (local snapshot)
             
@@ -625,7 +1960,7 @@ class ctlInfo(clYAML) :
                 if not self.colLines.isInside(pos['x'], pos['y']) :
                     self.setWarning("The field collecting point is outside")
                     
-                self.listTransients.append(obs)
+                listTarget.append(obs)
                 return True
         # end of addSnapLocal
             
@@ -645,27 +1980,40 @@ class ctlInfo(clYAML) :
         if numLines == 0 :
             self.setWarning("The list of elements is empty")
         else :
-            count = 0
-            for line in listElem :
-                print("Processing element: ", count, " type: ", list(line.keys())[0])
-                count += 1
-                
-                if 'line' in dict(line):
-                    self.colLines.addLine(copy.deepcopy(line['line']))
-                elif 'connector' in dict(line) :
-                    self.colLines.addConnector(copy.deepcopy(line['connector']))
-            # end loop over elements
+            # elements may refer to the elements listed after them
+            listElem = self.colLines.orderElements(listElem)
+            if listElem == None :
+                self.setError("The order of elements cannot be resolved")
+                return False
             
-            # IMPORTANT TODO: this should be done _after_ all elements are added since some elements
-            # below can enter with absolute coordinates!
-            self.colLines.setCenter()
-            print("The elements are confined within (X: %s, %s) (Y: %s, %s) (Z: %s, %s)" 
-                  % (self.colLines.MinX, self.colLines.MaxX, self.colLines.MinY, self.colLines.MaxY, 
-                     self.colLines.MinZ, self.colLines.MaxZ))
+            profile_phase('layout')
+            if self.layout != None :
+                # only what is changed since the last time is laid out and settled again
+                settled = self.layout.update(self.colLines, listElem)
+            else :
+                count = 0
+                for line in listElem :
+                    log(1, "Processing element: %s type: %s" % (count, list(line.keys())[0]))
+                    count += 1
+                    
+                    # the elements are laid out without changing the configuration
+                    if 'line' in dict(line):
+                        self.colLines.addLine(line['line'])
+                    elif 'connector' in dict(line) :
+                        self.colLines.addConnector(line['connector'])
+                # end loop over elements
+                profile_count('elements', count)
+                
+                # The limits are fixed before the paddings are adjusted by settleConflicts
+                profile_phase('settle_conflicts')
+                self.colLines.setLimits()
+                settled = self.colLines.settleConflicts()
             
-            if not self.colLines.settleConflicts() :
+            if not settled :
+                profile_stop()
                 self.setError("Conflicts couldn't be resolved")
                 return False
+            profile_stop()
         # end of processing lines and connector
 
         # sources
@@ -687,16 +2035,33 @@ class ctlInfo(clYAML) :
                 # TODO: implement full interface for spectral observers
                 if 'flux' in dict(col) :
                     addFluxPoint(col)
+                if 'field' in dict(col) :
+                    if not addSnapLocal(col, self.listSpectralFields) : return False
                     
         if 'temporal' in dict(listElem) :
             # temporal observers (snapshots)
             listObs = listElem['temporal']
             for col in listObs :
-                print("Processing temporal observable: %s" % col.keys())
+                log(1, "Processing temporal observable: %s" % col.keys())
                 if 'snapshot' in dict(col) :
                     if not addSnapshots(col) : return False
                 if 'field' in dict(col) :
-                    if not addSnapLocal(col) : return False
+                    if not addSnapLocal(col, self.listTransients) : return False
+        
+        # Now everything that can enter with absolute coordinates is in and we can center
+        # the structure
+        listPoints = [source['position'] for source in self.listSources] \
+            + [obs['position'] for obs in self.listFluxPoints] \
+            + [obs['field']['position'] for obs in self.listTransients if 'field' in dict(obs)] \
+            + [obs['field']['position'] for obs in self.listSpectralFields] \
+            + [obs['snapshot']['volume'] for obs in self.listTransients 
+               if 'snapshot' in dict(obs) and isinstance(obs['snapshot'].get('volume'), dict)]
+        profile_phase('set_center')
+        self.colLines.setCenter(listPoints)
+        profile_stop()
+        print("The elements are confined within (X: %s, %s) (Y: %s, %s) (Z: %s, %s)" 
+              % (self.colLines.MinX, self.colLines.MaxX, self.colLines.MinY, self.colLines.MaxY, 
+                 self.colLines.MinZ, self.colLines.MaxZ))
                 
         return True
     # end of subvalidate
@@ -722,6 +2087,8 @@ class ctlInfo(clYAML) :
     def commentProvided(self, element = None) :
         if not element :
             return self.topComment
+        elif isinstance(element, lineElement) :
+            return element.comment
         elif 'comment' in dict(element) :
             return element['comment']
         else :
@@ -729,6 +2096,32 @@ class ctlInfo(clYAML) :
 
     def getCtlName(self) :
         return self.nameCtlFile
+    
+    def getTightCell(self, margin) :
+        # Returns the width and the height of the smallest centered cell keeping 
+        # the structure (with the cladding and connectors), sources, flux regions and 
+        # field probes at the margin (PML and clearance) from the boundaries on all sides, 
+        # so no block lies in PML
+        MinX, MaxX, MinY, MaxY, MinZ, MaxZ = self.colLines.getLimits()
+        halfX = max(abs(MinX), abs(MaxX)) + margin
+        halfY = max(abs(MinY), abs(MaxY)) + margin
+        shiftX, shiftY = self.colLines.shiftX, self.colLines.shiftY
+        for line in self.colLines.listLines :
+            if line.type == 'connector' :
+                # connectors aren't in the limits, they may stick out of the lines they join
+                reference = line.start.attached_to.property
+                cover = reference['padding'] + reference['grooves']['depth']
+                halfX = max(halfX, abs(line.start.x + shiftX) + 0.5*line.property['width'] + margin)
+                halfY = max(halfY, abs(line.start.y + shiftY) + cover + margin, 
+                            abs(line.end.y + shiftY) + cover + margin)
+        regions = [(obj['position'], obj['position']['width']*0.5) 
+                   for obj in self.listSources + self.listFluxPoints] \
+            + [(obs['field']['position'], 0) for obs in self.listTransients if 'field' in dict(obs)] \
+            + [(obs['field']['position'], 0) for obs in self.listSpectralFields]
+        for pos, halfWidth in regions :
+            halfX = max(halfX, abs(pos['x']) + margin)
+            halfY = max(halfY, abs(pos['y']) + halfWidth + margin)
+        return 2*halfX, 2*halfY
 
 ## end of class ctlInfo and its Exceptions
 
@@ -738,23 +2131,57 @@ class MeepException(Exception) :
     def __init__ (self) :
         pass
 
+class PlacementException(MeepException) :
+    """Sources, flux regions or field probes are placed wrongly (see check_placements)"""
+    def __init__ (self, errors) :
+        self.errors = errors
+        
+    def __str__(self) :
+        return "; ".join(self.errors)
+
 class MeepControl (object) :
     # this class deals with the data going into the Meep control file
+    # The lines are streamed to the file as they are formed, the file is written under
+    # a temporary name and renamed by dump, so the unfinished file is never mistaken 
+    # for the control file
     
-    # buffer is an array of strings that will be dumped into the control file
-    buffer = []
+    # blocks of the table are formatted by chunks of this size 
+    chunkBlocks = 4096
 
-    def __init__(self, outFileName, rcFileName = "gen.rc") :
+    def __init__(self, outFileName, rcFileName = "gen.rc", iniData = None) :
+        # rcFileName may be the already loaded resources (instance of genResource)
+        # if outFileName is None, the file is kept in memory and returned by dump
         self.bufStr = "" # the current line
-        self.rcData = genResource(rcFileName)
+        self.rcData = rcFileName if isinstance(rcFileName, genResource) else genResource(rcFileName)
         if not self.rcData.isValid :
             sys.exit("Fatal error: The resource file is corrupted!")        
         self.FileName = outFileName
+        if outFileName == None :
+            self.partFileName = None
+            self.ctlFile = io.StringIO()
+        else :
+            self.partFileName = outFileName + ".part"
+            try:
+                self.ctlFile = open(self.partFileName, "w", buffering = 1 << 16)
+            except IOError :
+                # TODO: raise proper exceptions
+                print("Couldn't open ctl file")
+                raise
+        # the hash of the simulation is accumulated as the lines are written
+        self.digest = hashlib.sha256()
+        self.epsilonInput = None
         # accumulators of flux points and transients
         self.countFluxPoints = 0
         self.lineFluxCode = ""
         self.countTransients = 0
         self.lineTransCode = ""
+        self.countDFTFields = 0
+        self.lineDFTCode = ""
+        self.singlePrecision = False
+        # the control file while the lines go to the shared geometry (see startInclude)
+        self.runFile = None
+        # whether the file is dumped or discarded
+        self.finished = False
                 
         self.Code = self.rcData.getSection("Code")
         
@@ -763,22 +2190,40 @@ class MeepControl (object) :
         self.Header = resources
         self.add_comment(resources["intro"])
         self.add_comment(resources['gendata']['header'] + datetime.now().strftime("%Y/%m/%d %H:%M"))
-        self.add_comment(resources['gendata']["base"] + iniData.iniFileName)
-        comm = iniData.commentProvided()
-        if comm :
-            self.add_comment(comm)
+        if iniData != None :
+            self.add_comment(resources['gendata']["base"] + iniData.iniFileName)
+            comm = iniData.commentProvided()
+            if comm :
+                self.add_comment(comm)
     # end of __init__
             
     def setComplexFields(self, flag = 'true') :
         self.add_string(self.Header["complexity"] % flag)
                     
-    def addSnapshot(self, props, time_step) :
+    def addSnapshot(self, props, time_step, volume = None) :
+        # volume is (center x, y, size x, y, z) of the part of the cell written
+        # props may limit the time window (start, stop), ask for the single precision 
+        # and the spatial stride (applied after the run by h5stride.py)
         field = props['field']
         component = props['component']
         fname = field + component
         
+        if volume == None :
+            body = self.Code['snapshot'] % (fname, time_step, field, component)
+        else :
+            body = self.Code['snapshot_volume'] % ((fname, time_step) + tuple(volume) + (field, component))
+        if 'stop' in dict(props) and props['stop'] != None :
+            body = self.Code['before_time'] % (props['stop'], body)
+        if 'start' in dict(props) and props['start'] != None :
+            body = self.Code['after_time'] % (props['start'], body)
+        if 'single' in dict(props) and props['single'] and not self.singlePrecision :
+            self.add_string(self.Code['single_precision'])
+            self.singlePrecision = True
+        if 'stride' in dict(props) and int(props['stride']) > 1 :
+            self.add_string(self.Code['output_stride'] % (fname, int(props['stride'])))
+        
         varName = 'transient%s' % self.countTransients
-        self.addFunction(name = varName, body = self.Code['snapshot'] % (fname, time_step, field, component))
+        self.addFunction(name = varName, body = body)
         self.lineTransCode += " " + varName
         self.countTransients += 1
         
@@ -796,14 +2241,56 @@ class MeepControl (object) :
         self.lineTransCode += " " + varName
         self.countTransients += 1
                 
+    def addDFTField(self, props, pos_x, pos_y) :
+        # the field at the point is Fourier transformed while the run goes, only 
+        # the amplitudes at the frequencies are written after the run
+        field = props['field']
+        component = props['component']
+        freqs = props['property']
+        fname = field + component + '-dft-%s' % self.countDFTFields
+        
+        varName = 'dft%s' % self.countDFTFields
+        self.addFunction(name = varName, body = self.Code['dft_field'] % \
+                         (field.upper() + component, freqs['center'], freqs['width'], freqs['resolution'], 
+                          pos_x, pos_y))
+        self.lineDFTCode += self.Code['dft_output'] % (varName, fname)
+        self.countDFTFields += 1
+        
+    def finalizeDFTFields(self) :
+        if self.countDFTFields > 0 :
+            self.add_string(self.lineDFTCode.strip())
+        
     def add_string(self, add_str) :
         self.bufStr = add_str
         self.push()
         
+    def add_lines(self, lines) :
+        # adds the lines at once, they are hashed at once unless the hash changes them
+        # (see hash_ctl_line)
+        if len(lines) == 0 :
+            return
+        text = "\n".join(lines) + "\n"
+        self.ctlFile.write(text)
+        if text.startswith(";") or "\n;" in text or "(include" in text \
+           or (self.epsilonInput != None and self.epsilonInput in text) :
+            for line in lines :
+                hash_ctl_line(self.digest, line, self.epsilonInput)
+        else :
+            self.digest.update(text.encode())
+        
     def push(self) :
-        self.buffer.append(self.bufStr)
+        self.ctlFile.write(self.bufStr + "\n")
+        hash_ctl_line(self.digest, self.bufStr, self.epsilonInput)
         self.bufStr = ""
         
+    def getHash(self, raster = None) :
+        # the canonical hash of the simulation: the control file without comments 
+        # and the structure loaded by epsilon-input-file (epsilon, conductivity)
+        digest = self.digest.copy()
+        if raster != None :
+            hash_raster(digest, *raster)
+        return digest.hexdigest()
+        
     def add_comment(self, add_str) :
         self.add_string("; " + add_str)
         
@@ -812,26 +2299,71 @@ class MeepControl (object) :
         self.bufStr += add_str
         
     def dump(self):
+        # finishes the file, returns the text if it's kept in memory
+        if self.partFileName == None :
+            return self.ctlFile.getvalue()
         print("The output is written to: ", self.FileName)
+        self.ctlFile.close()
         try:
-            with open(self.FileName, "w") as ctlFile :
-                for str in self.buffer :
-                    ctlFile.write(str + "\n")
-        except IOError :
+            os.replace(self.partFileName, self.FileName)
+            self.finished = True
+        except OSError :
             # TODO: raise proper exceptions
-            print("Couldn't open ctl file")
+            print("Couldn't write ctl file")
             raise
 
+    def discard(self) :
+        # drops the unfinished file, nothing is done once it's dumped
+        if self.partFileName != None and not self.finished :
+            (self.ctlFile if self.runFile == None else self.runFile).close()
+            if os.path.exists(self.partFileName) :
+                os.remove(self.partFileName)
+            self.finished = True
+
+    def startInclude(self) :
+        # the following lines go to the geometry shared by the runs (see finishInclude)
+        self.runFile, self.ctlFile = self.ctlFile, io.StringIO()
+        self.runDigest, self.digest = self.digest, hashlib.sha256()
+        
+    def finishInclude(self, directory, raster = None, write = True) :
+        # writes the lines since startInclude to the directory unless the same geometry is 
+        # there already, the file is named by the hash of the lines and the structure loaded 
+        # by epsilon-input-file (raster), and includes it into the control file.
+        # Returns the name and the text of the shared file (only returned if not write)
+        key = self.getHash(raster)
+        text = self.ctlFile.getvalue()
+        self.ctlFile, self.digest = self.runFile, self.runDigest
+        self.runFile = None
+        
+        includeName = os.path.join(directory, self.Code["include_name"] % key[:16])
+        text = "; %s\n; %s%s\n" % (self.Header["intro"], self.Header["shared"], key) + text
+        if write :
+            if not os.path.isdir(directory) :
+                os.makedirs(directory, exist_ok = True)
+            
+            def writeInclude(fileName) :
+                with open(fileName, "w") as f :
+                    f.write(text)
+            if write_shared(includeName, writeInclude) :
+                print("The shared geometry is written to: %s" % includeName)
+            else :
+                print("The shared geometry is used: %s" % includeName)
+        
+        ctlDir = "." if self.FileName == None else os.path.dirname(self.FileName) or "."
+        self.add_string(self.Code["include"] % os.path.relpath(includeName, ctlDir))
+        return includeName, text
+
     def defineGeneralArea(self, size_x, size_y, size_z) :
         if size_z == None :
             size_z = 'no-size'
         self.add_string(self.Code["geometry"] %(size_x, size_y, size_z))
     
-    def startGeometry(self) :
-        self.add_string(self.Code["geometry_head"])
+    def startGeometry(self, duplicates = False) :
+        # with duplicates the geometry is a list of lists to be appended
+        self.add_string(self.Code["geometry_append_head" if duplicates else "geometry_head"])
         
-    def finalizeGeometry(self):
-        self.add_string(self.Code["geometry_tail"])
+    def finalizeGeometry(self, duplicates = False):
+        self.add_string(self.Code["geometry_append_tail" if duplicates else "geometry_tail"])
     
     def startSources(self) :
         self.add_string(self.Code["sources_head"])
@@ -841,7 +2373,6 @@ class MeepControl (object) :
 
     def addblock(self, medium, xL, xR, yB, yT, zB, zT) :
         # adds the piece of code corresponding to the block made of medium
-        # TODO: if medium is not understood, raise an exception
         sizeX = xR - xL
         centX = xL + sizeX/2.0
         sizeY = yT - yB 
@@ -855,17 +2386,121 @@ class MeepControl (object) :
     
         str = self.Code["block_position"] % (centX, centY, sizeX, sizeY, sizeZ)    
         self.form_line(str)
-    
-        if medium["medium"] == "metal" :
-            str = self.Code["block_metal"] % (medium["epsilon"], medium["conductivity"])
-        else :
-            # dielectric
-            str = self.Code["block_dielectric"] % medium["epsilon"]
-    
-        self.form_line(str)
+        self.form_line(self.formMedium(medium))
         self.form_line(self.Code["block_tail"])
         self.push()
+        
+    def formMedium(self, medium, bare = False) :
+        # bare media are not wrapped into (material ..)
+        # TODO: if medium is not understood, raise an exception
+        if medium["medium"] == "metal" :
+            return self.Code["medium_metal" if bare else "block_metal"] % (medium["epsilon"], medium["conductivity"])
+        # dielectric
+        return self.Code["medium_dielectric" if bare else "block_dielectric"] % medium["epsilon"]
+        
+    def setEpsilonInput(self, fileName) :
+        self.epsilonInput = fileName
+        self.add_string(self.Code["epsilon_input"] % fileName)
+        
+    def defineMaterials(self, blocks, background = None) :
+        # defines the media used in the table (instance of blockTable) and the background one
+        used = set(np.unique(blocks.getTable()['material']).tolist())
+        if background != None :
+            used.add(background)
+        for num in sorted(used) :
+            self.add_string(self.Code["material_define"] % 
+                            (self.Code["material_name"] % num, self.formMedium(blocks.materials[num], bare = True)))
+        
+    def setDefaultMaterial(self, num) :
+        self.add_string(self.Code["default_material"] % (self.Code["material_name"] % num))
+        
+    def addBlockTable(self, blocks, duplicates = False, cache = None) :
+        # adds all blocks of the table (instance of blockTable) together with comments
+        # if duplicates, the periodic parts of lines are given by one period duplicated
+        # by geometric-objects-duplicates. With the cache (instance of translationCache), 
+        # the code of the blocks written by the last translation is reused
+        table = blocks.getTable()
+        # the media are defined by defineMaterials
+        codeMaterials = [self.Code["block_material"] % (self.Code["material_name"] % num) 
+                         for num in range(len(blocks.materials))]
+        
+        code = None if cache == None else self.formatBlocks(table, codeMaterials, cache)
+        def add_blocks(first, last) :
+            # writes the blocks of the rows first, ..., last - 1
+            if code is not None :
+                self.add_lines(code[first : last])
+                return
+            for start in range(first, last, self.chunkBlocks) :
+                self.add_lines(self.formatRows(table[start : min(last, start + self.chunkBlocks)], 
+                                               codeMaterials))
+        # end of add_blocks
+        
+        # comments and duplicates are written in the order of their positions
+        # (a comment goes before the duplicates starting at the same block)
+        repeats = blocks.repeats if duplicates else []
+        events = [(pos, 0, comment) for pos, comment in blocks.comments] \
+            + [(repeat[0], 1, repeat) for repeat in repeats]
+        cursor = 0
+        for pos, kind, event in sorted(events, key = lambda event : event[:2]) :
+            add_blocks(cursor, pos)
+            cursor = max(cursor, pos)
+            if kind == 0 :
+                self.add_comment(event)
+            else :
+                first, numBlocks, numPeriods, period = event
+                self.add_string(self.Code["duplicates_head"] % (period, numPeriods - 1))
+                add_blocks(first, first + numBlocks)
+                self.add_string(self.Code["duplicates_tail"])
+                cursor = first + numBlocks*numPeriods
+        add_blocks(cursor, table.size)
 
+    def formatRows(self, rows, codeMaterials) :
+        # Returns the lines of code of the blocks (rows of blockTable)
+        pattern = self.Code["block_head"] + self.Code["block_position"] + "%s" + self.Code["block_tail"]
+        patternZ = self.Code["block_head"] + self.Code["block_position_z"] + "%s" + self.Code["block_tail"]
+        sizeZ = np.abs(rows['zT'] - rows['zB'])
+        listSizeZ = np.where(sizeZ < Tolerance, None, sizeZ).tolist()
+        centZ = (rows['zT'] + rows['zB'])/2.0
+        listCentZ = np.where(np.abs(centZ) < Tolerance, None, centZ).tolist()
+        res = []
+        for (centX, centY, sizeX, sizeY, _, _, material), sizeZ, centZ \
+                in zip(rows.tolist(), listSizeZ, listCentZ) :
+            if centZ == None :
+                res.append(pattern % (centX, centY, sizeX, sizeY, 
+                                      'infinity' if sizeZ == None else sizeZ, codeMaterials[material]))
+            else :
+                res.append(patternZ % (centX, centY, centZ, sizeX, sizeY, sizeZ, codeMaterials[material]))
+        return res
+    
+    def formatBlocks(self, table, codeMaterials, cache) :
+        # Returns the lines of code of all blocks of the table (the array of them). The line
+        # depends only on the row (the material is named by its number), so the lines of 
+        # the rows written by the last translation (see translationCache) are taken as they are.
+        # The rows are looked up by their hash and compared as bytes
+        patterns = tuple(self.Code[name] for name in ("block_head", "block_position", "block_position_z", 
+                                                      "block_tail", "block_material", "material_name"))
+        table = np.ascontiguousarray(table)
+        rows = table.view(np.dtype((np.void, table.dtype.itemsize)))
+        keys = np.zeros(table.size, dtype = np.uint64)
+        for word in table.view(np.uint32).reshape(table.size, table.dtype.itemsize//4).T :
+            keys = (keys*np.uint64(1000003)) ^ word
+        
+        code = np.empty(table.size, dtype = object)
+        missing = np.ones(table.size, dtype = bool)
+        if cache.code != None and cache.code[0] == patterns and cache.code[1].size > 0 :
+            _, oldKeys, oldRows, oldCode = cache.code
+            pos = np.minimum(np.searchsorted(oldKeys, keys), oldKeys.size - 1)
+            found = (oldKeys[pos] == keys) & (oldRows[pos] == rows)
+            code[found] = oldCode[pos[found]]
+            missing = ~found
+        missing = np.nonzero(missing)[0]
+        if missing.size > 0 :
+            code[missing] = self.formatRows(table[missing], codeMaterials)
+        profile_count('blocks_formatted', missing.size)
+        order = np.argsort(keys, kind = 'stable')
+        cache.code = (patterns, keys[order], rows[order], code[order])
+        return code
+    
     def addsource(self, props, xL, xR, yB, yT, zB, zT) :
         # adds the source 
         sizeX = xR - xL
@@ -891,7 +2526,15 @@ class MeepControl (object) :
         self.push()
         
     def addPML(self):
-        self.add_string(self.Code["pml"])
+        self.add_string(self.Code["pml"] % self.Code["pml_thickness"])
+        
+    def addSymmetries(self, mirrors) :
+        # mirrors is the list of (direction, phase)
+        self.form_line(self.Code["symmetries_head"])
+        for direction, phase in mirrors :
+            self.form_line(self.Code["symmetry_mirror"] % (direction.upper(), phase))
+        self.form_line(self.Code["symmetries_tail"])
+        self.push()
         
     def addresolution(self, res) :
         self.add_string(self.Code["resolution"] % res)
@@ -926,12 +2569,21 @@ class MeepControl (object) :
         
         self.add_string(str)
     
-    def startRunControl(self, property, **kwargs) : 
+    def startRunControl(self, property, outputEpsilon = True, **kwargs) : 
         # forms (run-* line 
         if property == 'decay':
             self.form_line(self.Code["time_decay"] % (kwargs['duration'], kwargs['pos_x'], kwargs['pos_y']))
         elif property == 'fixed' :
             self.form_line(self.Code["time_fixed"] % kwargs['duration'])
+        elif property == 'converge' :
+            # the condition checking the spectra of all flux regions, so the fluxes 
+            # must be added already
+            self.add_string(self.Code["flux_convergence"] 
+                            % (kwargs['interval'], self.lineFluxCode.strip(), kwargs['interval'], 
+                               kwargs['tolerance'], kwargs['checks'], kwargs['duration'], kwargs['duration']))
+            self.form_line(self.Code["time_converge"])
+        if outputEpsilon :
+            self.form_line(self.Code["output_epsilon"])
             
     def addRunControl(self, body = None) :
         if body == None :
@@ -946,15 +2598,85 @@ class MeepControl (object) :
 
 # end of class MeepControl and its Exceptions
 
-def main(iniData, rcFileName) :
+def check_placements(iniData, blocks, width, height, pml) :
+    # Returns the messages about the sources, flux regions and field probes placed outside
+    # the simulated region (the centered cell without PML), with the center inside conducting 
+    # blocks or, for sources and flux regions, crossing grooves
+    index = blocks.getIndex()
+    table = index.table
+    is3d = iniData.zSize > 0
+    objects = [("Source %s" % num, source['position'], True) for num, source in enumerate(iniData.listSources)] \
+        + [("Flux region %s" % num, fluxp['position'], True) for num, fluxp in enumerate(iniData.listFluxPoints)] \
+        + [("Field probe %s" % num, obs['field']['position'], False) 
+           for num, obs in enumerate(obs for obs in iniData.listTransients if 'field' in dict(obs))] \
+        + [("Spectral field probe %s" % num, obs['field']['position'], False) 
+           for num, obs in enumerate(iniData.listSpectralFields)]
+    
+    errors = []
+    for name, pos, extended in objects :
+        halfWidth = pos['width']*0.5 if extended else 0.0
+        x, yB, yT = pos['x'], pos['y'] - halfWidth, pos['y'] + halfWidth
+        if abs(x) > width/2.0 - pml + Tolerance or max(abs(yB), abs(yT)) > height/2.0 - pml + Tolerance :
+            errors.append("%s at (%s, %s) is outside the simulated region or in PML" % (name, x, pos['y']))
+            continue
+        # flux regions may extend into the metal, but not lie in it
+        center = index.query(x, x, pos['y'], pos['y'], *((0.0, 0.0) if is3d else ()))
+        if any(blocks.materials[material]['medium'] == 'metal' for material in set(table['material'][center].tolist())) :
+            errors.append("%s at (%s, %s) is inside metal" % (name, x, pos['y']))
+            continue
+        z = pos['elevation'] if extended else 0.0
+        rows = index.query(x, x, yB, yT, *((-z, z) if is3d else ()))
+        if extended and len(index.grooves(rows)) > 0 :
+            errors.append("%s at (%s, %s) overlaps a groove" % (name, x, pos['y']))
+    return errors
+
+def main(iniData, rcFileName, optimize = False, invert = False, duplicates = False, raster = None, 
+         symmetry = None, tight = False, check = None, write = True, blockCache = None, shared = None) :
     """
     Accept classes containing initializing data 
-    rcFileName - name of the resource file
+    rcFileName - name of the resource file or the loaded resources (instance of genResource)
     iniData - configuration of the structure (instance of ctlInfo).
+    optimize - whether blocks are merged (can also be set by Geometry.optimize)
+    invert - whether the dominant material is made the background (Geometry.invert)
+    duplicates - whether periods of lines are duplicated by Meep (Geometry.duplicates)
+    raster - None, 'overlay' or 'input' (Geometry.raster): whether the epsilon is rasterized 
+        instead of being written by Meep and whether it's loaded by epsilon-input-file
+    symmetry - whether mirror symmetries are detected and passed to Meep (Controls.symmetry, 
+        default: False), they restrict the fields to the symmetric subspace
+    tight - whether the cell is fitted to the structure, sources and collectors keeping them 
+        the margin of PML and Geometry.clearance away from the boundaries on all sides 
+        (Geometry.tight_cell)
+    check - whether the placement of sources, flux regions and field probes is checked against
+        the blocks (Controls.check_placement, default: True): if True, PlacementException is 
+        raised when they are outside the simulated region, inside metal or cross grooves, 
+        with 'warn' these are warnings, False skips the check
+    write - whether the control file, the estimate and the rasterized structure are written,
+        otherwise they are returned
+    blockCache - what the previous translations keep for the next one (instance of translationCache)
+    shared - the directory of geometries shared by runs (Output.shared_geometry): the cell, 
+        materials, blocks, PML and resolution are written there once per structure and 
+        included by the control file, the epsilon is rasterized there once (as 'overlay'
+        unless raster is 'input') and linked next to the control file. If nothing is written,
+        the name and the text of the shared file are returned (include)
     
+    Returns the dictionary with the cost estimate (estimate), the hash of the simulation (hash)
+    and, if nothing is written,
+    the text of the control file (text) and the rasterized structure (raster). With the 
+    blockCache, the updated cache (cache) and the number of elements whose blocks are reused (reused).
     This function should work standalone as well as within a script.
+    The unfinished control file is dropped whatever interrupts the translation.
     """    
-    ctlFile = MeepControl(iniData.getCtlName(), rcFileName)
+    ctlFile = MeepControl(iniData.getCtlName() if write else None, rcFileName, iniData)
+    try :
+        return write_control(ctlFile, iniData, optimize, invert, duplicates, raster, symmetry, 
+                             tight, check, write, blockCache, shared)
+    finally :
+        ctlFile.discard()
+
+def write_control(ctlFile, iniData, optimize, invert, duplicates, raster, symmetry, tight, check, 
+                  write, blockCache, shared) :
+    # the translation of main into the started control file (ctlFile)
+    results = {}
     contrData = iniData.getSection("Controls")
     
     # 0. Set whether fields should be regarded as complex or not
@@ -963,12 +2685,20 @@ def main(iniData, rcFileName) :
         ctlFile.setComplexFields()
 
     # 1. Find the limiting points
-    s = iniData.getSection("Geometry")["overshot"]
+    geomData = iniData.getSection("Geometry")
+    s = geomData["overshot"]
+    
+    if shared == None and 'shared_geometry' in dict(iniData.getSection("Output")) :
+        shared = iniData.getSection("Output")['shared_geometry']
+    if shared != None :
+        ctlFile.startInclude()
     
     if iniData.getNumElements() == 0 :
         print("Empty structure is generated")
+        width = height = 2*s
+        zCell = None if iniData.zSize <= 0 else iniData.zSize + 2*s
         
-        ctlFile.defineGeneralArea(2*s, 2*s, None if iniData.zSize <= 0 else iniData.zSize + 2*s)
+        ctlFile.defineGeneralArea(2*s, 2*s, zCell)
     else :
         # [2015-2-11] We take the limiting coordinates strictly
         # We assume that incoming/outgoing channels enter MinX, MaxX planes only
@@ -978,160 +2708,180 @@ def main(iniData, rcFileName) :
         zSize = MaxZ - MinZ
         if abs(zSize) < Tolerance :
             zSize = 0
-        ctlFile.defineGeneralArea(width, height, None if iniData.zSize <= 0 else iniData.zSize + 2*s)
+        zCell = None if iniData.zSize <= 0 else iniData.zSize + 2*s
+        
+        if tight or ('tight_cell' in dict(geomData) and geomData['tight_cell']) :
+            # s is replaced by the margin
+            clearance = float(geomData['clearance']) if 'clearance' in dict(geomData) else 0.5
+            margin = float(ctlFile.Code["pml_thickness"]) + clearance
+            tightWidth, tightHeight = iniData.getTightCell(margin)
+            sizes = [width, height] + ([] if zCell == None else [zCell])
+            tightSizes = [tightWidth, tightHeight] + ([] if zCell == None else [iniData.zSize + 2*margin])
+            points = [np.prod([max(int(round(size*contrData["resolution"])), 1) for size in cell]) 
+                      for cell in (sizes, tightSizes)]
+            report = "Tight cell: %s instead of %s, grid points: %s instead of %s (%+.1f%%)" \
+                % (" x ".join("%.4g" % size for size in tightSizes), " x ".join("%.4g" % size for size in sizes), 
+                   points[1], points[0], 100.0*(points[1] - points[0])/points[0])
+            print(report)
+            ctlFile.add_comment(report)
+            width, height = tightWidth, tightHeight
+            s = margin
+            zCell = None if zCell == None else tightSizes[2]
+        ctlFile.defineGeneralArea(width, height, zCell)
             
     # 2. We create a list of blocks corresponding to each line
-    
-    def add_flat(line, x1, x2) :
-        # adds the flat part extending from x1 to x2
-        # (for later) we think about x1 and x2 given in the local frame
-        props = line['property']
-        y = line['start']['y']
-        # the up metal part
-        yBottom = y + 0.5*props['width']
-        yTop = y + line['weak_space_up']
-        zBottom, zTop = -props['elevation'], props['elevation']
-        ctlFile.addblock(props['materials']["up"], x1, x2, yBottom, yTop, zBottom, zTop)
-        # the middle part
-        yTop = yBottom
-        yBottom = yTop - props["width"]
-        ctlFile.addblock(props["materials"]["in"], x1, x2, yBottom, yTop, zBottom, zTop)
-        # lower metallic part
-        yTop = yBottom
-        yBottom = y - line['weak_space_down']
-        ctlFile.addblock(line_props["materials"]["down"], x1, x2, yBottom, yTop, zBottom, zTop)
-    # end of add_flat
-    
-    def add_groove(line, x1, x2) :
-        # adds the part corresponding to a grove 
-        props = line['property']
-        zBottom, zTop = -props['elevation'], props['elevation']
-        
-        y = line['start']['y']
-        # the up metal part
-        yBottom = y + 0.5*props['width']  + props['grooves']['depth']
-        yTop = y + line['weak_space_up']
-        ctlFile.addblock(props['materials']["up"], x1, x2, yBottom, yTop, zBottom, zTop)
-        # the middle part
-        yTop = yBottom
-        yBottom = yTop - props["width"] - 2.0*props['grooves']['depth']
-        ctlFile.addblock(props["materials"]["in"], x1, x2, yBottom, yTop, zBottom, zTop)        
-        # lower metallic part
-        yTop = yBottom
-        yBottom = y - line['weak_space_down']
-        ctlFile.addblock(line_props["materials"]["down"], x1, x2, yBottom, yTop, zBottom, zTop)        
-    # end of add_groove
-         
-    ctlFile.startGeometry()
+    profile_phase('geometry_expansion')
+    blocks = blockTable(blockCache)
+    shiftX, shiftY = iniData.colLines.shiftX, iniData.colLines.shiftY
     for line in iniData.getLines() :
         comm = iniData.commentProvided(line)
         if comm :
-            ctlFile.add_comment(comm)
-            
-        x1 = line["start"]["x"]
-        # in what follows x1 denotes the cursor position
-        x2 = line["end"]["x"]
-        y1 = line["start"]["y"]
-        y2 = line["end"]["y"]   
-        
-        print("Adding %s: (%s, %s)-(%s, %s)" % (line['type'], x1, y1, x2, y2))
-        length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-        # TODO: direction
-        line_props = line['property']
-        zBottom, zTop = -line_props['elevation'], line_props['elevation']
-        
-        if line['type'] == 'connector' :
-            # this is three block system
-            # top block
-            xLeft = x1 - 0.5*line_props['width']
-            xRight = x1 + 0.5*line_props['width']
-            yBottom = y2
-            
-            reference = line['start']['attached_to']['property']
-            yTop = y2 + reference['padding'] + reference['grooves']['depth']
-            ctlFile.addblock(reference['materials']["up"], xLeft, xRight, yBottom, yTop, zBottom, zTop)
-            
-            # middle dielectric
-            yTop = y2
-            yBottom = y1
-            ctlFile.addblock(line_props['materials']["in"], xLeft, xRight, yBottom, yTop, zBottom, zTop)
-            
-            # bottom 
-            yTop = y1
-            yBottom = y1 - reference['padding'] - reference['grooves']['depth']
-            ctlFile.addblock(reference['materials']["up"], xLeft, xRight, yBottom, yTop, zBottom, zTop)
-            
-            # TODO: patches
-            # if is not attached on side : side.cover(whole)
-            # else: side.cover(whole - width_of_attached_lines)
-            # if not end.attached (to another connector) : add_terminating_block
-            
-            continue # to avoid ridiculously long if-else
-        
-        period = float(line_props["grooves"]["period"])
-        length_rest = length # ?? since == length - x1
-        
-        len_groove = line_props['grooves']['width']
-        len_flat = period - len_groove
+            blocks.addComment(comm)
         
-        # 1. Add an "incomplete" block due to initial skip of a part of the period
-        # 2. Add proper periods
-        # 3. Add possible "incomplete" block at the end
-        len_start_left = period*(1 - line['start']['skip'])
-        len_start_flat_left = len_start_left - len_groove
-        
-        if len_start_flat_left > 0 :
-            if length_rest < len_start_flat_left :
-                # we have a short line that doesn't cover the rest of the flat part
-                add_flat(line, x1, x2)
-                continue
-            # at least the flat part is covered
-            x2 = x1 + len_start_flat_left
-            add_flat(line, x1, x2)
-            len_start_left -= len_start_flat_left # == line_props['grooves']['width']
-            x1 = x2
-            length_rest -= len_start_flat_left
-            # the cursor is at the beginning of the groove in the incomplete part
-        # end adding starting flat part
-        len_start_groove_left = len_start_left
-        
-        if length_rest < len_start_groove_left :
-            x2 = x1 + length_rest
-            add_groove(line, x1, x2)
-            continue
-        x2 = x1 + len_start_groove_left
-        add_groove(line, x1, x2)
-        x1 = x2
-        length_rest -= len_start_groove_left
-        # The starting part is done now to proper periods
-        numperiods = int(length_rest/period)
-        
-        for part in range(numperiods) :
-            x2 = x1 + len_flat
-            add_flat(line, x1, x2)
-            x1 = x2
-            x2 = x1 + len_groove
-            add_groove(line, x1, x2)
-            x1 = x2
-            length_rest -= period
-        # loop over periods
-        
-        # Now we deal with the tail
-        if length_rest > len_flat :
-            x2 = x1 + len_flat
-            add_flat(line, x1, x2)
-            x1 = x2
-            length_rest -= len_flat
-            x2 = x1 + length_rest
-            add_groove(line, x1, x2)
-        else:
-            x2 = x1 + length_rest
-            add_flat(line, x1, x2)
+        if VERBOSITY >= 1 :
+            log(1, "Adding %s: (%s, %s)-(%s, %s)" % (line.type, line.start.x + shiftX, line.start.y + shiftY, 
+                                                     line.end.x + shiftX, line.end.y + shiftY))
+        blocks.addElement(line)
     # end of loop over lines
-        
-    ctlFile.finalizeGeometry()
+    # the elements are laid out off the center
+    blocks.shift(shiftX, shiftY)
+    profile_count('blocks_expanded', blocks.numBlocks)
+    if blockCache != None :
+        blockCache.elements = blocks.newElements
+        results['cache'] = blockCache
+        results['reused'] = blocks.numReused
+    
+    # 2.1 The media crossed by sources, flux regions and field probes
+    if check == None :
+        check = contrData['check_placement'] if 'check_placement' in dict(contrData) else True
+    if check :
+        profile_phase('placement_check')
+        errors = check_placements(iniData, blocks, width, height, float(ctlFile.Code["pml_thickness"]))
+        if len(errors) > 0 and check == 'warn' :
+            for error in errors :
+                iniData.setWarning(error, code = 2)
+        elif len(errors) > 0 :
+            for error in errors :
+                iniData.setError(error, code = 2)
+            raise PlacementException(errors)
+        profile_phase('geometry_expansion')
+    
+    if optimize or ('optimize' in dict(geomData) and geomData['optimize']) :
+        numBlocks = blocks.numBlocks
+        numRemoved = blocks.optimize()
+        print("Geometry optimization: %s of %s blocks are removed" % (numRemoved, numBlocks))
+        ctlFile.add_comment("Geometry is optimized: %s of %s blocks are removed" % (numRemoved, numBlocks))
+        
+    background = None
+    if invert or ('invert' in dict(geomData) and geomData['invert']) :
+        # the structure is centered and so is the cell
+        numBlocks = blocks.numBlocks
+        background = blocks.invert(-width/2.0, width/2.0, -height/2.0, height/2.0, 
+                                   None if iniData.zSize <= 0 else iniData.zSize/2.0 + s)
+        if background == None :
+            print("Background material is not changed")
+        else :
+            print("Background material: %s, %s blocks instead of %s" 
+                  % (blocks.materials[background], blocks.numBlocks, numBlocks))
+            ctlFile.add_comment("Background material is the dominant one: %s blocks instead of %s" 
+                                % (blocks.numBlocks, numBlocks))
+    
+    if raster == None and 'raster' in dict(geomData) and geomData['raster'] != None :
+        raster = geomData['raster']
+    if shared != None and raster != 'input' :
+        # the overlay is rasterized once for the shared geometry (see below)
+        raster = 'overlay'
+    # with the shared geometry the structure loaded by epsilon-input-file is in the hash of
+    # the shared file, the file itself is linked next to the control file (see below)
+    sharedInput = None
+    if raster == 'input' and shared != None :
+        epsilon, conductivity = blocks.rasterize(-width/2.0, width/2.0, -height/2.0, height/2.0, 
+                                                 contrData["resolution"], 
+                                                 None if iniData.zSize <= 0 else iniData.zSize/2.0 + s, 
+                                                 background)
+        if background != None :
+            print("The epsilon-input-file cannot be used with the background material")
+        else :
+            numBlocks = blocks.numBlocks
+            blocks.selectMaterials([num for num, medium in enumerate(blocks.materials) 
+                                    if medium['medium'] == 'metal'])
+            ctlFile.add_comment("The epsilon is loaded from the file: %s blocks instead of %s" 
+                                % (blocks.numBlocks, numBlocks))
+            sharedInput = (epsilon, conductivity)
+    elif raster == 'overlay' and shared != None :
+        pass
+    elif raster in ('overlay', 'input') :
+        # the file replaces the one written by output-epsilon
+        rasterName = os.path.splitext(iniData.getCtlName())[0] + "-eps-000000.00.h5"
+        epsilon, conductivity = blocks.rasterize(-width/2.0, width/2.0, -height/2.0, height/2.0, 
+                                                 contrData["resolution"], 
+                                                 None if iniData.zSize <= 0 else iniData.zSize/2.0 + s, 
+                                                 background)
+        if write :
+            write_raster(rasterName, epsilon, conductivity)
+            print("The rasterized structure %s is written to: %s" % (epsilon.shape, rasterName))
+        else :
+            results['raster'] = (epsilon, conductivity)
+        
+        if raster == 'input' and background != None :
+            print("The epsilon-input-file cannot be used with the background material")
+        elif raster == 'input' :
+            # epsilon-input-file doesn't pass the conductivity, so conducting blocks stay
+            numBlocks = blocks.numBlocks
+            blocks.selectMaterials([num for num, medium in enumerate(blocks.materials) 
+                                    if medium['medium'] == 'metal'])
+            ctlFile.add_comment("The epsilon is loaded from the file: %s blocks instead of %s" 
+                                % (blocks.numBlocks, numBlocks))
+            ctlFile.setEpsilonInput(os.path.basename(rasterName))
+    elif raster != None :
+        print("Unknown type of rasterization: %s (overlay, input or null are expected)" % raster)
+        raster = None
+    
+    # every distinct medium is defined once
+    profile_phase('geometry_emission')
+    profile_count('blocks_written', blocks.numBlocks)
+    profile_count('materials', len(blocks.materials))
+    ctlFile.defineMaterials(blocks, background)
+    if background != None :
+        ctlFile.setDefaultMaterial(background)
+        
+    # merged blocks are not periodic anymore
+    duplicates = (duplicates or ('duplicates' in dict(geomData) and geomData['duplicates'])) \
+        and len(blocks.repeats) > 0
+    ctlFile.startGeometry(duplicates)
+    ctlFile.addBlockTable(blocks, duplicates, blockCache)
+    ctlFile.finalizeGeometry(duplicates)
+    
+    if shared != None :
+        ctlFile.addPML()
+        ctlFile.addresolution(contrData["resolution"])
+        includeName, includeText = ctlFile.finishInclude(shared, sharedInput, write)
+        # the text of the shared file is returned if nothing is written
+        results['include'] = includeName if write else (includeName, includeText)
+        
+        # the same structure is rasterized once and linked next to every control file,
+        # the run loads its own link, so the runs don't depend on each other's directories
+        sharedRaster = os.path.splitext(includeName)[0] + "-eps-000000.00.h5"
+        rasterName = os.path.splitext(iniData.getCtlName())[0] + "-eps-000000.00.h5"
+        
+        def rasterizeShared() :
+            if raster == 'input' :
+                return epsilon, conductivity
+            return blocks.rasterize(-width/2.0, width/2.0, -height/2.0, height/2.0, 
+                                    contrData["resolution"], 
+                                    None if iniData.zSize <= 0 else iniData.zSize/2.0 + s, 
+                                    background)
+        if write :
+            write_shared(sharedRaster, lambda fileName : write_raster(fileName, *rasterizeShared()))
+            link_shared(sharedRaster, rasterName)
+        else :
+            results['raster'] = rasterizeShared()
+        if sharedInput != None :
+            ctlFile.setEpsilonInput(os.path.basename(rasterName))
     
     # 3. Add sources
+    profile_phase('sources')
+    profile_count('sources', len(iniData.listSources))
     ctlFile.startSources()
    
     for source in iniData.listSources:
@@ -1143,7 +2893,7 @@ def main(iniData, rcFileName) :
         z1 = -source['position']['elevation']
         z2 = source['position']['elevation']
         
-        print("Adding source: (%s, %s, %s)" % (x1, y1, z1))
+        log(1, "Adding source: (%s, %s, %s)" % (x1, y1, z1))
         
         comm = iniData.commentProvided(source)
         if comm :
@@ -1153,19 +2903,43 @@ def main(iniData, rcFileName) :
     
     ctlFile.finalizeSources()
     
-    # 4. Add pml and resolution
-    ctlFile.addPML()
+    # 4. Add pml and resolution (unless they are shared with the geometry)
+    if shared == None :
+        ctlFile.addPML()
+        
+        ctlFile.addresolution(contrData["resolution"])
     
-    ctlFile.addresolution(contrData["resolution"])
+    # 5. Mirror symmetries of the structure, sources and flux regions
+    profile_phase('symmetries')
+    if symmetry == None :
+        symmetry = 'symmetry' in dict(contrData) and contrData['symmetry']
+    mirrors = []
+    if symmetry and len(iniData.listSources) > 0 :
+        for direction in ('x', 'y') :
+            phases = set(mirror_phase(source['property']['component'], direction) 
+                         for source in iniData.listSources)
+            if len(phases) == 1 and mirror_regions(iniData.listSources, direction) \
+                    and mirror_regions(iniData.listFluxPoints, direction) \
+                    and blocks.isMirrorSymmetric(direction) :
+                mirrors.append((direction, phases.pop()))
+        if len(mirrors) > 0 :
+            report = "Mirror symmetries: %s" % ", ".join("%s (phase %s)" % mirror for mirror in mirrors)
+            print(report)
+            ctlFile.add_comment(report)
+            ctlFile.addSymmetries(mirrors)
+        else :
+            print("No mirror symmetries are found")
     
     # 6. Define flux points
     # The procedure here is different because each flux region is a separate variable
     # They must be defined before the time control is defined
     
+    profile_phase('fluxes')
+    profile_count('fluxes', len(iniData.listFluxPoints))
     count = 0
     for fluxp in iniData.listFluxPoints :
-        print("Adding flux collector: %s at (%s, %s)" \
-              % (count, fluxp['position']['x'], fluxp['position']['y']))
+        log(1, "Adding flux collector: %s at (%s, %s)" 
+            % (count, fluxp['position']['x'], fluxp['position']['y']))
         count += 1
         
         x1 = fluxp["position"]["x"]
@@ -1177,6 +2951,13 @@ def main(iniData, rcFileName) :
         
         ctlFile.addflux(fluxp["property"], x1, x2, y1, y2, z1, z2)
         
+    # 6.0.1 Fields at points accumulated by the DFT (they replace the time samples of local
+    # fields transformed afterwards)
+    for probe in iniData.listSpectralFields :
+        log(1, "Adding spectral field collector: %s at (%s, %s)" 
+            % (ctlFile.countDFTFields, probe['field']['position']['x'], probe['field']['position']['y']))
+        ctlFile.addDFTField(probe['field'], probe['field']['position']['x'], probe['field']['position']['y'])
+    
     # 6.1. Add snapshots and other transient functions
     # TODO: reimplement this part to avoid unnecessary repetitions
     
@@ -1184,14 +2965,35 @@ def main(iniData, rcFileName) :
         return 0.6 if not 'resolution' in dict(snap) else float(snap['resolution'])
     # end setResolution
     
+    def snapshotVolume(snap) :
+        # (center x, y, size x, y, z) of the part of the cell written by the snapshot, 
+        # None for the whole cell
+        if not 'volume' in dict(snap) or snap['volume'] == None :
+            return None
+        if snap['volume'] == 'structure' :
+            MinX, MaxX, MinY, MaxY, MinZ, MaxZ = iniData.colLines.getLimits()
+            return ((MinX + MaxX)/2.0, (MinY + MaxY)/2.0, MaxX - MinX, MaxY - MinY, MaxZ - MinZ)
+        volume = snap['volume']
+        return (volume['x'], volume['y'], volume['width'], volume['height'], 0 if zCell == None else zCell)
+    # end snapshotVolume
+    
+    def snapshotWindow(snap) :
+        # the length of the time window of the snapshot, None for the whole run
+        start = snap['start'] if 'start' in dict(snap) and snap['start'] != None else 0
+        stop = snap['stop'] if 'stop' in dict(snap) and snap['stop'] != None else duration
+        return None if start == 0 and stop >= duration else max(min(stop, duration) - start, 0)
+    # end snapshotWindow
+    
+    profile_phase('transients')
+    profile_count('transients', len(iniData.listTransients))
     count = 0
     for transient in iniData.listTransients:
-        print("Adding transient function: %s, type %s" % (count, transient))
+        log(1, "Adding transient function: %s, type %s" % (count, transient))
         count += 1
         if "snapshot" in dict(transient) :
             snaps = transient['snapshot']
             res = setResolution(snaps)
-            ctlFile.addSnapshot(snaps, res)
+            ctlFile.addSnapshot(snaps, res, snapshotVolume(snaps))
         elif 'field' in dict(transient) :
             snaps = transient['field']
             res = setResolution(snaps)
@@ -1199,8 +3001,9 @@ def main(iniData, rcFileName) :
 
     # 7. Add Run control
     # 7.1 add run control
+    profile_phase('run_control')
     if "structure_only" in dict(contrData['time']) and contrData['time']['structure_only']:
-        ctlFile.startRunControl('fixed', duration = 0.1)
+        ctlFile.startRunControl('fixed', outputEpsilon = raster == None, duration = 0.1)
     elif contrData["time"]["type"] == "decay":
         if len(iniData.listFluxPoints) == 0 :
             # if no flux points are defined we take default at the center
@@ -1213,10 +3016,21 @@ def main(iniData, rcFileName) :
             cont_pos_x = iniData.listFluxPoints[0]["position"]["x"]
             cont_pos_y = iniData.listFluxPoints[0]["position"]["y"]
         
-        ctlFile.startRunControl("decay", duration = contrData["time"]["duration"], 
+        ctlFile.startRunControl("decay", outputEpsilon = raster == None, duration = contrData["time"]["duration"], 
                                    pos_x = cont_pos_x, pos_y = cont_pos_y)
     elif contrData["time"]["type"] == "fixed":
-        ctlFile.startRunControl("fixed", duration = contrData["time"]["duration"])
+        ctlFile.startRunControl("fixed", outputEpsilon = raster == None, duration = contrData["time"]["duration"])
+    elif contrData["time"]["type"] == "converge" :
+        # the run stops when the spectra of all flux regions are settled, the duration is the limit
+        timeData = contrData["time"]
+        if len(iniData.listFluxPoints) == 0 :
+            iniData.setWarning("No flux regions to check the convergence, the run time is fixed")
+            ctlFile.startRunControl("fixed", outputEpsilon = raster == None, duration = timeData["duration"])
+        else :
+            ctlFile.startRunControl("converge", outputEpsilon = raster == None, duration = timeData["duration"], 
+                                    interval = timeData['check_interval'] if 'check_interval' in dict(timeData) else 20, 
+                                    tolerance = timeData['tolerance'] if 'tolerance' in dict(timeData) else 1e-3, 
+                                    checks = timeData['checks'] if 'checks' in dict(timeData) else 3)
         
     # 7.2 add transient functions 
     # for transient in iniDdata.listTransientsFunctions ...
@@ -1224,10 +3038,396 @@ def main(iniData, rcFileName) :
         
     ctlFile.endRunControl()
 
-    # 8. Add output of flux points
+    # 8. Add output of flux points and DFT fields
     ctlFile.finalizeFluxes()
+    ctlFile.finalizeDFTFields()
+
+    profile_phase('dump')
+    text = ctlFile.dump()
+    if not write :
+        results['text'] = text
+    results['hash'] = ctlFile.getHash(None if ctlFile.epsilonInput == None else (epsilon, conductivity))
+    print("Simulation hash: %s" % results['hash'])
+    
+    # 9. Estimate the cost of the run
+    profile_phase('estimate')
+    if "structure_only" in dict(contrData['time']) and contrData['time']['structure_only']:
+        duration = 0.1
+    elif contrData["time"]["type"] == "decay":
+        # the lower bound: gaussian sources are on for 10 widths (cutoff of Meep)
+        duration = contrData["time"]["duration"] + \
+            max([10.0/source['property']['width'] for source in iniData.listSources 
+                 if source['property']['type'] == 'pulse'] + [0])
+    else :
+        duration = contrData["time"]["duration"]
+    cellSizes = [width, height] + ([] if zCell == None else [zCell])
+    fluxes = [(fluxp['property']['resolution'], [fluxp['position']['width'], 2*fluxp['position']['elevation']]) 
+              for fluxp in iniData.listFluxPoints] \
+        + [(probe['field']['property']['resolution'], []) for probe in iniData.listSpectralFields]
+    estimate = estimate_cost(ctlFile.rcData.getSection("Estimate"), cellSizes, contrData["resolution"], duration, 
+                             fluxes, 
+                             [(setResolution(obs['snapshot']), 
+                               None if snapshotVolume(obs['snapshot']) == None else snapshotVolume(obs['snapshot'])[2:],
+                               snapshotWindow(obs['snapshot']), 
+                               int(obs['snapshot']['stride']) if 'stride' in dict(obs['snapshot']) else 1, 
+                               'single' in dict(obs['snapshot']) and obs['snapshot']['single'])
+                              for obs in iniData.listTransients if 'snapshot' in dict(obs)], 
+                             [setResolution(obs['field']) for obs in iniData.listTransients if 'field' in dict(obs)], 
+                             'complex' in dict(contrData) and contrData['complex'], len(mirrors))
+    if contrData["time"]["type"] == "decay" :
+        estimate['time_lower_bound'] = True
+    elif contrData["time"]["type"] == "converge" :
+        estimate['time_upper_bound'] = True
+    # the key of cached results (see simcache.py)
+    estimate['simulation_hash'] = results['hash']
+    results['estimate'] = estimate
+    print("Estimate: %s grid points, %s time steps, %s MB, %s MPI ranks, walltime %s" 
+          % (estimate['grid_points'], estimate['time_steps'], estimate['memory_mb'], 
+             estimate['mpi_ranks'], estimate['walltime']))
+    if write :
+        estimateName = os.path.splitext(iniData.getCtlName())[0] + ".cost.yaml"
+        with open(estimateName, "w") as f :
+            yaml.safe_dump(estimate, f, default_flow_style = False)
+        print("The estimate is written to: %s" % estimateName)
+    profile_stop()
+    return results
 
-    ctlFile.dump()
+def translate(config, rcData = None, write = False, cacheDir = None, iniFileName = None, **options) :
+    """
+    Translates the meta-configuration without touching the state of the module.
+    config - the name of the meta-configuration file or the parsed configuration 
+        (dictionary, iniFileName or 'gen.ini' names it)
+    rcData - the name of the resource file or the loaded resources (genResource), 
+        the same instance can be shared by many translations
+    write - whether the files are written as by the command line (see main)
+    cacheDir - the directory of validated configurations (see load_validated)
+    options - the options of main (optimize, invert, ...)
+    
+    Returns the text of the control file (None if the translation failed or the file 
+    is written) and the dictionary of diagnostics: messages (what is printed otherwise),
+    warnings, errors and the results of main (estimate, raster).
+    """
+    diagnostics = {'warnings' : [], 'errors' : []}
+    messages = io.StringIO()
+    text = None
+    with contextlib.redirect_stdout(messages) :
+        try :
+            if not isinstance(rcData, genResource) :
+                rcData = load_validated(genResource, genResource.resolveName(rcData), cacheDir)
+            iniData = ctlInfo(iniFileName, data = config) if isinstance(config, dict) \
+                else load_validated(ctlInfo, config, cacheDir)
+            if iniData.isValid :
+                results = main(iniData, rcData, write = write, **options)
+                text = results.pop('text', None)
+                diagnostics.update(results)
+                if write :
+                    diagnostics['ctl_file'] = iniData.getCtlName()
+            else :
+                diagnostics['errors'].append((1, "Configuration file doesn't describe a valid structure"))
+            diagnostics['warnings'] = iniData.bufWarnings + diagnostics['warnings']
+            diagnostics['errors'] = iniData.bufErrors + diagnostics['errors']
+        except (Exception, SystemExit) as exc :
+            # SystemExit is raised on corrupted resources
+            text = None
+            diagnostics['errors'].append((1, str(exc) or exc.__class__.__name__))
+    diagnostics['messages'] = messages.getvalue()
+    return text, diagnostics
+
+class ctlWatcher(object) :
+    # Translates the meta-configuration file whenever it changes (gentri3.py --watch).
+    # The parsed configuration, the layout of the elements (see elementLayout), the blocks
+    # of the elements and their code (see translationCache) are kept between translations.
+    # Only the changed parts of the file are parsed again (see parse), so the elements
+    # that aren't changed are the same and aren't laid out again
+    
+    def __init__(self, iniFileName, rcFileName = None, **options) :
+        self.iniFileName = iniFileName
+        self.rcData = genResource(rcFileName)
+        if not self.rcData.isValid :
+            sys.exit("Fatal error: The resource file is corrupted!")
+        self.options = options
+        self.cache = translationCache()
+        self.layout = elementLayout()
+        self.stamp = None
+        # the text of the file by lines, the configuration parsed off it, the parts 
+        # of the text (see splitText) and the anchors defined in it (see findAnchors)
+        self.lines = None
+        self.data = None
+        self.units = None
+        self.anchors = []
+        
+    def translate(self) :
+        start = time.time()
+        try :
+            with open(self.iniFileName, "r") as f :
+                data = self.parse(f.read())
+            if not isinstance(data, dict) :
+                print("Configuration file doesn't describe a valid structure")
+                return False
+            iniData = ctlInfo(self.iniFileName, data, self.layout)
+            if not iniData.isValid :
+                print("Configuration file doesn't describe a valid structure")
+                return False
+            results = main(iniData, self.rcData, blockCache = self.cache, **self.options)
+        except Exception as exc :
+            # the file may be saved halfway
+            print("Translation failed: %s" % exc)
+            return False
+        self.cache = results['cache']
+        print("Translated in %.3f s: %s of %s elements laid out and %s of %s lines settled again, "
+              "the blocks of %s of %s laid-out elements are reused" 
+              % (time.time() - start, self.layout.numLaid, self.layout.numElements, 
+                 self.layout.numSettled, self.layout.numLines, results['reused'], len(iniData.getLines())))
+        return True
+    
+    def parse(self, text) :
+        # Returns the configuration in the text. The parts of the text changed since the last 
+        # time are parsed alone if they are elements of Geometry.elements or top-level sections 
+        # other than Geometry (see parseParts), otherwise the whole text is parsed and the elements
+        # equal to the ones parsed before are replaced by them
+        lines = text.splitlines(True)
+        res = None if self.data == None else self.parseParts(lines)
+        if res == None :
+            loader = YAMLLoader(text)
+            try :
+                node = loader.get_single_node()
+                data = None if node == None else loader.construct_document(node)
+            finally :
+                loader.dispose()
+            try :
+                self.keepEqual(self.data['Geometry']['elements'], data['Geometry']['elements'])
+            except (KeyError, TypeError) :
+                pass
+            res = data, self.splitText(node, lines), self.findAnchors(node, lines)
+        self.lines = lines
+        self.data, self.units, self.anchors = res
+        return self.data
+    
+    @staticmethod
+    def keepEqual(old, new) :
+        # replaces the items of the new list equal to the old ones by the old ones
+        if not isinstance(old, list) or not isinstance(new, list) :
+            return
+        head = 0
+        while head < min(len(old), len(new)) and old[head] == new[head] :
+            new[head] = old[head]
+            head += 1
+        tail = 0
+        while tail < min(len(old), len(new)) - head and old[-1 - tail] == new[-1 - tail] :
+            new[-1 - tail] = old[-1 - tail]
+            tail += 1
+        # the items moved in between are found by their representation
+        equal = {}
+        for item in old[head : len(old) - tail] :
+            equal.setdefault(repr(item), []).append(item)
+        for num in range(head, len(new) - tail) :
+            same = equal.get(repr(new[num]))
+            if same and same[0] == new[num] :
+                new[num] = same.pop(0)
+    
+    @staticmethod
+    def splitText(node, lines) :
+        # Returns the parts of the text (lines) parsed into the node: (the first line, kind, name), 
+        # the part goes up to the next one. The kinds are 'section' (the top-level section 
+        # named so, other than Geometry), 'element' (an element of Geometry.elements, named 
+        # by its column) and None (the rest, it's parsed with the whole text)
+        units = [(0, None, None)]
+        if not isinstance(node, yaml.MappingNode) or node.flow_style :
+            return units
+        names = [key.value for key, value in node.value]
+        if len(set(names)) < len(names) :
+            return units
+        for key, value in node.value :
+            if not isinstance(key, yaml.ScalarNode) or key.start_mark.column != 0 :
+                return [(0, None, None)]
+            if key.value != 'Geometry' :
+                units.append((key.start_mark.line, 'section', key.value))
+                continue
+            units.append((key.start_mark.line, None, None))
+            if not isinstance(value, yaml.MappingNode) or value.flow_style :
+                continue
+            for num, (name, items) in enumerate(value.value) :
+                if name.value != 'elements' or not isinstance(items, yaml.SequenceNode) \
+                   or items.flow_style or len(items.value) == 0 :
+                    continue
+                # every element starts its line after the dash
+                column = items.value[0].start_mark.column
+                if any(item.start_mark.column != column or 
+                       lines[item.start_mark.line][:column].strip() != '-' for item in items.value) :
+                    continue
+                units.extend((item.start_mark.line, 'element', column) for item in items.value)
+                if num + 1 < len(value.value) :
+                    units.append((value.value[num + 1][0].start_mark.line, None, None))
+        # the leading part may be empty
+        if units[1][0] == 0 :
+            del units[0]
+        if any(unit[0] >= following[0] for unit, following in zip(units, units[1:])) :
+            return [(0, None, None)]
+        return units
+    
+    @staticmethod
+    def findAnchors(node, lines) :
+        # Returns the anchors defined in the text (lines) parsed into the node: 
+        # (line, column, name, the node anchored) in the order of the text
+        res = []
+        for num, line in enumerate(lines) :
+            if not '&' in line :
+                continue
+            for match in re.finditer(r'&([^\s,\[\]{}]+)', line) :
+                # the anchored node starts at its anchor
+                position = (num, match.start())
+                target = node
+                while target != None and (target.start_mark.line, target.start_mark.column) != position :
+                    if isinstance(target, yaml.MappingNode) :
+                        children = [child for pair in target.value for child in pair]
+                    elif isinstance(target, yaml.SequenceNode) :
+                        children = target.value
+                    else :
+                        children = []
+                    target = None
+                    for child in children :
+                        if (child.start_mark.line, child.start_mark.column) > position :
+                            break
+                        target = child
+                if target != None :
+                    res.append(position + (match.group(1), target))
+        return res
+    
+    def parseParts(self, lines) :
+        # Returns the configuration, the parts of the text (lines) and the anchors with the parts
+        # changed since the last time parsed alone or None if the text is to be parsed as a whole
+        old = self.lines
+        head = next((num for num, (line, oldLine) in enumerate(zip(lines, old)) if line != oldLine), 
+                    min(len(old), len(lines)))
+        if head == len(old) == len(lines) :
+            return self.data, self.units, self.anchors
+        tail = next((num for num, (line, oldLine) in enumerate(zip(reversed(lines[head :]), reversed(old[head :])))
+                     if line != oldLine), min(len(old), len(lines)) - head)
+        shift = len(lines) - len(old)
+        
+        # the parts with the changed lines
+        starts = [unit[0] for unit in self.units]
+        first = bisect.bisect_right(starts, head) - 1
+        last = bisect.bisect_right(starts, max(len(old) - tail - 1, head)) - 1
+        while True :
+            kind, name = self.units[first][1:]
+            if kind == None or any(unit[1] != kind for unit in self.units[first : last + 1]) :
+                return None
+            start = self.units[first][0]
+            end = len(lines) if last + 1 == len(self.units) else self.units[last + 1][0] + shift
+            # the lines added at the end of the previous part belong to it
+            line = next((line for line in lines[start : end] 
+                         if line.strip() != "" and not line.strip().startswith("#")), None)
+            if line != None and ((kind == 'section' and line[0].isspace()) or 
+                                 (kind == 'element' and line[:name].strip() != '-')) :
+                if first == 0 :
+                    return None
+                first -= 1
+                continue
+            break
+        
+        text = "".join(lines[start : end])
+        # the anchors defined in the parts may be referred to by the rest
+        if '&' in text or '&' in "".join(old[start : end - shift]) :
+            return None
+        if '*' in text :
+            # the aliases refer to the anchors defined before (the composer of the C loader
+            # doesn't take them)
+            loader = yaml.SafeLoader(text)
+            loader.anchors = dict((anchor[2], anchor[3]) for anchor in self.anchors if anchor[0] < start)
+        else :
+            loader = YAMLLoader(text)
+        try :
+            node = loader.get_single_node()
+            value = None if node == None else loader.construct_document(node)
+        finally :
+            loader.dispose()
+        
+        data = dict(self.data)
+        if kind == 'element' :
+            if node == None :
+                newUnits, value = [], []
+            elif not isinstance(node, yaml.SequenceNode) or node.flow_style \
+                 or any(item.start_mark.column != name or 
+                        lines[start + item.start_mark.line][:name].strip() != '-' for item in node.value) :
+                return None
+            else :
+                newUnits = [(start + item.start_mark.line, kind, name) for item in node.value]
+            numFirst = first - [unit[1] for unit in self.units].index('element')
+            elements = self.data['Geometry']['elements']
+            self.keepEqual(elements[numFirst : numFirst + last - first + 1], value)
+            data['Geometry'] = dict(self.data['Geometry'], 
+                                    elements = elements[: numFirst] + value + elements[numFirst + last - first + 1 :])
+        else :
+            names = [unit[2] for unit in self.units[first : last + 1]]
+            if not isinstance(node, yaml.MappingNode) or node.flow_style \
+               or [key.value for key, _ in node.value] != names \
+               or any(key.start_mark.column != 0 for key, _ in node.value) :
+                return None
+            newUnits = [(start + key.start_mark.line, kind, key.value) for key, _ in node.value]
+            for key in names :
+                data[key] = value[key]
+        if len(newUnits) > 0 :
+            newUnits[0] = (start,) + newUnits[0][1:]
+        return data, self.units[: first] + newUnits \
+            + [(unit[0] + shift,) + unit[1:] for unit in self.units[last + 1 :]], \
+            [anchor if anchor[0] < start else (anchor[0] + shift,) + anchor[1:] for anchor in self.anchors]
+    
+    def run(self, interval = 0.2) :
+        # polls the file until interrupted
+        print("Watching %s (Ctrl-C stops)" % self.iniFileName)
+        try :
+            while True :
+                try :
+                    info = os.stat(self.iniFileName)
+                    stamp = (info.st_mtime_ns, info.st_size)
+                except OSError :
+                    stamp = None
+                if stamp != None and stamp != self.stamp :
+                    self.stamp = stamp
+                    self.translate()
+                time.sleep(interval)
+        except KeyboardInterrupt :
+            pass
+
+# end of class ctlWatcher
+
+# the resources shared by the processes of the batch
+batchResource = None
+
+def init_batch(rcData) :
+    global batchResource
+    batchResource = rcData
+
+def translate_batch(args) :
+    # translates one file of the batch in a separate process
+    iniFileName, cacheDir, options = args
+    text, diagnostics = translate(iniFileName, batchResource, write = True, cacheDir = cacheDir, **options)
+    return iniFileName, diagnostics
+
+def run_batch(iniFileNames, rcFileName = None, processes = None, cacheDir = None, **options) :
+    # translates the meta-configuration files by the pool of processes loading 
+    # the resources once. Returns the number of failed translations
+    import multiprocessing
+    
+    rcData = load_validated(genResource, genResource.resolveName(rcFileName), cacheDir)
+    if not rcData.isValid :
+        sys.exit("Fatal error: The resource file is corrupted!")
+    numFailed = 0
+    pool = multiprocessing.Pool(processes, initializer = init_batch, initargs = (rcData,))
+    try :
+        for iniFileName, diagnostics in pool.imap(translate_batch, 
+                                                  [(name, cacheDir, options) for name in iniFileNames]) :
+            if len(diagnostics['errors']) > 0 or not 'ctl_file' in diagnostics :
+                numFailed += 1
+                print("FAILED %s: %s" % (iniFileName, "; ".join(str(error[1]) for error in diagnostics['errors'])))
+            else :
+                print("ok %s -> %s" % (iniFileName, diagnostics['ctl_file']))
+    finally :
+        pool.close()
+        pool.join()
+    print("Translated %s of %s files" % (len(iniFileNames) - numFailed, len(iniFileNames)))
+    return numFailed
 
 if __name__ == "__main__" :
     
@@ -1236,10 +3436,61 @@ if __name__ == "__main__" :
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', default = None, help = 'The resource file')
     parser.add_argument('-i', default = 'gen.ini', help = 'The meta-configuration file')
+    parser.add_argument('--batch', nargs = '+', default = None, metavar = 'INI', 
+                        help = 'Translate many meta-configuration files by a pool of processes')
+    parser.add_argument('--watch', action = 'store_true', 
+                        help = 'Translate the meta-configuration file again whenever it changes, '
+                        'reusing the blocks of the elements laid out as before')
+    parser.add_argument('--cache', default = None, metavar = 'DIR', 
+                        help = 'Keep validated configurations in the directory to skip parsing them again')
+    parser.add_argument('-j', type = int, default = None, 
+                        help = 'The number of processes for --batch (default: the number of CPUs)')
+    parser.add_argument('--optimize', action = 'store_true', 
+                        help = 'Merge blocks of the same material and drop empty blocks')
+    parser.add_argument('--duplicates', action = 'store_true', 
+                        help = 'Write one period of lines and duplicate it with geometric-objects-duplicates')
+    parser.add_argument('--raster', default = None, choices = ['overlay', 'input'], 
+                        help = 'Rasterize the epsilon instead of output-epsilon (overlay) and load it by epsilon-input-file (input)')
+    parser.add_argument('--tight-cell', action = 'store_true', 
+                        help = 'Fit the cell to the structure, sources and collectors keeping PML and clearance')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--symmetry', action = 'store_true', 
+                       help = 'Pass detected mirror symmetries to Meep (Controls.symmetry)')
+    group.add_argument('--no-symmetry', action = 'store_true', 
+                       help = 'Do not pass mirror symmetries to Meep even if Controls.symmetry is set')
+    parser.add_argument('--check', default = None, choices = ['error', 'warn', 'off'], 
+                        help = 'Misplaced sources, flux regions and field probes are errors (default), '
+                        'warnings or not checked (overrides Controls.check_placement)')
+    parser.add_argument('--shared-geometry', default = None, metavar = 'DIR', 
+                        help = 'Write the geometry and the epsilon once per structure to the directory and include it')
+    parser.add_argument('--invert', action = 'store_true', 
+                        help = 'Make the dominant material the background and add blocks of other materials only')
+    parser.add_argument('-v', '--verbose', action = 'count', default = 0, 
+                        help = 'Report every element, source and collector')
+    parser.add_argument('--profile', default = None, metavar = 'JSON', 
+                        help = 'Write wall time, CPU time and peak memory of the phases of the translation '
+                        'and the counts of blocks, cuts and conflicts to the file (not for --batch and --watch)')
     args = parser.parse_args()
+    
+    VERBOSITY = args.verbose
+    if args.profile != None and args.batch == None and not args.watch :
+        PROFILE = phaseProfile()
 
     rcFileName = args.r
-    iniData = ctlInfo(args.i)
+    options = dict(optimize = args.optimize, invert = args.invert, duplicates = args.duplicates, 
+                   raster = args.raster, symmetry = True if args.symmetry else False if args.no_symmetry else None, 
+                   tight = args.tight_cell, check = {'error' : True, 'warn' : 'warn', 'off' : False}.get(args.check), 
+                   shared = args.shared_geometry)
+    
+    if args.batch != None :
+        sys.exit(1 if run_batch(args.batch, rcFileName, args.j, args.cache, **options) > 0 else 0)
+    if args.watch :
+        ctlWatcher(args.i, rcFileName, **options).run()
+        sys.exit(0)
+    
+    iniData = load_validated(ctlInfo, args.i, args.cache)
+    if args.cache != None :
+        rcFileName = load_validated(genResource, genResource.resolveName(rcFileName), args.cache)
     
     # Poor man handling exceptions
     # TODO: introduce more elaborated treatment, since there may be different situations
@@ -1247,4 +3498,14 @@ if __name__ == "__main__" :
     if not iniData.isValid :
         sys.exit("Configuration file is not found or doesn't describe a valid structure")
 
-    main(iniData, rcFileName)
+    try :
+        main(iniData, rcFileName, **options)
+    except PlacementException :
+        sys.exit("Sources, flux regions or field probes are misplaced, the control file is not written")
+    
+    if PROFILE != None :
+        report = PROFILE.report()
+        report['file'] = args.i
+        with open(args.profile, "w") as f :
+            json.dump(report, f, indent = 2)
+        print("The profile is written to: %s" % args.profile)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Spatial decimation of the field snapshots of a finished Meep run
+#
+# Meep writes every grid point, so the snapshots with a stride (Collectors -> temporal ->
+# snapshot -> stride) are marked in the control file by gentri3.py:
+#   (define output-stride-<fname> <stride>)
+# and only every stride-th point along every spatial direction of <prefix>-<fname>.h5 is
+# kept afterwards (the last dimension of the appended snapshots is the time). The file
+# is rewritten aside and renamed, the decimated files are marked and never decimated twice.
+#
+# Usage:
+#   h5stride.py run.ctl
+
+import os
+import re
+import sys
+import h5py
+
+# the number of time frames copied at once
+FRAMES = 64
+
+def strides(ctlFileName) :
+    # {fname : stride} of the snapshots of the control file
+    res = {}
+    with open(ctlFileName, "r") as f :
+        for line in f :
+            match = re.match(r'\(define output-stride-(\S+) (\d+)\)', line.strip())
+            if match :
+                res[match.group(1)] = int(match.group(2))
+    return res
+
+def decimate(fileName, stride) :
+    # keeps every stride-th point of the spatial dimensions of the datasets of the file
+    with h5py.File(fileName, "r") as src :
+        if 'stride' in src.attrs :
+            print("Decimated already: %s" % fileName)
+            return False
+        partName = fileName + ".part"
+        with h5py.File(partName, "w") as dst :
+            for name, dataset in src.items() :
+                spatial = (slice(None, None, stride),)*(dataset.ndim - 1)
+                if dataset.ndim < 2 :
+                    dst.create_dataset(name, data = dataset[...])
+                    continue
+                frames = dataset.shape[-1]
+                shape = tuple(len(range(0, size, stride)) for size in dataset.shape[:-1]) + (frames,)
+                target = dst.create_dataset(name, shape = shape, dtype = dataset.dtype)
+                for start in range(0, frames, FRAMES) :
+                    stop = min(start + FRAMES, frames)
+                    target[..., start:stop] = dataset[spatial + (slice(start, stop),)]
+            for key, value in src.attrs.items() :
+                dst.attrs[key] = value
+            dst.attrs['stride'] = stride
+    os.replace(partName, fileName)
+    print("Decimated by %s: %s" % (stride, fileName))
+    return True
+
+if __name__ == "__main__" :
+
+    if len(sys.argv) != 2 :
+        sys.exit("Usage: h5stride.py run.ctl")
+
+    ctlFileName = sys.argv[1]
+    prefix = os.path.splitext(ctlFileName)[0]
+    for fname, stride in sorted(strides(ctlFileName).items()) :
+        fileName = "%s-%s.h5" % (prefix, fname)
+        if not os.path.isfile(fileName) :
+            print("No snapshots: %s" % fileName)
+            continue
+        decimate(fileName, stride)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# Content-addressed cache of Meep runs
+#
+# The key of a run is the hash of the simulation as computed by gentri3.py: the control
+# file without comments plus the structure loaded by epsilon-input-file. The entry keeps
+# the artifacts of the run (<prefix>.ctl, .log, .dat, <prefix>-*.h5, ...) with the prefix
+# replaced by 'sim', they are hard-linked (copied across file systems) in both directions.
+#
+# Usage:
+#   simcache.py hash run.ctl          # prints the hash
+#   simcache.py fetch run.ctl         # links the cached artifacts, exit code 1 if none
+#   simcache.py store run.ctl         # puts the artifacts of the finished run to the cache
+#   simcache.py query run.ctl|HASH    # lists the artifacts of the entry
+#   simcache.py list | size
+#   simcache.py prune [--max-size MB] [--older-than DAYS]
+#
+# The cache is in --cache, $GENTRI3_RESULTS or ~/.cache/gentri3-results
+
+import os
+import re
+import sys
+import time
+import shutil
+import hashlib
+
+from gentri3 import hash_ctl_line, hash_raster
+
+ENTRY_PREFIX = "sim"
+
+def default_cache() :
+    return os.environ.get("GENTRI3_RESULTS",
+                          os.path.join(os.path.expanduser("~"), ".cache", "gentri3-results"))
+
+def ctl_hash(ctlFileName) :
+    # the hash of the simulation described by the control file
+    digest = hashlib.sha256()
+    epsilonInput = None
+    with open(ctlFileName, "r") as f :
+        lines = f.read().splitlines()
+    for line in lines :
+        match = re.match(r'\(set! epsilon-input-file "([^":]*)', line)
+        if match :
+            epsilonInput = match.group(1)
+        hash_ctl_line(digest, line, epsilonInput)
+    if epsilonInput != None :
+        import h5py
+        with h5py.File(os.path.join(os.path.dirname(ctlFileName), epsilonInput), "r") as f :
+            hash_raster(digest, f["eps"][...], f["sigma"][...])
+    return digest.hexdigest()
+
+def entry_path(cacheDir, key) :
+    return os.path.join(cacheDir, key[:2], key)
+
+def link(source, target) :
+    try :
+        os.link(source, target)
+    except OSError :
+        shutil.copy2(source, target)
+
+def artifacts(ctlFileName) :
+    # the files of the run: <prefix>.* and <prefix>-*
+    prefix = os.path.splitext(os.path.basename(ctlFileName))[0]
+    directory = os.path.dirname(ctlFileName) or "."
+    return prefix, directory, sorted(name for name in os.listdir(directory)
+                                     if (name.startswith(prefix + ".") or name.startswith(prefix + "-"))
+                                     and not name.endswith(".part")
+                                     and os.path.isfile(os.path.join(directory, name)))
+
+def store(cacheDir, ctlFileName) :
+    key = ctl_hash(ctlFileName)
+    entry = entry_path(cacheDir, key)
+    if os.path.isdir(entry) :
+        print("The run is cached already: %s" % key)
+        return key
+    prefix, directory, names = artifacts(ctlFileName)
+    # the entry is assembled aside and renamed, so readers never see a partial one
+    partEntry = "%s.%s.part" % (entry, os.getpid())
+    os.makedirs(partEntry)
+    for name in names :
+        link(os.path.join(directory, name), os.path.join(partEntry, ENTRY_PREFIX + name[len(prefix):]))
+    try :
+        os.rename(partEntry, entry)
+    except OSError :
+        # stored concurrently
+        shutil.rmtree(partEntry)
+    print("Stored %s files: %s" % (len(names), key))
+    return key
+
+def fetch(cacheDir, ctlFileName) :
+    # links the cached artifacts next to the control file, the existing files are kept
+    key = ctl_hash(ctlFileName)
+    entry = entry_path(cacheDir, key)
+    if not os.path.isdir(entry) :
+        print("Not cached: %s" % key)
+        return False
+    prefix = os.path.splitext(os.path.basename(ctlFileName))[0]
+    directory = os.path.dirname(ctlFileName) or "."
+    count = 0
+    for name in sorted(os.listdir(entry)) :
+        target = os.path.join(directory, prefix + name[len(ENTRY_PREFIX):])
+        if not os.path.exists(target) :
+            link(os.path.join(entry, name), target)
+            count += 1
+    # the time of the last use for pruning
+    os.utime(entry)
+    print("Fetched %s files: %s" % (count, key))
+    return True
+
+def entries(cacheDir) :
+    # (key, path, size in bytes, time of the last use)
+    res = []
+    if not os.path.isdir(cacheDir) :
+        return res
+    for bucket in sorted(os.listdir(cacheDir)) :
+        bucketPath = os.path.join(cacheDir, bucket)
+        if not os.path.isdir(bucketPath) :
+            continue
+        for key in sorted(os.listdir(bucketPath)) :
+            path = os.path.join(bucketPath, key)
+            if key.endswith(".part") or not os.path.isdir(path) :
+                continue
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            res.append((key, path, size, os.path.getmtime(path)))
+    return res
+
+def prune(cacheDir, maxSize = None, olderThan = None) :
+    # removes the entries not used for olderThan days and then the least recently
+    # used ones until the cache fits into maxSize MB
+    listEntries = sorted(entries(cacheDir), key = lambda entry : entry[3])
+    total = sum(entry[2] for entry in listEntries)
+    now = time.time()
+    removed = 0
+    for key, path, size, used in listEntries :
+        if (olderThan != None and now - used > olderThan*86400.0) \
+            or (maxSize != None and total > maxSize*2.0**20) :
+            shutil.rmtree(path)
+            total -= size
+            removed += 1
+    print("Removed %s of %s entries, %.1f MB left" % (removed, len(listEntries), total/2.0**20))
+
+if __name__ == "__main__" :
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', default = None, help = 'The cache directory')
+    parser.add_argument('command', choices = ['hash', 'fetch', 'store', 'query', 'list', 'size', 'prune'])
+    parser.add_argument('target', nargs = '?', default = None, help = 'The control file or the hash')
+    parser.add_argument('--max-size', type = float, default = None, help = 'For prune: in MB')
+    parser.add_argument('--older-than', type = float, default = None, help = 'For prune: in days')
+    args = parser.parse_args()
+
+    cacheDir = default_cache() if args.cache == None else args.cache
+
+    if args.command in ('hash', 'fetch', 'store', 'query') and args.target == None :
+        sys.exit("The control file is required")
+
+    if args.command == 'hash' :
+        print(ctl_hash(args.target))
+    elif args.command == 'fetch' :
+        sys.exit(0 if fetch(cacheDir, args.target) else 1)
+    elif args.command == 'store' :
+        store(cacheDir, args.target)
+    elif args.command == 'query' :
+        key = ctl_hash(args.target) if os.path.isfile(args.target) else args.target
+        entry = entry_path(cacheDir, key)
+        if not os.path.isdir(entry) :
+            print("Not cached: %s" % key)
+            sys.exit(1)
+        for name in sorted(os.listdir(entry)) :
+            print("%12d %s" % (os.path.getsize(os.path.join(entry, name)), name))
+    elif args.command == 'list' :
+        for key, path, size, used in entries(cacheDir) :
+            print("%s %10.1f MB %s" % (key, size/2.0**20, time.strftime("%Y/%m/%d %H:%M", time.localtime(used))))
+    elif args.command == 'size' :
+        listEntries = entries(cacheDir)
+        print("%s entries, %.1f MB in %s" % (len(listEntries), sum(entry[2] for entry in listEntries)/2.0**20, cacheDir))
+    elif args.command == 'prune' :
+        if args.max_size == None and args.older_than == None :
+            sys.exit("Either --max-size or --older-than is required")
+        prune(cacheDir, args.max_size, args.older_than)
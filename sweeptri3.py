@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# Parameter sweeps of Mach-Zehnder interferometers translated in one process
+# (replaces the sed-and-copy scripts generated by bulk/genpatts.py)
+#
+# The pattern is parsed once and the ${var} parameters of every point are substituted into
+# the parsed configuration:
+#   terminator_length, vertical_spacing, middle_length - the structure
+#   center_frequency, width_frequency - sources and observers
+#   out_name, count - the name of the control file
+# The points are translated by a pool of processes. The points of the same structure go
+# to the same process one after another, so the laid-out elements are reused (see the
+# blockCache of gentri3.main) and the geometry is written once (see --shared-geometry).
+# Every run directory p_<pattern>.<count> gets the meta-configuration, the control file and
+# the job script (pass.sh.patt with ${config}, ${control} and ${tools}). No scripts are
+# copied. description.txt and the crawl_ scripts are the same as those of genpatts.py
+# (see bulk/parsedesc.py).
+#
+# Usage:
+#   sweeptri3.py [--vert 5] [--term 2] [--middle 1] [--freq 0.025:0.025:0.4] [--continuous] [-j N] gen.ini.patt
+
+import os
+import re
+import sys
+import stat
+import string
+from datetime import datetime
+
+import numpy
+import yaml
+
+import gentri3
+
+SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+RUN_FILE_NAME = "pass.sh"
+PLOT_FILE_NAME = "plot.sh"
+DESC_FILE_NAME = "description.txt"
+SHARED_DIR = "geometry"
+
+def process(str) :
+    # the range of a parameter: a single value, start:stop (10 values) or start:step:stop
+    pos = str.find(':')
+    if pos < 0 :
+        # single parameter
+        return numpy.array([float(str)])
+
+    start = float(str[:pos])
+    pos2 = str.find(':', pos + 1)
+    if pos2 < 0 :
+        # simple interval is provided, 10 steps are assumed
+        stop = float(str[pos + 1 :])
+        return numpy.linspace(start, stop, 10)
+
+    step = float(str[pos + 1: pos2])
+    stop = float(str[pos2 + 1:])
+    return numpy.arange(start, stop, step)
+
+def parameters(data) :
+    # the names of the ${var} parameters used by the parsed pattern
+    if isinstance(data, dict) :
+        return set().union(*[parameters(value) for value in data.values()])
+    if isinstance(data, list) :
+        return set().union(*[parameters(value) for value in data])
+    if isinstance(data, str) :
+        return set(re.findall(r'\$\{(\w+)\}', data))
+    return set()
+
+def substitute(data, values) :
+    # returns the copy of the parsed pattern with the parameters replaced by the values,
+    # a string that is a single parameter becomes the value itself (as YAML would read it)
+    if isinstance(data, dict) :
+        return dict((key, substitute(value, values)) for key, value in data.items())
+    if isinstance(data, list) :
+        return [substitute(value, values) for value in data]
+    if isinstance(data, str) :
+        match = re.match(r'^\$\{(\w+)\}$', data)
+        if match and match.group(1) in values :
+            return values[match.group(1)]
+        return string.Template(data).safe_substitute(values)
+    return data
+
+def sweep_points(vert, term, middle, cent, continuous, outName) :
+    # the points in the order of genpatts.py: (directory, parameters)
+    points = []
+    count = 0
+    for ver in vert :
+        for ter in term :
+            for mid in middle :
+                for cen in cent :
+                    wid = cen/50.0 if continuous else cen*1.5
+                    values = {'count' : count, 'out_name' : outName,
+                              'vertical_spacing' : float(ver), 'terminator_length' : float(ter),
+                              'middle_length' : float(mid),
+                              'center_frequency' : float(cen), 'width_frequency' : float(wid)}
+                    points.append(("p_%s.%s" % (outName, count), values))
+                    count += 1
+    return points
+
+def write_script(fileName, text) :
+    with open(fileName, "w") as f :
+        f.write(text)
+    os.chmod(fileName, os.stat(fileName).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+# the pattern, the job scripts, the resources and the options shared by the processes 
+# of the sweep
+sweepData = None
+
+def init_sweep(data) :
+    global sweepData
+    sweepData = data
+
+def translate_structure(points) :
+    # translates the points of the same structure one after another reusing the blocks
+    # of the laid-out elements. Returns the list of (directory, diagnostics)
+    pattern, scripts, tools, rcData, options = sweepData
+    cache = gentri3.translationCache()
+    res = []
+    for dirName, values in points :
+        config = substitute(pattern, values)
+        metaFileName = "%s.%s" % (values['out_name'], values['count'])
+        # the older patterns name the control file directly
+        ctlFile = config['Output']['ctl_file']
+        ctlName = ctlFile if isinstance(ctlFile, str) \
+            else metaFileName + ".ctl" if ctlFile.get('default') else ctlFile['name']
+        config = dict(config, Output = dict(config['Output'], ctl_file = {'name' : ctlName}))
+        if not os.path.isdir(dirName) :
+            os.makedirs(dirName)
+        with open(os.path.join(dirName, metaFileName), "w") as f :
+            yaml.safe_dump(config, f, default_flow_style = False)
+
+        # the control file goes to the run directory
+        config = dict(config, Output = dict(config['Output'], ctl_file = {'name' : os.path.join(dirName, ctlName)}))
+        text, diagnostics = gentri3.translate(config, rcData, write = True, 
+                                              iniFileName = os.path.join(dirName, metaFileName), 
+                                              blockCache = cache, **options)
+        cache = diagnostics.pop('cache', cache)
+        diagnostics.pop('raster', None)
+
+        # the plot script names the control file without the dot (as genpatts.py does)
+        for fileName, body, control in scripts :
+            body = body.replace("${config}", metaFileName).replace("${tools}", tools)
+            body = body.replace("${control}", control % (values['out_name'], values['count']))
+            write_script(os.path.join(dirName, fileName), body)
+        res.append((dirName, diagnostics))
+    return res
+
+def write_description(pattFileName, type, vert, term, middle, cent, points) :
+    # the layout read by parsedesc.py
+    stamp = datetime.now().strftime("%Y/%m/%d %H:%M")
+    with open(DESC_FILE_NAME, "w") as descfile :
+        descfile.write("Description of generated files\n")
+        descfile.write("Generated %s with %s as the pattern \n" % (stamp, pattFileName))
+        descfile.write("Type of source: %s\n" % type)
+
+        descfile.write("\n Overview of the simulation: \n")
+        descfile.write("Vertical: %s\n" % vert)
+        descfile.write("Terminators: %s\n" % term)
+        descfile.write("Middle: %s\n" % middle)
+        descfile.write("Frequency: %s\n\n" % cent)
+
+        current = (None, None, None)
+        for dirName, values in points :
+            ver, ter, mid = values['vertical_spacing'], values['terminator_length'], values['middle_length']
+            if ver != current[0] :
+                descfile.write("\n Vertical spacing: %s\n" % ver)
+                current = (ver, None, None)
+            if ter != current[1] :
+                descfile.write("\tTerminator length: %s\n" % ter)
+                current = (ver, ter, None)
+            if mid != current[2] :
+                descfile.write("\t\tLength of the middle part: %s\n" % mid)
+                current = (ver, ter, mid)
+            descfile.write("\t\t\tCentral frequency: %s  --> %s \n" % (values['center_frequency'], dirName))
+
+def write_crawlers(pattFileName, dirNames, plot) :
+    # the scripts submitting the jobs and running the plot scripts of all directories
+    stamp = datetime.now().strftime("%Y/%m/%d %H:%M")
+    with open("crawl_" + pattFileName + ".sh", "w") as outfile :
+        outfile.write("#!/bin/bash \n")
+        outfile.write("# Generated %s with %s as the pattern \n \n" % (stamp, pattFileName))
+        for dirName in dirNames :
+            outfile.write("cd %s \n" % dirName)
+            outfile.write("chmod a+x %s \n" % RUN_FILE_NAME)
+            outfile.write("qsub %s \n" % RUN_FILE_NAME)
+            outfile.write("cd .. \n")
+    if not plot :
+        return
+    with open("crawl_plot_" + pattFileName + ".sh", "w") as plotfile :
+        plotfile.write("#!/bin/bash \n")
+        plotfile.write("# Generated %s with %s as the pattern \n \n" % (stamp, pattFileName))
+        for dirName in dirNames :
+            plotfile.write("cd %s \n" % dirName)
+            plotfile.write("chmod a+x %s \n" % PLOT_FILE_NAME)
+            plotfile.write("#./%s \n" % PLOT_FILE_NAME)
+            plotfile.write("cd .. \n")
+
+def run_sweep(pattFileName, points, runFilePatt, plotFilePatt = None, rcFileName = None, 
+              processes = None, tools = SCRIPT_PATH, shared = SHARED_DIR, **options) :
+    # translates the points of the sweep by the pool of processes, the points of every 
+    # structure by one process. Returns the list of failed directories
+    import multiprocessing
+    
+    with open(pattFileName, "r") as f :
+        pattern = yaml.load(f, Loader = gentri3.YAMLLoader)
+    missing = parameters(pattern) - set(points[0][1].keys()) if len(points) > 0 else set()
+    if len(missing) > 0 :
+        sys.exit("The parameters of the pattern are not defined: %s" % ", ".join(sorted(missing)))
+    
+    scripts = []
+    for fileName, patt, control in ((RUN_FILE_NAME, runFilePatt, "%s.%s"), (PLOT_FILE_NAME, plotFilePatt, "%s%s")) :
+        if patt != None and os.path.isfile(patt) :
+            with open(patt, "r") as f :
+                scripts.append((fileName, f.read(), control))
+    
+    rcData = gentri3.genResource(rcFileName)
+    if not rcData.isValid :
+        sys.exit("Fatal error: The resource file is corrupted!")
+    
+    structures = {}
+    for dirName, values in points :
+        key = (values['vertical_spacing'], values['terminator_length'], values['middle_length'])
+        structures.setdefault(key, []).append((dirName, values))
+    
+    failed = []
+    pool = multiprocessing.Pool(processes, initializer = init_sweep, 
+                                initargs = ((pattern, scripts, tools, rcData, dict(options, shared = shared)),))
+    try :
+        for res in pool.imap_unordered(translate_structure, list(structures.values())) :
+            for dirName, diagnostics in res :
+                if len(diagnostics['errors']) > 0 or not 'ctl_file' in diagnostics :
+                    failed.append(dirName)
+                    print("FAILED %s: %s" % (dirName, "; ".join(str(error[1]) for error in diagnostics['errors'])))
+                else :
+                    print("ok %s" % diagnostics['ctl_file'])
+    finally :
+        pool.close()
+        pool.join()
+    print("Translated %s of %s points, %s structures" % (len(points) - len(failed), len(points), len(structures)))
+    return failed
+
+if __name__ == "__main__" :
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vert', default = '5', help = 'Range of vertical spacings')
+    parser.add_argument('--term', default = '2', help = 'Range of terminator lengts')
+    parser.add_argument('--middle', default = '1', help = 'Range of lengts of middle parts')
+    parser.add_argument('--freq', default = '0.025:0.025:0.4', help = 'Range of frequencies')
+    
+    # we need to be more precise with the width when a continuous source is provided
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--continuous', action = 'store_true')
+    group.add_argument('--pulse', action = 'store_false')
+    
+    parser.add_argument('-r', default = None, help = 'The resource file')
+    parser.add_argument('-j', type = int, default = None, 
+                        help = 'The number of processes (default: the number of CPUs)')
+    parser.add_argument('--run', default = None, metavar = 'PATT', 
+                        help = 'The pattern of the job script (default: pass.sh.patt here or in bulk/)')
+    parser.add_argument('--plot', default = 'plot.sh.patt', metavar = 'PATT', 
+                        help = 'The pattern of the plot script (skipped if missing)')
+    parser.add_argument('--tools', default = SCRIPT_PATH, metavar = 'DIR', 
+                        help = 'Where the job scripts find simcache.py and h5stride.py (default: %(default)s)')
+    parser.add_argument('--shared-geometry', default = SHARED_DIR, metavar = 'DIR', 
+                        help = 'The geometry shared by the points of the same structure (default: %(default)s)')
+    parser.add_argument('patt_file', help = 'Name of the pattern file')
+    args = parser.parse_args()
+
+    vert = process(args.vert)
+    term = process(args.term)
+    middle = process(args.middle)
+    cent = process(args.freq)
+    type = 'continuous' if args.continuous else 'pulse'
+
+    print("Sweep of the following parameters")
+    print("Vertical spacing: %s" % vert)
+    print("Length of terminators: %s" % term)
+    print("Length of the middle part: %s" % middle)
+    print("Range of frequencies: %s" % cent)
+    print("with a %s source" % type)
+
+    runFilePatt = args.run
+    if runFilePatt == None :
+        runFilePatt = "pass.sh.patt" if os.path.isfile("pass.sh.patt") \
+            else os.path.join(SCRIPT_PATH, "bulk", "pass.sh.patt")
+
+    pattFileName = os.path.basename(args.patt_file)
+    points = sweep_points(vert, term, middle, cent, args.continuous, pattFileName)
+    write_description(pattFileName, type, vert, term, middle, cent, points)
+    failed = run_sweep(args.patt_file, points, runFilePatt, args.plot, args.r, args.j, 
+                       os.path.abspath(args.tools), args.shared_geometry)
+    write_crawlers(pattFileName, [dirName for dirName, values in points], os.path.isfile(args.plot))
+    sys.exit(1 if len(failed) > 0 else 0)
@@ -0,0 +1,5 @@
+# The scripts of the repository are modules at its top level
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
@@ -0,0 +1,25 @@
+# The synthetic configurations of benchtri3.py follow the collectors of gen.ini.canonical
+import os
+import sys
+import subprocess
+
+import pytest
+
+import benchtri3
+import gentri3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+@pytest.mark.parametrize('suite', benchtri3.SUITES)
+def test_generate(suite, tmp_path) :
+    iniFileName = str(tmp_path / ("%s.ini" % suite))
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'benchtri3.py'), 'generate', suite, '10', iniFileName])
+    text, diagnostics = gentri3.translate(iniFileName, os.path.join(ROOT, 'gen.rc'), write = False)
+    assert text != None, diagnostics['errors']
+
+def test_collectors_are_moved() :
+    config = benchtri3.synthetic_config('lines', 4)
+    refs = [value['position']['ref'] for kind in ('spectral', 'temporal')
+            for obs in config['Collectors'][kind] for value in obs.values()
+            if isinstance(value, dict) and 'position' in value]
+    assert refs and set(refs) == {'l1-1'}
@@ -0,0 +1,114 @@
+# The expansion of lines into blocks (gentri3.blockTable)
+import numpy as np
+
+import gentri3
+
+def make_line(length, period, groove, skip = 0.0) :
+    property = {'width' : 0.5, 'padding' : 1.0, 'elevation' : 0.0,
+                'grooves' : {'period' : period, 'width' : groove, 'depth' : 0.2},
+                'materials' : {'up' : {'medium' : 'metal', 'epsilon' : 1, 'conductivity' : 1e6},
+                               'in' : {'medium' : 'dielectric', 'epsilon' : 2},
+                               'down' : {'medium' : 'metal', 'epsilon' : 1, 'conductivity' : 1e6}}}
+    line = gentri3.lineElement('line', 'l', None, property,
+                               gentri3.elementPoint(0.0, 0.0, skip), gentri3.elementPoint(length, 0.0))
+    line.weak_space_up = line.weak_space_down = 1.45
+    return line
+
+def loop_parts(line) :
+    # the parts of the line (ends and whether they're grooves) as the period-by-period
+    # loop of the original translator cut them
+    x1 = line.start.x
+    length_rest = np.sqrt((line.end.x - x1)**2 + (line.end.y - line.start.y)**2)
+    period = float(line.property['grooves']['period'])
+    len_groove = line.property['grooves']['width']
+    len_flat = period - len_groove
+    parts = []
+    def add(length, groove) :
+        parts.append((x1, x1 + length, groove))
+        return x1 + length
+    
+    len_start_left = period*(1 - line.start.skip)
+    len_start_flat_left = len_start_left - len_groove
+    if len_start_flat_left > 0 :
+        if length_rest < len_start_flat_left :
+            add(length_rest, False)
+            return parts
+        x1 = add(len_start_flat_left, False)
+        len_start_left -= len_start_flat_left
+        length_rest -= len_start_flat_left
+    if length_rest < len_start_left :
+        add(length_rest, True)
+        return parts
+    x1 = add(len_start_left, True)
+    length_rest -= len_start_left
+    for part in range(int(length_rest/period)) :
+        x1 = add(len_flat, False)
+        x1 = add(len_groove, True)
+        length_rest -= period
+    if length_rest > len_flat :
+        x1 = add(len_flat, False)
+        add(length_rest - len_flat, True)
+    else :
+        add(length_rest, False)
+    return parts
+
+def expected_table(line) :
+    parts = loop_parts(line)
+    blocks = gentri3.blockTable()
+    blocks.addParts(line, np.array([part[0] for part in parts]), np.array([part[1] for part in parts]), 
+                    np.array([part[2] for part in parts]))
+    return blocks.getTable()
+
+def test_long_line_tail() :
+    # 18357 periods, the remainder is a hair below the flat part when the periods are
+    # subtracted one by one and above it when they're subtracted at once
+    line = make_line(5507.61, 0.3, 0.09)
+    blocks = gentri3.blockTable()
+    blocks.addLine(line)
+    expected = expected_table(line)
+    assert len(loop_parts(line)) > 2*10**4
+    assert blocks.getTable().tobytes() == expected.tobytes()
+
+def test_lines_as_the_loop() :
+    for length, period, groove, skip in ((0.1, 1.0, 0.3, 0.0), (0.9, 1.0, 0.3, 0.5), 
+                                         (10.35, 1.0, 0.3, 0.25), (3000.07, 0.7, 0.35, 0.0)) :
+        line = make_line(length, period, groove, skip)
+        blocks = gentri3.blockTable()
+        blocks.addLine(line)
+        assert blocks.getTable().tobytes() == expected_table(line).tobytes()
+
+def painted(blocks, xL, xR, yB, yT, resolution, zCell = None) :
+    # the epsilon of the cell painted block by block, later blocks over the earlier ones
+    table = blocks.getTable()
+    def pixels(left, right, start, end) :
+        num = max(int(round((end - start)*resolution)), 1)
+        centers = start + (np.arange(num) + 0.5)/resolution
+        return (centers >= left) & (centers < right)
+    background = blocks.addMaterial({'medium': 'dielectric', 'epsilon': 1})
+    nx, ny = len(pixels(0, 0, xL, xR)), len(pixels(0, 0, yB, yT))
+    shape = (nx, ny) if zCell == None else (nx, ny, len(pixels(0, 0, -zCell, zCell)))
+    image = np.full(shape, background)
+    for row in table :
+        mask = pixels(row['centX'] - row['sizeX']/2.0, row['centX'] + row['sizeX']/2.0, xL, xR)[:, None] & \
+            pixels(row['centY'] - row['sizeY']/2.0, row['centY'] + row['sizeY']/2.0, yB, yT)[None, :]
+        if zCell != None :
+            zB, zT = sorted((row['zB'], row['zT']))
+            if zT - zB < gentri3.Tolerance :
+                zB, zT = -zCell, zCell
+            mask = mask[:, :, None] & pixels(zB, zT, -zCell, zCell)[None, None, :]
+        image[mask] = row['material']
+    return np.array([float(medium['epsilon']) for medium in blocks.materials])[image]
+
+def test_rasterize_as_painted() :
+    # overlapping blocks of several materials on a grid not aligned with their edges
+    random = np.random.RandomState(3)
+    for zCell in (None, 2.0) :
+        blocks = gentri3.blockTable()
+        materials = [{'medium' : 'dielectric', 'epsilon' : eps} for eps in (2, 3, 5)]
+        x, y = random.uniform(-10, 8, 300), random.uniform(-5, 4, 300)
+        z = random.uniform(-2, 2, 300)
+        blocks.addBlocks(random.randint(0, 3, 300), x, x + random.uniform(0, 4, 300), 
+                         y, y + random.uniform(0, 2, 300), z, np.where(random.rand(300) < 0.3, z, z + 1))
+        blocks.materials = materials
+        epsilon, conductivity = blocks.rasterize(-10, 10, -5, 5, 3.7, zCell)
+        assert np.array_equal(epsilon, painted(blocks, -10, 10, -5, 5, 3.7, zCell))
@@ -0,0 +1,27 @@
+# Misplaced sources and collectors fail the translation unless they're asked to be warnings
+import os
+
+import yaml
+
+import gentri3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def source_in_metal() :
+    with open(os.path.join(ROOT, 'gen.ini.canonical'), "r") as f :
+        config = yaml.load(f, Loader = gentri3.YAMLLoader)
+    config['Controls'].pop('check_placement', None)
+    config['Sources'][0]['source']['position']['y'] = 1.2
+    return config
+
+def test_errors_by_default() :
+    text, diagnostics = gentri3.translate(source_in_metal(), os.path.join(ROOT, 'gen.rc'), iniFileName = 'bad.ini')
+    assert text == None
+    assert any('inside metal' in str(error[1]) for error in diagnostics['errors'])
+
+def test_warnings_on_request() :
+    config = source_in_metal()
+    config['Controls']['check_placement'] = 'warn'
+    text, diagnostics = gentri3.translate(config, os.path.join(ROOT, 'gen.rc'), iniFileName = 'bad.ini')
+    assert text != None
+    assert any('inside metal' in str(warning[1]) for warning in diagnostics['warnings'])
@@ -0,0 +1,40 @@
+# The tight cell (Geometry.tight_cell) keeps PML off the structure
+import os
+import re
+
+import pytest
+import yaml
+
+import gentri3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def canonical() :
+    with open(os.path.join(ROOT, 'gen.ini.canonical'), "r") as f :
+        return yaml.load(f, Loader = gentri3.YAMLLoader)
+
+def number(text) :
+    return float('inf') if text == 'infinity' else float(text)
+
+@pytest.mark.parametrize('zSize', [None, 2])
+def test_pml_misses_blocks(zSize) :
+    config = canonical()
+    if zSize != None :
+        config['Geometry']['Z_direction']['size'] = zSize
+    rcData = gentri3.genResource(os.path.join(ROOT, 'gen.rc'))
+    text, diagnostics = gentri3.translate(config, rcData, iniFileName = 'tight.ini', tight = True)
+    assert text != None, diagnostics['errors']
+    
+    pml = float(rcData.getSection('Code')['pml_thickness'])
+    cell = re.search(r'\(make lattice \(size (\S+) (\S+) (\S+)\)', text).groups()
+    halves = [number(size)/2.0 - pml for size in cell[:2]] + \
+        [float('inf') if zSize == None else number(cell[2])/2.0 - pml]
+    blocks = re.findall(r'\(make block\s*\(center ([^)]*)\) \(size ([^)]*)\)', text)
+    assert len(blocks) > 0
+    for center, size in blocks :
+        center = [float(value) for value in center.split()] + [0.0]
+        for axis, (value, extent) in enumerate(zip(center, size.split())) :
+            if extent == 'infinity' :
+                assert zSize == None and axis == 2
+                continue
+            assert abs(value) + number(extent)/2.0 <= halves[axis] + gentri3.Tolerance, (center, size)
@@ -0,0 +1,70 @@
+# The watcher translates the edited files as gentri3.translate does, laying out again only what is changed
+import os
+import re
+import sys
+import shutil
+import subprocess
+
+import gentri3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+RC = os.path.join(ROOT, 'gen.rc')
+
+def code(text) :
+    # the comments carry the date and the time
+    return [line for line in text.splitlines() if not line.startswith(';')]
+
+def edit(iniFileName, pattern, repl, num, section = None) :
+    # replaces the num-th match of the pattern (in the top-level section)
+    with open(iniFileName) as f :
+        text = f.read()
+    start, end = 0, len(text)
+    if section != None :
+        start = text.index('\n%s:' % section) + 1
+        nextSection = re.compile(r'^\w', re.M).search(text, start + 1)
+        end = nextSection.start() if nextSection else end
+    match = list(re.compile(pattern, re.M).finditer(text, start, end))[num]
+    with open(iniFileName, 'w') as f :
+        f.write(text[:match.start()] + match.expand(repl) + text[match.end():])
+
+def check(watcher) :
+    assert watcher.translate()
+    with open(watcher.iniFileName + '.ctl') as f :
+        watched = code(f.read())
+    text, diagnostics = gentri3.translate(watcher.iniFileName, RC)
+    assert text != None, diagnostics['errors']
+    assert watched == code(text)
+
+def test_watch_overlap(tmp_path, monkeypatch) :
+    monkeypatch.chdir(tmp_path)
+    iniFileName = str(tmp_path / 'overlap.ini')
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'benchtri3.py'), 'generate', 'overlap', '20', iniFileName])
+    watcher = gentri3.ctlWatcher(iniFileName, RC)
+    check(watcher)
+    elements = watcher.data['Geometry']['elements']
+    # one element is moved
+    edit(iniFileName, r'^( +y: )(-?[0-9.]+)$', r'\g<1>0.25', 10, 'Geometry')
+    check(watcher)
+    layout = watcher.layout
+    assert 0 < layout.numLaid < layout.numElements
+    assert layout.numSettled < layout.numLines
+    kept = [a is b for a, b in zip(elements, watcher.data['Geometry']['elements'])]
+    assert kept.count(False) == 1
+    # the sources don't touch the layout
+    edit(iniFileName, r'^( +x: )(-?[0-9.]+)$', r'\g<1>1.5', 0, 'Sources')
+    check(watcher)
+    assert watcher.layout.numLaid == 0
+
+def test_watch_canonical(tmp_path, monkeypatch) :
+    monkeypatch.chdir(tmp_path)
+    iniFileName = str(tmp_path / 'gen.ini')
+    shutil.copy(os.path.join(ROOT, 'gen.ini.canonical'), iniFileName)
+    watcher = gentri3.ctlWatcher(iniFileName, RC)
+    check(watcher)
+    # the line with id: 1 is referred to by the next ones
+    edit(iniFileName, r'^( +y: )(3\.0)$', r'\g<1>2.5', 0, 'Geometry')
+    check(watcher)
+    assert watcher.layout.numLaid > 1
+    # the whole file is parsed again
+    edit(iniFileName, r'^( +overshot: )1', r'\g<1>2', 0, 'Geometry')
+    check(watcher)